@@ -39,6 +39,7 @@ setup(
             "cleanup = taca.cleanup.cli:cleanup",
             "analysis = taca.analysis.cli:analysis",
             "bioinfo_deliveries = taca.utils.cli:bioinfo_deliveries",
+            "ledger = taca.utils.cli:ledger",
             "server_status = taca.server_status.cli:server_status",
             "backup = taca.backup.cli:backup",
             "create_env = taca.testing.cli:uppmax_env",
@@ -5,16 +5,30 @@ import logging
 import os
 import subprocess
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from shutil import copyfile, copytree
 
-from flowcell_parser.classes import RunParametersParser
-
+from taca.illumina import parsed
+from taca.illumina.catalog import DEFAULT_SKIP_STATUSES, RunCatalog, run_fingerprint
+from taca.illumina.demux_executor import BatchExecutor
+from taca.illumina.demux_queue import DemuxScheduler
+from taca.illumina.instrument import detect_instrument, run_parameters_file
+from taca.illumina.interop import (
+    LIVE_METRICS_DIR,
+    forget_live_metrics,
+    read_live_metrics,
+)
+from taca.illumina.lane_reports import json_twin
 from taca.illumina.MiSeq_Runs import MiSeq_Run
 from taca.illumina.NextSeq_Runs import NextSeq_Run
 from taca.illumina.NovaSeq_Runs import NovaSeq_Run
 from taca.illumina.NovaSeqXPlus_Runs import NovaSeqXPlus_Run
+from taca.illumina.watcher import RunWatcher
+from taca.log import init_logger_file
 from taca.utils import statusdb
 from taca.utils.config import CONFIG
+from taca.utils.filesystem import lock_file
 from taca.utils.transfer import RsyncAgent
 
 logger = logging.getLogger(__name__)
@@ -23,69 +37,33 @@ logger = logging.getLogger(__name__)
 def get_runObj(
     run: os.PathLike, software: str
 ) -> MiSeq_Run | NextSeq_Run | NovaSeq_Run | NovaSeqXPlus_Run | None:
-    """Tries to read runParameters.xml to parse the type of sequencer
+    """Detects the type of sequencer, see taca.illumina.instrument,
     and then return the respective Run object (MiSeq, HiSeq..)
     """
 
-    if os.path.exists(os.path.join(run, "runParameters.xml")):
-        run_parameters_file = "runParameters.xml"
-    elif os.path.exists(os.path.join(run, "RunParameters.xml")):
-        run_parameters_file = "RunParameters.xml"
-    else:
+    if run_parameters_file(run) is None:
         logger.error(
             f"Cannot find RunParameters.xml or runParameters.xml in the run folder for run {run}"
         )
         return None
 
-    run_parameters_path = os.path.join(run, run_parameters_file)
-    try:
-        run_parameters = RunParametersParser(run_parameters_path)
-    except OSError:
-        logger.warn(
-            f"Problems parsing the runParameters.xml file at {run_parameters_path}. "
-            f"This is quite unexpected. please archive the run {run} manually"
-        )
+    _configure_parsed_cache()
+    # From the run folder name, or else streamed from runParameters.xml
+    runtype = detect_instrument(run)
+    if "MiSeq" in runtype:
+        return MiSeq_Run(run, software, CONFIG["analysis"]["MiSeq"])
+    elif "NextSeq" in runtype:
+        return NextSeq_Run(run, software, CONFIG["analysis"]["NextSeq"])
+    elif "NovaSeqXPlus" in runtype:
+        return NovaSeqXPlus_Run(run, software, CONFIG["analysis"]["NovaSeqXPlus"])
+    elif "NovaSeq" in runtype:
+        return NovaSeq_Run(run, software, CONFIG["analysis"]["NovaSeq"])
     else:
-        # Do a case by case test because there are so many version of RunParameters that there is no real other way
-        runtype = run_parameters.data["RunParameters"].get(
-            "InstrumentType",
-            run_parameters.data["RunParameters"].get(
-                "ApplicationName",
-                run_parameters.data["RunParameters"].get("Application", ""),
-            ),
+        logger.warn(
+            f"Unrecognized run type {runtype}, cannot archive the run {run}. "
+            "Someone as likely bought a new sequencer without telling "
+            "it to the bioinfo team"
         )
-        if "Setup" in run_parameters.data["RunParameters"]:
-            # This is the HiSeq2500, MiSeq, and HiSeqX case
-            try:
-                # Works for recent control software
-                runtype = run_parameters.data["RunParameters"]["Setup"]["Flowcell"]
-            except KeyError:
-                # Use this as second resource but print a warning in the logs
-                logger.warn(
-                    "Parsing runParameters to fecth instrument type, "
-                    "not found Flowcell information in it. Using ApplicationName"
-                )
-                # Here makes sense to use get with default value '' ->
-                # so that it doesn't raise an exception in the next lines
-                # (in case ApplicationName is not found, get returns None)
-                runtype = run_parameters.data["RunParameters"]["Setup"].get(
-                    "ApplicationName", ""
-                )
-
-        if "MiSeq" in runtype:
-            return MiSeq_Run(run, software, CONFIG["analysis"]["MiSeq"])
-        elif "NextSeq" in runtype:
-            return NextSeq_Run(run, software, CONFIG["analysis"]["NextSeq"])
-        elif "NovaSeqXPlus" in runtype:
-            return NovaSeqXPlus_Run(run, software, CONFIG["analysis"]["NovaSeqXPlus"])
-        elif "NovaSeq" in runtype:
-            return NovaSeq_Run(run, software, CONFIG["analysis"]["NovaSeq"])
-        else:
-            logger.warn(
-                f"Unrecognized run type {runtype}, cannot archive the run {run}. "
-                "Someone as likely bought a new sequencer without telling "
-                "it to the bioinfo team"
-            )
     return None
 
 
@@ -103,15 +81,20 @@ def upload_to_statusdb(run_dir, software):
         _upload_to_statusdb(runObj)
 
 
-def _upload_to_statusdb(run):
+def _upload_to_statusdb(run, live_metrics=None):
     """Triggers the upload to statusdb using the dependency flowcell_parser.
 
     :param Run run: the object run
+    :param dict live_metrics: Metrics per lane of a run still sequencing, from
+        taca.illumina.interop, uploaded as the live_metrics section
     """
     couch_conf = CONFIG["statusdb"]
     couch_connection = statusdb.StatusdbSession(couch_conf).connection
     db = couch_connection[couch_conf["xten_db"]]
+    run.prepare_samplesheet()
     parser = run.runParserObj
+    if not parser.obj.get("samplesheet_csv") and parser.samplesheet is not None:
+        parser.obj["samplesheet_csv"] = parser.samplesheet.data
     # Check if I have NoIndex lanes
     for element in parser.obj["samplesheet_csv"]:
         if "NoIndex" in element.get("index", "") or not element.get(
@@ -155,6 +138,8 @@ def _upload_to_statusdb(run):
         parser.obj["DemultiplexConfig"] = {
             "Setup": {"Software": run.CONFIG.get("bcl2fastq", {})}
         }
+    if live_metrics is not None:
+        parser.obj["live_metrics"] = live_metrics
     statusdb.update_doc(db, parser.obj, over_write_db_entry=True)
 
 
@@ -302,6 +287,38 @@ def transfer_runfolder(run_dir, pid, exclude_lane):
     return
 
 
+def redemultiplex_run(run_dir, software):
+    """Demultiplex again only the lanes of a run whose samplesheet changed.
+
+    The results are aggregated again by the next demultiplex or watch cycle,
+    once the new sub-demultiplexings are done.
+
+    :param str run_dir: Path to the run folder
+    :param str software: Demultiplexing software, bcl2fastq or bclconvert
+    """
+    run_id = os.path.basename(os.path.normpath(run_dir))
+    lock_path = os.path.join(
+        CONFIG["analysis"]["status_dir"], "locks", f"{run_id}.lock"
+    )
+    with lock_file(lock_path) as locked:
+        if not locked:
+            raise RuntimeError(f"Run {run_id} is locked by another TACA process")
+        runObj = get_runObj(run_dir, software)
+        if not runObj:
+            raise RuntimeError(
+                f"Unrecognized instrument type or incorrect run folder {run_dir}"
+            )
+        runObj.demux_scheduler = _get_demux_scheduler()
+        runObj.demux_executor = _get_demux_executor()
+        transfer_file = os.path.join(CONFIG["analysis"]["status_dir"], "transfer.tsv")
+        if runObj.is_transferred(transfer_file):
+            logger.warning(
+                f"Run {run_id} has already been transferred, it has to be "
+                "removed from the transfer file to be transferred again"
+            )
+        runObj.redemultiplex()
+
+
 def extract_project_samplesheet(sample_sheet, pid_list):
     header_line = "[Data]\n"
     project_entries = ""
@@ -317,204 +334,376 @@ def extract_project_samplesheet(sample_sheet, pid_list):
     return new_samplesheet_content
 
 
-def run_preprocessing(run, software):
-    """Run demultiplexing in all data directories.
+def _process(run):
+    """Process a run/flowcell and transfer to analysis server.
 
-    :param str run: Process a particular run instead of looking for runs
+    :param taca.illumina.Run run: Run to be processed and transferred
+    :returns: The status of the run once processed, or None if it was archived
     """
-
-    def _process(run):
-        """Process a run/flowcell and transfer to analysis server.
-
-        :param taca.illumina.Run run: Run to be processed and transferred
-        """
-        logger.info(f"Checking run {run.id}")
-        transfer_file = os.path.join(CONFIG["analysis"]["status_dir"], "transfer.tsv")
-        if run.is_transferred(
-            transfer_file
-        ):  # Transfer is ongoing or finished. Do nothing. Sometimes caused by runs that are copied back from NAS after a reboot
-            logger.info(
-                f"Run {run.id} already transferred to analysis server, skipping it"
+    logger.info(f"Checking run {run.id}")
+    transfer_file = os.path.join(CONFIG["analysis"]["status_dir"], "transfer.tsv")
+    if run.is_transferred(
+        transfer_file
+    ):  # Transfer is ongoing or finished. Do nothing. Sometimes caused by runs that are copied back from NAS after a reboot
+        logger.info(f"Run {run.id} already transferred to analysis server, skipping it")
+        return "TRANSFERRED"
+
+    # Statuses are read from a snapshot of the run folder, taken once here and
+    # refreshed only after the actions below that change it
+    run.refresh_snapshot()
+    status = run.get_run_status()
+    live_metrics_dir = os.path.join(CONFIG["analysis"]["status_dir"], LIVE_METRICS_DIR)
+    if status != "SEQUENCING":
+        forget_live_metrics(run.run_dir, live_metrics_dir)
+    if status == "SEQUENCING":
+        logger.info(f"Run {run.id} is not finished yet")
+        if "statusdb" in CONFIG:
+            _upload_to_statusdb(
+                run,
+                live_metrics=read_live_metrics(run.run_dir, live_metrics_dir),
             )
-            return
-
-        if run.get_run_status() == "SEQUENCING":
-            logger.info(f"Run {run.id} is not finished yet")
-            if "statusdb" in CONFIG:
-                _upload_to_statusdb(run)
-        elif run.get_run_status() == "TO_START":
-            if run.get_run_type() == "NON-NGI-RUN":
-                # For now MiSeq specific case. Process only NGI-run, skip all the others (PhD student runs)
-                logger.warn(
-                    f"Run {run.id} marked as {run.get_run_type()}, "
-                    "TACA will skip this and move the run to "
-                    "no-sync directory"
-                )
-                if "storage" in CONFIG:
-                    run.archive_run(
-                        CONFIG["storage"]["archive_dirs"][run.sequencer_type]
-                    )
-                return
-            logger.info(
-                f"Starting BCL to FASTQ conversion and demultiplexing for run {run.id}"
-            )
-            if "statusdb" in CONFIG:
-                _upload_to_statusdb(run)
-            run.demultiplex_run()
-        elif run.get_run_status() == "IN_PROGRESS":
-            logger.info(
-                "BCL conversion and demultiplexing process in "
-                f"progress for run {run.id}, skipping it"
+    elif status == "TO_START":
+        if run.get_run_type() == "NON-NGI-RUN":
+            # For now MiSeq specific case. Process only NGI-run, skip all the others (PhD student runs)
+            logger.warn(
+                f"Run {run.id} marked as {run.get_run_type()}, "
+                "TACA will skip this and move the run to "
+                "no-sync directory"
             )
-            # Upload to statusDB if applies
-            if "statusdb" in CONFIG:
-                _upload_to_statusdb(run)
-            # This function checks if demux is done
-            run.check_run_status()
-
-        # Previous elif might change the status to COMPLETED, therefore to avoid skipping
-        # a cycle take the last if out of the elif
-        if run.get_run_status() == "COMPLETED":
-            run.check_run_status()
-            logger.info(f"Preprocessing of run {run.id} is finished, transferring it")
-            # Upload to statusDB if applies
-            if "statusdb" in CONFIG:
-                _upload_to_statusdb(run)
-                demux_summary_message = []
-                for demux_id, demux_log in run.demux_summary.items():
-                    if demux_log["errors"] or demux_log["warnings"]:
-                        demux_summary_message.append(
-                            "Sub-Demultiplexing in Demultiplexing_{} completed with {} errors and {} warnings:".format(
-                                demux_id, demux_log["errors"], demux_log["warnings"]
-                            )
+            if "storage" in CONFIG:
+                run.archive_run(CONFIG["storage"]["archive_dirs"][run.sequencer_type])
+            return None
+        logger.info(
+            f"Starting BCL to FASTQ conversion and demultiplexing for run {run.id}"
+        )
+        if "statusdb" in CONFIG:
+            _upload_to_statusdb(run)
+        run.demultiplex_run()
+        run.refresh_snapshot()
+    elif status == "IN_PROGRESS":
+        logger.info(
+            "BCL conversion and demultiplexing process in "
+            f"progress for run {run.id}, skipping it"
+        )
+        # Upload to statusDB if applies
+        if "statusdb" in CONFIG:
+            _upload_to_statusdb(run)
+        # This function checks if demux is done
+        run.check_run_status()
+        run.refresh_snapshot()
+
+    # Previous elif might change the status to COMPLETED, therefore to avoid skipping
+    # a cycle take the last if out of the elif
+    if run.get_run_status() == "COMPLETED":
+        run.check_run_status()
+        run.refresh_snapshot()
+        logger.info(f"Preprocessing of run {run.id} is finished, transferring it")
+        # Upload to statusDB if applies
+        if "statusdb" in CONFIG:
+            _upload_to_statusdb(run)
+            demux_summary_message = []
+            for demux_id, demux_log in run.demux_summary.items():
+                if demux_log["errors"] or demux_log["warnings"]:
+                    demux_summary_message.append(
+                        "Sub-Demultiplexing in Demultiplexing_{} completed with {} errors and {} warnings:".format(
+                            demux_id, demux_log["errors"], demux_log["warnings"]
                         )
+                    )
+                    first_messages = demux_log["error_and_warning_messages"]
+                    demux_summary_message.append("\n".join(first_messages))
+                    # The last messages overlap the first ones in short logs
+                    not_shown = demux_log["error_and_warning_count"] - len(
+                        first_messages
+                    )
+                    last_messages = demux_log["last_error_and_warning_messages"][
+                        len(demux_log["last_error_and_warning_messages"])
+                        - min(not_shown, 5) :
+                    ]
+                    if not_shown > len(last_messages):
                         demux_summary_message.append(
-                            "\n".join(demux_log["error_and_warning_messages"][:5])
+                            f"...... Only the first 5 and last 5 errors or warnings are displayed for Demultiplexing_{demux_id}."
                         )
-                        if len(demux_log["error_and_warning_messages"]) > 5:
-                            demux_summary_message.append(
-                                f"...... Only the first 5 errors or warnings are displayed for Demultiplexing_{demux_id}."
-                            )
-                # Notify with a mail run completion and stats uploaded
-                if demux_summary_message:
-                    sbt = f"{run.id} Demultiplexing Completed with ERRORs or WARNINGS!"
-                    msg = """The run {run} has been demultiplexed with errors or warnings!
+                    if last_messages:
+                        demux_summary_message.append("\n".join(last_messages))
+            # Notify with a mail run completion and stats uploaded
+            if demux_summary_message:
+                sbt = f"{run.id} Demultiplexing Completed with ERRORs or WARNINGS!"
+                msg = """The run {run} has been demultiplexed with errors or warnings!
 
-                    {errors_warnings}
+                {errors_warnings}
 
-                    The Run will be transferred to the analysis cluster for further analysis.
+                The Run will be transferred to the analysis cluster for further analysis.
 
-                    The run is available at : https://genomics-status.scilifelab.se/flowcells/{run}
+                The run is available at : https://genomics-status.scilifelab.se/flowcells/{run}
 
-                    """.format(
-                        errors_warnings="\n".join(demux_summary_message), run=run.id
-                    )
-                else:
-                    sbt = f"{run.id} Demultiplexing Completed!"
-                    msg = f"""The run {run.id} has been demultiplexed without any error or warning.
+                """.format(errors_warnings="\n".join(demux_summary_message), run=run.id)
+            else:
+                sbt = f"{run.id} Demultiplexing Completed!"
+                msg = f"""The run {run.id} has been demultiplexed without any error or warning.
 
-                    The Run will be transferred to the analysis cluster for further analysis.
+                The Run will be transferred to the analysis cluster for further analysis.
 
-                    The run is available at : https://genomics-status.scilifelab.se/flowcells/{run.id}
+                The run is available at : https://genomics-status.scilifelab.se/flowcells/{run.id}
 
-                    """
-                run.send_mail(sbt, msg, rcp=CONFIG["mail"]["recipients"])
+                """
+            run.send_mail(sbt, msg, rcp=CONFIG["mail"]["recipients"])
 
-            # Copy demultiplex stats file, InterOp meta data and run xml files to shared file system for LIMS purpose
-            if "mfs_path" in CONFIG["analysis"]:
-                try:
-                    mfs_dest = os.path.join(
-                        CONFIG["analysis"]["mfs_path"][run.sequencer_type.lower()],
-                        run.id,
-                    )
-                    logger.info(
-                        f"Copying demultiplex stats, InterOp metadata and XML files for run {run.id} to {mfs_dest}"
-                    )
-                    if not os.path.exists(mfs_dest):
-                        os.mkdir(mfs_dest)
-                    demulti_stat_src = os.path.join(
-                        run.run_dir,
-                        run.demux_dir,
-                        "Reports",
-                        "html",
-                        run.flowcell_id,
-                        "all",
-                        "all",
-                        "all",
-                        "laneBarcode.html",
-                    )
+        # Copy demultiplex stats file, InterOp meta data and run xml files to shared file system for LIMS purpose
+        if "mfs_path" in CONFIG["analysis"]:
+            try:
+                mfs_dest = os.path.join(
+                    CONFIG["analysis"]["mfs_path"][run.sequencer_type.lower()],
+                    run.id,
+                )
+                logger.info(
+                    f"Copying demultiplex stats, InterOp metadata and XML files for run {run.id} to {mfs_dest}"
+                )
+                if not os.path.exists(mfs_dest):
+                    os.mkdir(mfs_dest)
+                demulti_stat_src = os.path.join(
+                    run.run_dir,
+                    run.demux_dir,
+                    "Reports",
+                    "html",
+                    run.flowcell_id,
+                    "all",
+                    "all",
+                    "all",
+                    "laneBarcode.html",
+                )
+                copyfile(demulti_stat_src, os.path.join(mfs_dest, "laneBarcode.html"))
+                # Copy the JSON version of laneBarcode.html, if generated
+                demulti_stat_json_src = json_twin(demulti_stat_src)
+                if os.path.isfile(demulti_stat_json_src):
                     copyfile(
-                        demulti_stat_src, os.path.join(mfs_dest, "laneBarcode.html")
+                        demulti_stat_json_src,
+                        os.path.join(mfs_dest, "laneBarcode.json"),
                     )
-                    # Copy RunInfo.xml
-                    run_info_xml_src = os.path.join(run.run_dir, "RunInfo.xml")
-                    if os.path.isfile(run_info_xml_src):
-                        copyfile(
-                            run_info_xml_src, os.path.join(mfs_dest, "RunInfo.xml")
-                        )
-                    # Copy RunParameters.xml
-                    run_parameters_xml_src = os.path.join(
-                        run.run_dir, "RunParameters.xml"
+                # Copy RunInfo.xml
+                run_info_xml_src = os.path.join(run.run_dir, "RunInfo.xml")
+                if os.path.isfile(run_info_xml_src):
+                    copyfile(run_info_xml_src, os.path.join(mfs_dest, "RunInfo.xml"))
+                # Copy RunParameters.xml
+                run_parameters_xml_src = os.path.join(run.run_dir, "RunParameters.xml")
+                if os.path.isfile(run_info_xml_src):
+                    copyfile(
+                        run_parameters_xml_src,
+                        os.path.join(mfs_dest, "RunParameters.xml"),
                     )
-                    if os.path.isfile(run_info_xml_src):
-                        copyfile(
-                            run_parameters_xml_src,
-                            os.path.join(mfs_dest, "RunParameters.xml"),
-                        )
-                    # Copy InterOp
-                    interop_src = os.path.join(run.run_dir, "InterOp")
-                    if os.path.exists(interop_src):
-                        copytree(
-                            interop_src,
-                            os.path.join(mfs_dest, "InterOp"),
-                            dirs_exist_ok=True,
-                        )
-                except:
-                    logger.warn(
-                        f"Could not copy demultiplex stats, InterOp metadata or XML files for run {run.id}"
+                # Copy InterOp
+                interop_src = os.path.join(run.run_dir, "InterOp")
+                if os.path.exists(interop_src):
+                    copytree(
+                        interop_src,
+                        os.path.join(mfs_dest, "InterOp"),
+                        dirs_exist_ok=True,
                     )
+            except:
+                logger.warn(
+                    f"Could not copy demultiplex stats, InterOp metadata or XML files for run {run.id}"
+                )
 
-            # Transfer to analysis server if flag is True
-            if run.transfer_to_analysis_server:
-                mail_recipients = CONFIG.get("mail", {}).get("recipients")
-                logger.info(
-                    "Transferring run {} to {} into {}".format(
-                        run.id,
-                        run.CONFIG["analysis_server"]["host"],
-                        run.CONFIG["analysis_server"]["sync"]["data_archive"],
-                    )
+        # Transfer to analysis server if flag is True
+        if run.transfer_to_analysis_server:
+            mail_recipients = CONFIG.get("mail", {}).get("recipients")
+            logger.info(
+                "Transferring run {} to {} into {}".format(
+                    run.id,
+                    run.CONFIG["analysis_server"]["host"],
+                    run.CONFIG["analysis_server"]["sync"]["data_archive"],
                 )
-                run.transfer_run(transfer_file, mail_recipients)
+            )
+            run.transfer_run(transfer_file, mail_recipients)
 
-            # Archive the run if indicated in the config file
-            if "storage" in CONFIG:  # TODO: make sure archiving to PDC is not ongoing
-                run.archive_run(CONFIG["storage"]["archive_dirs"][run.sequencer_type])
+        # Archive the run if indicated in the config file
+        if "storage" in CONFIG:  # TODO: make sure archiving to PDC is not ongoing
+            run.archive_run(CONFIG["storage"]["archive_dirs"][run.sequencer_type])
+        run.refresh_snapshot()
 
-    if run:
-        # Determine the run type
-        runObj = get_runObj(run, software)
+    return run.get_run_status()
+
+
+def _process_run_dir(run_dir, software, strict=False):
+    """Instantiate and process a single run folder while holding its lock.
+
+    The lock file lives in the status_dir so that overlapping invocations of
+    TACA (e.g. cron ticks that outlast the interval) never work on the same run.
+
+    :param str run_dir: Path to the run folder
+    :param str software: Demultiplexing software, bcl2fastq or bclconvert
+    :param bool strict: Raise instead of warning if the run is not recognized
+    """
+    run_id = os.path.basename(os.path.normpath(run_dir))
+    lock_path = os.path.join(
+        CONFIG["analysis"]["status_dir"], "locks", f"{run_id}.lock"
+    )
+    with lock_file(lock_path) as locked:
+        if not locked:
+            logger.info(f"Run {run_id} is locked by another TACA process, skipping it")
+            return
+        start_time = time.monotonic()
+        catalog = _get_run_catalog()
+        demux_scheduler = _get_demux_scheduler()
+        if catalog and not strict:
+            skip_statuses = (CONFIG["analysis"]["run_catalog"] or {}).get(
+                "skip_statuses", DEFAULT_SKIP_STATUSES
+            )
+            # Runs with queued jobs are checked every time to get them started
+            if catalog.is_unchanged(
+                run_id, run_fingerprint(run_dir), skip_statuses
+            ) and not (demux_scheduler and demux_scheduler.has_pending(run_id)):
+                logger.info(f"Run {run_id} unchanged since last check, skipping it")
+                return
+        runObj = get_runObj(run_dir, software)
         if not runObj:
-            raise RuntimeError(
-                f"Unrecognized instrument type or incorrect run folder {run}"
+            if strict:
+                raise RuntimeError(
+                    f"Unrecognized instrument type or incorrect run folder {run_dir}"
+                )
+            logger.warning(
+                f"Unrecognized instrument type or incorrect run folder {run_dir}"
             )
-        else:
-            _process(runObj)
-    else:
-        data_dirs = CONFIG.get("analysis").get("data_dirs")
-        for data_dir in data_dirs:
-            # Run folder looks like DATE_*_*_*, the last section is the FC name.
-            runs = glob.glob(os.path.join(data_dir, "[1-9]*_*_*_*"))
-            for _run in runs:
-                runObj = get_runObj(_run, software)
-                if not runObj:
+            return
+        runObj.demux_scheduler = demux_scheduler
+        runObj.demux_executor = _get_demux_executor()
+        status = _process(runObj)
+        if catalog:
+            if not os.path.exists(run_dir):
+                # The run has been archived
+                catalog.remove(run_id)
+            elif status:
+                catalog.update(run_id, status, run_fingerprint(run_dir))
+        logger.info(
+            f"Processing of run {run_id} took {time.monotonic() - start_time:.1f}s"
+        )
+
+
+def _get_run_catalog():
+    """Return the RunCatalog configured under analysis/run_catalog, if any."""
+    catalog_config = CONFIG["analysis"].get("run_catalog")
+    if catalog_config is None:
+        return None
+    db_path = (catalog_config or {}).get("db") or os.path.join(
+        CONFIG["analysis"]["status_dir"], "run_catalog.sqlite"
+    )
+    return RunCatalog(db_path)
+
+
+def _get_demux_scheduler():
+    """Return the DemuxScheduler configured under analysis/demux_scheduler, if any."""
+    scheduler_config = CONFIG["analysis"].get("demux_scheduler")
+    if scheduler_config is None:
+        return None
+    scheduler_config = scheduler_config or {}
+    db_path = scheduler_config.get("db") or os.path.join(
+        CONFIG["analysis"]["status_dir"], "demux_queue.sqlite"
+    )
+    return DemuxScheduler(
+        db_path,
+        cpus=scheduler_config.get("cpus", os.cpu_count()),
+        mem_gb=scheduler_config.get("mem_gb", float("inf")),
+        job_cpus=scheduler_config.get("job_cpus", 1),
+        job_mem_gb=scheduler_config.get("job_mem_gb", 0),
+    )
+
+
+def _get_demux_executor():
+    """Return the DemuxExecutor configured under analysis/demux_executor, if any.
+
+    Jobs are started locally, possibly through the demux scheduler, otherwise.
+    """
+    executor_config = CONFIG["analysis"].get("demux_executor")
+    if not executor_config or executor_config.get("type", "local") == "local":
+        return None
+    if executor_config["type"] == "batch":
+        return BatchExecutor(executor_config["submit_command"])
+    raise RuntimeError(f"Unknown demux executor {executor_config['type']}")
+
+
+def _configure_parsed_cache():
+    """Apply the settings under analysis/parsed_cache to the cache of parsers."""
+    cache_config = CONFIG["analysis"].get("parsed_cache") or {}
+    parsed.configure(
+        maxsize=cache_config.get("maxsize", parsed.DEFAULT_MAXSIZE),
+        cache_dir=cache_config.get("dir"),
+    )
+
+
+def _init_worker(config):
+    """Initializer for worker processes: load the configuration and logging."""
+    CONFIG.update(config)
+    log_file = config.get("log", {}).get("file", None)
+    if log_file:
+        init_logger_file(log_file, config["log"].get("log_level", "INFO"))
+
+
+def run_preprocessing(run, software, jobs=1):
+    """Run demultiplexing in all data directories.
+
+    :param str run: Process a particular run instead of looking for runs
+    :param str software: Demultiplexing software, bcl2fastq or bclconvert
+    :param int jobs: Number of runs to process in parallel
+    """
+    if run:
+        _process_run_dir(run, software, strict=True)
+        return
+
+    data_dirs = CONFIG.get("analysis").get("data_dirs")
+    run_dirs = []
+    for data_dir in data_dirs:
+        # Run folder looks like DATE_*_*_*, the last section is the FC name.
+        run_dirs.extend(glob.glob(os.path.join(data_dir, "[1-9]*_*_*_*")))
+
+    start_time = time.monotonic()
+    if jobs > 1 and len(run_dirs) > 1:
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(dict(CONFIG),)
+        ) as executor:
+            futures = {
+                executor.submit(_process_run_dir, _run, software): _run
+                for _run in run_dirs
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    # It is better to continue processing other runs
                     logger.warning(
-                        f"Unrecognized instrument type or incorrect run folder {run}"
+                        f"There was an error processing the run {futures[future]}",
+                        exc_info=True,
                     )
-                else:
-                    try:
-                        _process(runObj)
-                    except:
-                        # This function might throw and exception,
-                        # it is better to continue processing other runs
-                        logger.warning(f"There was an error processing the run {run}")
-                        pass
+    else:
+        for _run in run_dirs:
+            try:
+                _process_run_dir(_run, software)
+            except:
+                # This function might throw and exception,
+                # it is better to continue processing other runs
+                logger.warning(f"There was an error processing the run {_run}")
+                pass
+    logger.info(
+        f"Processed {len(run_dirs)} runs with {jobs} job(s) in "
+        f"{time.monotonic() - start_time:.1f}s"
+    )
+
+
+def watch_runs(software, poll_interval=None):
+    """Process runs as soon as their sentinel files appear, instead of on cron ticks.
+
+    :param str software: Demultiplexing software, bcl2fastq or bclconvert
+    :param int poll_interval: Seconds between sweeps processing all runs, for
+        changes inotify cannot see (e.g. made by other hosts over NFS)
+    """
+    if poll_interval is None:
+        poll_interval = (CONFIG["analysis"].get("watch") or {}).get(
+            "poll_interval", 1800
+        )
+
+    def _dispatch(run_dir):
+        _process_run_dir(run_dir, software)
+
+    watcher = RunWatcher(CONFIG["analysis"]["data_dirs"], _dispatch, poll_interval)
+    try:
+        watcher.run()
+    finally:
+        watcher.close()
@@ -30,9 +30,36 @@ def analysis():
     default="bcl2fastq",
     help="Available software for demultiplexing: bcl2fastq (default), bclconvert",
 )
-def demultiplex(run, software):
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of runs to process in parallel (default 1)",
+)
+def demultiplex(run, software, jobs):
     """Demultiplex and transfer all runs present in the data directories."""
-    an.run_preprocessing(run, software)
+    an.run_preprocessing(run, software, jobs)
+
+
+@analysis.command()
+@click.option(
+    "-s",
+    "--software",
+    type=click.Choice(["bcl2fastq", "bclconvert"]),
+    default="bcl2fastq",
+    help="Available software for demultiplexing: bcl2fastq (default), bclconvert",
+)
+@click.option(
+    "-p",
+    "--poll-interval",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Seconds between sweeps of all runs (default analysis/watch/poll_interval in the config, or 1800)",
+)
+def watch(software, poll_interval):
+    """Demultiplex and transfer runs as soon as sequencing or demultiplexing finishes."""
+    an.watch_runs(software, poll_interval)
 
 
 @analysis.command()
@@ -72,6 +99,20 @@ def updatedb(rundir, software):
     an.upload_to_statusdb(rundir, software)
 
 
+@analysis.command()
+@click.option(
+    "-s",
+    "--software",
+    type=click.Choice(["bcl2fastq", "bclconvert"]),
+    default="bcl2fastq",
+    help="Available software for demultiplexing: bcl2fastq (default), bclconvert",
+)
+@click.argument("rundir", type=click.Path(exists=True))
+def redemultiplex(rundir, software):
+    """Demultiplex again the lanes whose samplesheet changed in LIMS."""
+    an.redemultiplex_run(rundir, software)
+
+
 # Nanopore analysis subcommands
 
 
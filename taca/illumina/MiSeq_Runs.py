@@ -5,13 +5,12 @@ import shutil
 
 from flowcell_parser.classes import SampleSheetParser
 
+from taca.illumina import parsed
+from taca.illumina.index_tables import index_kind
 from taca.illumina.Standard_Runs import Standard_Run
 
 logger = logging.getLogger(__name__)
 
-TENX_SINGLE_PAT = re.compile("SI-(?:GA|NA)-[A-H][1-9][0-2]?")
-TENX_DUAL_PAT = re.compile("SI-(?:TT|NT|NN|TN|TS)-[A-H][1-9][0-2]?")
-SMARTSEQ_PAT = re.compile("SMARTSEQ[1-9]?-[1-9][0-9]?[A-P]")
 IDT_UMI_PAT = re.compile("([ATCG]{4,}N+$)")
 RECIPE_PAT = re.compile("[0-9]+-[0-9]+")
 
@@ -21,7 +20,6 @@ class MiSeq_Run(Standard_Run):
         super().__init__(run_dir, software, configuration)
         self._set_sequencer_type()
         self._set_run_type()
-        self._copy_samplesheet()
 
     def _set_sequencer_type(self):
         self.sequencer_type = "MiSeq"
@@ -59,7 +57,7 @@ class MiSeq_Run(Standard_Run):
             raise RuntimeError
         if ssname is None:
             return None
-        ssparser = SampleSheetParser(ssname)
+        ssparser = parsed.load(SampleSheetParser, ssname)
         self.sample_table = self._classify_samples(indexfile, ssparser, runSetup)
         # Copy the original samplesheet locally.
         # Copy again if already done as there might have been changes to the samplesheet
@@ -98,13 +96,9 @@ class MiSeq_Run(Standard_Run):
         )
         # SampleSheet.csv generated
         # When demultiplexing SampleSheet.csv is the one I need to use
-        self.runParserObj.samplesheet = SampleSheetParser(
-            os.path.join(self.run_dir, "SampleSheet_copy.csv")
+        self.runParserObj.samplesheet = parsed.load(
+            SampleSheetParser, os.path.join(self.run_dir, "SampleSheet_copy.csv")
         )
-        if not self.runParserObj.obj.get("samplesheet_csv"):
-            self.runParserObj.obj["samplesheet_csv"] = (
-                self.runParserObj.samplesheet.data
-            )
 
     def _generate_clean_samplesheet(
         self,
@@ -130,7 +124,7 @@ class MiSeq_Run(Standard_Run):
             if sample["index"] in index_dict_tenX.keys():
                 tenX_index = sample["index"]
                 # In the case of 10X dual indexes, replace index and index2
-                if TENX_DUAL_PAT.findall(tenX_index):
+                if index_dict_tenX.kinds[tenX_index] == "10X_DUAL":
                     sample["index"] = index_dict_tenX[tenX_index][0]
                     sample["index2"] = "".join(
                         reversed(
@@ -153,7 +147,7 @@ class MiSeq_Run(Standard_Run):
                         x += 1
                     # Set the original 10X index to the 4th correct index
                     sample["index"] = index_dict_tenX[tenX_index][x]
-            elif SMARTSEQ_PAT.findall(sample["index"]):
+            elif index_kind(sample["index"], index_dict_tenX) == "SMARTSEQ":
                 x = 0
                 smartseq_index = sample["index"].split("-")[1]
                 indices_number = len(index_dict_smartseq[smartseq_index])
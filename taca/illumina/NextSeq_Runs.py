@@ -9,7 +9,6 @@ class NextSeq_Run(Standard_Run):
         # NextSeq2000 has a different FC ID pattern that ID contains the first letter for position
         if "VH" in self.instrument:
             self.flowcell_id = self.position + self.flowcell_id
-        self._copy_samplesheet()
 
     def _set_sequencer_type(self):
         self.sequencer_type = "NextSeq"
@@ -6,7 +6,6 @@ class NovaSeqXPlus_Run(Standard_Run):
         super().__init__(run_dir, software, configuration)
         self._set_sequencer_type()
         self._set_run_type()
-        self._copy_samplesheet()
 
     def _set_sequencer_type(self):
         self.sequencer_type = "NovaSeqXPlus"
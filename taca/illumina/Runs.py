@@ -1,21 +1,100 @@
 import csv
+import fnmatch
 import glob
 import json
 import logging
 import os
 import re
 import shutil
+import sqlite3
 import subprocess
 from datetime import datetime
-
-from flowcell_parser.classes import LaneBarcodeParser, RunParser, SampleSheetParser
-
+from functools import cached_property
+
+from flowcell_parser.classes import (
+    LaneBarcodeParser,
+    RunInfoParser,
+    RunParser,
+    SampleSheetParser,
+)
+
+from taca.illumina import parsed
+from taca.illumina.bclconvert_reports import BclConvertReport, has_native_reports
+from taca.illumina.demux_log import DemuxLogScanner
+from taca.illumina.demux_plan import load_demux_plan
+from taca.illumina.demux_queue import QUEUED
+from taca.illumina.index_swaps import (
+    DEFAULT_MIN_FRACTION,
+    DEFAULT_MIN_HITS,
+    INDEX_SWAPS_REPORT,
+    find_index_swaps,
+    samplesheet_samples,
+    stats_assigned_reads,
+)
+from taca.illumina.interop import read_tile_metrics
+from taca.illumina.lane_reports import (
+    aggregate_lane_barcodes,
+    merge_lane_entries,
+    summarize_lanes,
+    write_lane_report,
+)
+from taca.illumina.lane_split import (
+    lane_job_id,
+    lane_output_dir,
+    lane_outputs_done,
+    merge_lane_outputs,
+)
+from taca.illumina.redemux import (
+    drop_fastq_lanes,
+    drop_lane_entries,
+    drop_stats_lanes,
+)
+from taca.illumina.snapshot import RunSnapshot
+from taca.illumina.stats_json import DEFAULT_TOP_UNKNOWN_BARCODES, StatsJsonMerger
+from taca.illumina.symlink_farm import SymlinkFarm, scan_demux_dir
 from taca.utils import misc
+from taca.utils.filesystem import write_atomically
+from taca.utils.ledger import TransferLedger
 from taca.utils.misc import send_mail
 
 logger = logging.getLogger(__name__)
 
 
+class LazyRunParser:
+    """Sections of the RunParser of a run, each parsed on first access.
+
+    runinfo and samplesheet are read on their own, obj, which holds the
+    demultiplexing stats, needs the whole run to be parsed. Runs that are
+    only checked, e.g. already transferred or still demultiplexing, then
+    never read any of them.
+
+    :param str run_dir: The run folder
+    """
+
+    def __init__(self, run_dir):
+        self.path = run_dir
+
+    def _load_section(self, parser, name):
+        # As RunParser, None for missing files
+        try:
+            return parsed.load(parser, os.path.join(self.path, name))
+        except OSError as e:
+            logger.info(str(e))
+            return None
+
+    @cached_property
+    def runinfo(self):
+        return self._load_section(RunInfoParser, "RunInfo.xml")
+
+    @cached_property
+    def samplesheet(self):
+        return self._load_section(SampleSheetParser, "SampleSheet.csv")
+
+    @cached_property
+    def obj(self):
+        return parsed.load_run(RunParser, self.path).obj
+
+
 class Run:
     """Defines an Illumina run"""
 
@@ -57,7 +136,14 @@ class Run:
         self.demux_dir = "Demultiplexing"
         self.legacy_dir = "legacy"
         self.demux_summary = dict()
-        self.runParserObj = RunParser(self.run_dir)
+        self.runParserObj = LazyRunParser(self.run_dir)
+        # Whether the samplesheet has been copied and classified, see prepare_samplesheet
+        self._samplesheet_prepared = None
+        self._snapshot = None
+        # Set to a DemuxScheduler to queue sub-demultiplexing jobs instead of starting them
+        self.demux_scheduler = None
+        # Set to a DemuxExecutor to start jobs elsewhere, e.g. on a batch scheduler
+        self.demux_executor = None
         # This flag tells TACA to move demultiplexed files to the analysis server
         self.transfer_to_analysis_server = True
         # Probably worth to add the samplesheet name as a variable too
@@ -65,60 +151,192 @@ class Run:
     def demultiplex_run(self):
         raise NotImplementedError("Please Implement this method")
 
+    def _copy_samplesheet(self):
+        raise NotImplementedError("Please Implement this method")
+
+    def prepare_samplesheet(self):
+        """Copy and classify the samplesheet of the run, unless already done.
+
+        This is done when the run is demultiplexed, aggregated or uploaded to
+        statusdb rather than when the Run is created, so that runs which are
+        only checked do not read the LIMS samplesheet nor parse the run.
+
+        :returns: False if the samplesheet could not be generated
+        """
+        if self._samplesheet_prepared is None:
+            self._samplesheet_prepared = self._copy_samplesheet() is not False
+        return self._samplesheet_prepared
+
+    def _sub_samplesheets(self):
+        """Return the paths of the sub-samplesheets of the sub-demultiplexings.
+
+        They are taken from the demux plan when there is one, otherwise
+        SampleSheet_N.csv with a single digit N are looked for.
+        """
+        plan = load_demux_plan(self.run_dir)
+        if plan is None:
+            # A single digit, this hypothesis should hold for a while
+            return glob.glob(os.path.join(self.run_dir, "*_[0-9].csv"))
+        samplesheets = [
+            os.path.join(self.run_dir, f"SampleSheet_{demux['demux_id']}.csv")
+            for demux in plan["demuxes"]
+        ]
+        return [
+            samplesheet for samplesheet in samplesheets if os.path.exists(samplesheet)
+        ]
+
+    def _retired_lanes(self):
+        """Return {demux_id: lanes} of the sub-demultiplexings with retired lanes.
+
+        Their outputs for these lanes were superseded by a partial
+        re-demultiplexing and are left out of the aggregated results.
+        """
+        plan = load_demux_plan(self.run_dir)
+        if plan is None:
+            return {}
+        return {
+            str(demux["demux_id"]): set(demux["retired_lanes"])
+            for demux in plan["demuxes"]
+            if demux.get("retired_lanes")
+        }
+
+    def _split_lanes(self):
+        """Return {demux_id: lanes} of the sub-demultiplexings split by lane."""
+        plan = load_demux_plan(self.run_dir)
+        if plan is None:
+            return {}
+        return {
+            str(demux["demux_id"]): demux["split_lanes"]
+            for demux in plan["demuxes"]
+            if demux.get("split_lanes")
+        }
+
+    def _merge_lane_outputs(self, demux_id, lanes, legacy_path):
+        """Merge the outputs of the lane jobs of a sub-demultiplexing.
+
+        Demultiplexing_N is marked as done once merged, see
+        taca.illumina.lane_split.
+        """
+        merge_lane_outputs(self.run_dir, demux_id, lanes, legacy_path)
+        demux_dir = os.path.join(self.run_dir, f"Demultiplexing_{demux_id}")
+        html_path = [
+            legacy_path,
+            "Reports",
+            "html",
+            self.flowcell_id,
+            "all",
+            "all",
+            "all",
+        ]
+        flowcell_summary = {}
+        for html_name in ["lane.html", "laneBarcode.html"]:
+            html_reports = [
+                os.path.join(lane_output_dir(self.run_dir, demux_id, lane), *html_path)
+                for lane in lanes
+            ]
+            html_reports = [
+                os.path.join(html_report, html_name) for html_report in html_reports
+            ]
+            if not all(os.path.exists(html_report) for html_report in html_reports):
+                continue
+            lane_reports = [
+                LaneBarcodeParser(html_report) for html_report in html_reports
+            ]
+            merged_report = lane_reports[0]
+            merged_report.sample_data = [
+                entry
+                for lane_report in lane_reports
+                for entry in lane_report.sample_data
+            ]
+            if html_name == "lane.html":
+                _, flowcell_summary = summarize_lanes(merged_report.sample_data, ())
+            merged_report.flowcell_data.update(flowcell_summary)
+            write_lane_report(
+                os.path.join(_create_folder_structure(demux_dir, html_path), html_name),
+                merged_report,
+            )
+        open(
+            os.path.join(demux_dir, legacy_path, "Stats", "DemultiplexingStats.xml"),
+            "a",
+        ).close()
+
+    def _scan_demux_logs(self, demux_id, job_ids):
+        """Scan the logs of the jobs of a sub-demultiplexing and add up the results."""
+        if self.software == "bcl2fastq":
+            log_name = "bcl2fastq"
+        elif self.software == "bclconvert":
+            log_name = "bcl-convert"
+        else:
+            raise RuntimeError("Unrecognized software!")
+        summary = [0, 0, [], [], 0]
+        for job_id in job_ids:
+            demux_log = os.path.join(self.run_dir, f"demux_{job_id}_{log_name}.err")
+            if not os.path.isfile(demux_log):
+                raise RuntimeError(
+                    f"No demux log file found for sub-demultiplexing {demux_id}!"
+                )
+            for i, value in enumerate(self._check_demux_log(demux_id, demux_log)):
+                summary[i] += value
+        # First and last messages over all the logs
+        summary[2] = summary[2][:5]
+        summary[3] = summary[3][-5:]
+        return tuple(summary)
+
     def check_run_status(self):
         """
         This function checks the status of a run while in progress.
         In the case of HiSeq check that all demux have been done and in that case perform aggregation
         """
         dex_status = self.get_run_status()
+        # Start queued jobs if resources have been freed since the last check
+        job_states = {}
+        if self.demux_scheduler:
+            self.demux_scheduler.schedule()
+            job_states = self.demux_scheduler.job_states(self.id)
         if self.software == "bcl2fastq":
             legacy_path = ""
         elif self.software == "bclconvert":
             legacy_path = f"Reports/{self.legacy_dir}"
         # Check the status of running demux
         # Collect all samplesheets generated before
-        samplesheets = glob.glob(
-            os.path.join(self.run_dir, "*_[0-9].csv")
-        )  # A single digit, this hypothesis should hold for a while
+        samplesheets = self._sub_samplesheets()
+        split_lanes = self._split_lanes()
         all_demux_done = True
         for samplesheet in samplesheets:
             demux_id = os.path.splitext(os.path.split(samplesheet)[1])[0].split("_")[1]
             demux_folder = os.path.join(self.run_dir, f"Demultiplexing_{demux_id}")
+            demux_done = os.path.join(
+                self.run_dir,
+                demux_folder,
+                legacy_path,
+                "Stats",
+                "DemultiplexingStats.xml",
+            )
+            job_ids = [demux_id]
+            if demux_id in split_lanes:
+                lanes = split_lanes[demux_id]
+                job_ids = [lane_job_id(demux_id, lane) for lane in lanes]
+                # The lane jobs are merged into Demultiplexing_N once all done
+                if not os.path.exists(demux_done) and lane_outputs_done(
+                    self.run_dir, demux_id, lanes, legacy_path
+                ):
+                    self._merge_lane_outputs(demux_id, lanes, legacy_path)
             # Check if this job is done
-            if os.path.exists(
-                os.path.join(
-                    self.run_dir,
-                    demux_folder,
-                    legacy_path,
-                    "Stats",
-                    "DemultiplexingStats.xml",
-                )
-            ):
+            if os.path.exists(demux_done):
                 all_demux_done = all_demux_done and True
-                if self.software == "bcl2fastq":
-                    demux_log = os.path.join(
-                        self.run_dir, f"demux_{demux_id}_bcl2fastq.err"
-                    )
-                elif self.software == "bclconvert":
-                    demux_log = os.path.join(
-                        self.run_dir, f"demux_{demux_id}_bcl-convert.err"
-                    )
-                else:
-                    raise RuntimeError("Unrecognized software!")
-                if os.path.isfile(demux_log):
-                    (
-                        errors,
-                        warnings,
-                        error_and_warning_messages,
-                    ) = self._check_demux_log(demux_id, demux_log)
-                else:
-                    raise RuntimeError(
-                        f"No demux log file found for sub-demultiplexing {demux_id}!"
-                    )
+                (
+                    errors,
+                    warnings,
+                    error_and_warning_messages,
+                    last_error_and_warning_messages,
+                    error_and_warning_count,
+                ) = self._scan_demux_logs(demux_id, job_ids)
                 self.demux_summary[demux_id] = {
                     "errors": errors,
                     "warnings": warnings,
                     "error_and_warning_messages": error_and_warning_messages,
+                    "last_error_and_warning_messages": last_error_and_warning_messages,
+                    "error_and_warning_count": error_and_warning_count,
                 }
                 if errors or warnings:
                     logger.info(
@@ -130,14 +348,22 @@ class Run:
                     )
             else:
                 all_demux_done = all_demux_done and False
-                logger.info(f"Sub-Demultiplexing in {demux_folder} not completed yet.")
+                if any(job_states.get(job_id) == QUEUED for job_id in job_ids):
+                    logger.info(
+                        f"Sub-Demultiplexing in {demux_folder} queued, waiting for resources."
+                    )
+                else:
+                    logger.info(
+                        f"Sub-Demultiplexing in {demux_folder} not completed yet."
+                    )
 
         # All demux jobs finished and all stats aggregated under Demultiplexing
         # Aggreate all the results in the Demultiplexing folder
         if all_demux_done and dex_status != "COMPLETED":
             dex_status = "COMPLETED"
+            self.prepare_samplesheet()
             self._aggregate_demux_results()
-            self.runParserObj = RunParser(self.run_dir)
+            self.runParserObj = LazyRunParser(self.run_dir)
             # Rename undetermined if needed
             lanes = misc.return_unique(
                 [lanes["Lane"] for lanes in self.runParserObj.samplesheet.data]
@@ -152,39 +378,12 @@ class Run:
         """
         This function checks the log files of bcl2fastq/bclconvert
         Errors or warnings will be captured and email notifications will be sent
+        Only the part of the log appended since the last check is read, see DemuxLogScanner
+
+        :returns: (errors, warnings, first_messages, last_messages, message_count)
         """
-        with open(demux_log) as demux_log_file:
-            demux_log_content = demux_log_file.readlines()
-            if self.software == "bcl2fastq":
-                pattern = r"Processing completed with (\d+) errors and (\d+) warnings"
-                match = re.search(pattern, demux_log_content[-1])
-                if match:
-                    errors = int(match.group(1))
-                    warnings = int(match.group(2))
-                    error_and_warning_messages = []
-                    if errors or warnings:
-                        for line in demux_log_content:
-                            if "ERROR" in line or "WARN" in line:
-                                error_and_warning_messages.append(line)
-                    return errors, warnings, error_and_warning_messages
-                else:
-                    raise RuntimeError(
-                        f"Bad format with log file demux_{demux_id}_bcl2fastq.err"
-                    )
-            elif self.software == "bclconvert":
-                errors = 0
-                warnings = 0
-                error_and_warning_messages = []
-                for line in demux_log_content:
-                    if "ERROR" in line:
-                        errors += 1
-                        error_and_warning_messages.append(line)
-                    elif "WARNING" in line:
-                        warnings += 1
-                        error_and_warning_messages.append(line)
-                return errors, warnings, error_and_warning_messages
-            else:
-                raise RuntimeError("Unrecognized software!")
+        # Logs are only checked once their sub-demultiplexing is done
+        return DemuxLogScanner(demux_log, self.software).scan(complete=True)
 
     def _set_run_type(self):
         raise NotImplementedError("Please Implement this method")
@@ -227,18 +426,29 @@ class Run:
                 )
             )
 
+    @property
+    def snapshot(self):
+        """RunSnapshot of the run folder, taken on first use."""
+        if self._snapshot is None:
+            self._snapshot = RunSnapshot(self.run_dir, self._get_demux_folder())
+        return self._snapshot
+
+    def refresh_snapshot(self):
+        """Re-read the run folder after an action that changed its state."""
+        if self._snapshot is None:
+            self._snapshot = RunSnapshot(self.run_dir, self._get_demux_folder())
+        else:
+            self._snapshot.demux_dir = self._get_demux_folder()
+            self._snapshot.refresh()
+
     def _is_demultiplexing_done(self):
-        return os.path.exists(
-            os.path.join(self.run_dir, self._get_demux_folder(), "Stats", "Stats.json")
-        )
+        return self.snapshot.demultiplexing_done
 
     def _is_demultiplexing_started(self):
-        return os.path.exists(os.path.join(self.run_dir, self._get_demux_folder()))
+        return self.snapshot.demultiplexing_started
 
     def _is_sequencing_done(self):
-        return os.path.exists(
-            os.path.join(self.run_dir, "RTAComplete.txt")
-        ) and os.path.exists(os.path.join(self.run_dir, "CopyComplete.txt"))
+        return self.snapshot.sequencing_done
 
     def get_run_status(self):
         """Return the current status of the run."""
@@ -342,9 +552,7 @@ class Run:
             raise exception
 
         logger.info(f"Adding run {self.id} to {t_file}")
-        with open(t_file, "a") as tranfer_file:
-            tsv_writer = csv.writer(tranfer_file, delimiter="\t")
-            tsv_writer.writerow([self.id, str(datetime.now())])
+        TransferLedger(t_file).record(self.id)
         os.remove(os.path.join(self.run_dir, "transferring"))
 
         # Send an email notifying that the transfer was successful
@@ -379,18 +587,14 @@ class Run:
         Returns true in the case in which the tranfer is finished or ongoing.
         :param str transfer_file: Path to file with information about transferred runs
         """
+        if not os.path.exists(transfer_file):
+            return False
         try:
-            with open(transfer_file) as file_handle:
-                transfer_file_contents = csv.reader(file_handle, delimiter="\t")
-                for row in transfer_file_contents:
-                    # Rows have two columns: run and transfer date
-                    if row[0] == os.path.basename(self.id):
-                        return True
-            if os.path.exists(os.path.join(self.run_dir, "transferring")):
+            if TransferLedger(transfer_file).is_transferred(self.id):
                 return True
+        except (OSError, sqlite3.Error):
             return False
-        except OSError:
-            return False
+        return os.path.exists(os.path.join(self.run_dir, "transferring"))
 
     def is_unpooled_lane(self, lane):
         """
@@ -466,7 +670,7 @@ class Run:
         lane_demuxid_indexlength = dict()
         for samplesheet in samplesheets:
             demux_id = os.path.splitext(os.path.split(samplesheet)[1])[0].split("_")[1]
-            ssparser = SampleSheetParser(samplesheet)
+            ssparser = parsed.load(SampleSheetParser, samplesheet)
             for row in ssparser.data:
                 if row["Lane"] not in lane_demuxid_indexlength.keys():
                     lane_demuxid_indexlength[row["Lane"]] = {
@@ -509,85 +713,83 @@ class Run:
 
         return noindex_lanes, simple_lanes, complex_lanes
 
+    def _load_lane_reports(self, demux_id, legacy_path, samplesheet_data):
+        """Return the lane and laneBarcode tables of a sub-demultiplexing.
+
+        The tables of bcl-convert are built from its native reports and the
+        InterOp tile metrics of the run. The html reports are parsed otherwise.
+
+        :param demux_id: Number of the sub-demultiplexing
+        :param str legacy_path: Path of the html reports in the demux folder
+        :param list samplesheet_data: Rows of the samplesheet of the demux
+        :returns: (lane, laneBarcode) as LaneBarcodeParser or LaneTable objects
+        """
+        demux_dir = os.path.join(self.run_dir, f"Demultiplexing_{demux_id}")
+        native_reports_dir = os.path.join(demux_dir, "Reports")
+        if self.software == "bclconvert" and has_native_reports(native_reports_dir):
+            report = BclConvertReport(
+                native_reports_dir, samplesheet_data, read_tile_metrics(self.run_dir)
+            )
+            return report.lane_table(), report.laneBarcode_table()
+
+        html_reports = []
+        for html_name in ["lane.html", "laneBarcode.html"]:
+            html_report = os.path.join(
+                demux_dir,
+                legacy_path,
+                "Reports",
+                "html",
+                self.flowcell_id,
+                "all",
+                "all",
+                "all",
+                html_name,
+            )
+            if not os.path.exists(html_report):
+                raise RuntimeError(
+                    f"Not able to find html report {html_report}: possible cause is problem in demultiplexing"
+                )
+            html_reports.append(LaneBarcodeParser(html_report))
+        return tuple(html_reports)
+
     def _process_noindex_sample_with_fake_index_with_single_demux(
         self, demux_id, legacy_path
     ):
         demux_folder = os.path.join(self.run_dir, self.demux_dir)
-        sample_counter = 1
-        for entry in sorted(
-            self.runParserObj.samplesheet.data, key=lambda k: k["Lane"]
-        ):
-            lane = entry["Lane"]
-            project = entry["Sample_Project"]
-            sample = entry["Sample_ID"]
-            project_dest = os.path.join(demux_folder, project)
-            if not os.path.exists(project_dest):
-                os.makedirs(project_dest)
-            sample_dest = os.path.join(project_dest, sample)
-            if not os.path.exists(sample_dest):
-                os.makedirs(sample_dest)
-            for file in glob.glob(
-                os.path.join(
-                    self.run_dir,
-                    f"Demultiplexing_{demux_id}",
-                    f"Undetermined*L0?{lane}*",
-                )
-            ):
-                old_name = os.path.basename(file)
-                old_name_comps = old_name.split("_")
-                new_name_comps = [
-                    sample.replace("Sample_", ""),
-                    f"S{str(sample_counter)}",
-                ] + old_name_comps[2:]
-                new_name = "_".join(new_name_comps)
-                os.symlink(file, os.path.join(sample_dest, new_name))
-                logger.info(
-                    "For undet sample {}, renaming {} to {}".format(
-                        sample.replace("Sample_", ""), old_name, new_name
-                    )
-                )
-            sample_counter += 1
-        # Make a softlink of lane.html
-        html_report_lane_source = os.path.join(
-            self.run_dir,
-            f"Demultiplexing_{demux_id}",
-            legacy_path,
-            "Reports",
-            "html",
-            self.flowcell_id,
-            "all",
-            "all",
-            "all",
-            "lane.html",
+        demux_source = os.path.join(self.run_dir, f"Demultiplexing_{demux_id}")
+        farm = SymlinkFarm()
+        files, _ = scan_demux_dir(demux_source)
+        farm.add_noindex_fastqs(
+            files, demux_source, demux_folder, self.runParserObj.samplesheet.data
         )
-        html_report_lane_dest = os.path.join(
-            demux_folder,
-            "Reports",
-            "html",
-            self.flowcell_id,
-            "all",
-            "all",
-            "all",
-            "lane.html",
+        html_report_lane_parser, html_report_laneBarcode_parser = (
+            self._load_lane_reports(
+                demux_id, legacy_path, self.runParserObj.samplesheet.data
+            )
+        )
+        html_report_dir = _create_folder_structure(
+            demux_folder, ["Reports", "html", self.flowcell_id, "all", "all", "all"]
         )
-        if not os.path.isdir(os.path.dirname(html_report_lane_dest)):
-            os.makedirs(os.path.dirname(html_report_lane_dest))
-        os.symlink(html_report_lane_source, html_report_lane_dest)
+        html_report_lane_dest = os.path.join(html_report_dir, "lane.html")
+        if isinstance(html_report_lane_parser, LaneBarcodeParser):
+            # Make a softlink of lane.html
+            html_report_lane_source = os.path.join(
+                demux_source,
+                legacy_path,
+                "Reports",
+                "html",
+                self.flowcell_id,
+                "all",
+                "all",
+                "all",
+                "lane.html",
+            )
+            farm.add_link(html_report_lane_source, html_report_lane_dest)
+        else:
+            write_lane_report(html_report_lane_dest, html_report_lane_parser)
+        farm.build()
 
         # Modify the laneBarcode.html file
-        html_report_laneBarcode = os.path.join(
-            self.run_dir,
-            f"Demultiplexing_{demux_id}",
-            legacy_path,
-            "Reports",
-            "html",
-            self.flowcell_id,
-            "all",
-            "all",
-            "all",
-            "laneBarcode.html",
-        )
-        html_report_laneBarcode_parser = LaneBarcodeParser(html_report_laneBarcode)
         lane_project_sample = dict()
         for entry in html_report_laneBarcode_parser.sample_data:
             if entry["Sample"] != "Undetermined":
@@ -605,17 +807,8 @@ class Run:
             html_report_laneBarcode_parser.sample_data,
             key=lambda k: (k["Lane"].lower(), k["Sample"]),
         )
-        new_html_report_laneBarcode = os.path.join(
-            demux_folder,
-            "Reports",
-            "html",
-            self.flowcell_id,
-            "all",
-            "all",
-            "all",
-            "laneBarcode.html",
-        )
-        _generate_lane_html(new_html_report_laneBarcode, html_report_laneBarcode_parser)
+        new_html_report_laneBarcode = os.path.join(html_report_dir, "laneBarcode.html")
+        write_lane_report(new_html_report_laneBarcode, html_report_laneBarcode_parser)
 
         if not os.path.exists(os.path.join(demux_folder, "Stats")):
             os.makedirs(os.path.join(demux_folder, "Stats"))
@@ -709,171 +902,53 @@ class Run:
         index_cycles,
         complex_lanes,
         noindex_lanes,
-        html_reports_lane,
-        html_reports_laneBarcode,
+        lane_reports,
+        laneBarcode_reports,
     ):
         # Start with the lane
-        html_report_lane_parser = None
-        for next_html_report_lane in html_reports_lane:
-            if html_report_lane_parser is None:
-                html_report_lane_parser = LaneBarcodeParser(next_html_report_lane)
-            else:
-                lanesInReport = [
-                    Lane["Lane"] for Lane in html_report_lane_parser.sample_data
-                ]
-                next_html_report_lane_parser = LaneBarcodeParser(next_html_report_lane)
-                for entry in next_html_report_lane_parser.sample_data:
-                    if entry["Lane"] not in lanesInReport:
-                        # If this is a new lane not included before
-                        html_report_lane_parser.sample_data.append(entry)
-        # Now all lanes have been inserted
+        html_report_lane_parser = lane_reports[0]
+        # Lanes not present in the first demux are taken from the next ones
+        html_report_lane_parser.sample_data = merge_lane_entries(
+            [lane_report.sample_data for lane_report in lane_reports]
+        )
 
         # NumberReads for total lane cluster/yields and total sample cluster/yields
-        self.NumberReads_Summary = dict()
         # The numbers in Flowcell Summary also need to be aggregated if multiple demultiplexing is done
-        Clusters_Raw = 0
-        Clusters_PF = 0
-        Yield_Mbases = 0
-        for entry in html_report_lane_parser.sample_data:
-            # Update NumberReads for total lane clusters
-            self.NumberReads_Summary[entry["Lane"]] = {
-                "total_lane_cluster": int(entry["PF Clusters"].replace(",", "")),
-                "total_lane_yield": int(entry["Yield (Mbases)"].replace(",", "")),
-            }
-            Clusters_Raw += int(
-                int(entry["PF Clusters"].replace(",", ""))
-                / float(entry["% PFClusters"])
-                * 100
-            )
-            Clusters_PF += int(entry["PF Clusters"].replace(",", ""))
-            Yield_Mbases += int(entry["Yield (Mbases)"].replace(",", ""))
-            if entry["Lane"] in complex_lanes.keys():
-                entry["% Perfectbarcode"] = None
-                entry["% One mismatchbarcode"] = None
+        self.NumberReads_Summary, flowcell_summary = summarize_lanes(
+            html_report_lane_parser.sample_data, complex_lanes
+        )
         # Update the values in Flowcell Summary
-        html_report_lane_parser.flowcell_data["Clusters (Raw)"] = f"{Clusters_Raw:,}"
-        html_report_lane_parser.flowcell_data["Clusters(PF)"] = f"{Clusters_PF:,}"
-        html_report_lane_parser.flowcell_data["Yield (MBases)"] = f"{Yield_Mbases:,}"
-        # Add lanes not present in this demux
+        html_report_lane_parser.flowcell_data.update(flowcell_summary)
         # Create the new lane.html
         new_html_report_lane_dir = _create_folder_structure(
             demux_folder, ["Reports", "html", self.flowcell_id, "all", "all", "all"]
         )
         new_html_report_lane = os.path.join(new_html_report_lane_dir, "lane.html")
-        _generate_lane_html(new_html_report_lane, html_report_lane_parser)
+        write_lane_report(new_html_report_lane, html_report_lane_parser)
 
         # Generate the laneBarcode
-        html_report_laneBarcode_parser = None
-        for next_html_report_laneBarcode in html_reports_laneBarcode:
-            if html_report_laneBarcode_parser is None:
-                html_report_laneBarcode_parser = LaneBarcodeParser(
-                    next_html_report_laneBarcode
-                )
-            else:
-                # No need to check samples occuring in more than one file as it would be spotted while softlinking
-                next_html_report_laneBarcode_parser = LaneBarcodeParser(
-                    next_html_report_laneBarcode
-                )
-                for entry in next_html_report_laneBarcode_parser.sample_data:
-                    html_report_laneBarcode_parser.sample_data.append(entry)
-        # For complex lanes, set all numbers of undetermined to 0. And only keep one such entry
-        constant_keys = ["Lane", "Barcode sequence", "Project", "Sample"]
-        modified_complex_lanes = []
-        for entry in html_report_laneBarcode_parser.sample_data:
-            if (
-                entry["Lane"] in list(complex_lanes.keys())
-                and entry["Project"] in "default"
-            ):
-                if entry["Lane"] not in modified_complex_lanes:
-                    for key in entry.keys():
-                        if key not in constant_keys:
-                            entry[key] = "0"
-                    modified_complex_lanes.append(entry["Lane"])
-                else:
-                    html_report_laneBarcode_parser.sample_data.remove(entry)
-
-        # Update NumberReads for total sample yields
-        for entry in html_report_laneBarcode_parser.sample_data:
-            if (
-                "total_sample_cluster"
-                not in self.NumberReads_Summary[entry["Lane"]].keys()
-            ):
-                self.NumberReads_Summary[entry["Lane"]]["total_sample_cluster"] = 0
-                self.NumberReads_Summary[entry["Lane"]]["total_sample_yield"] = 0
-                if entry["Project"] != "default":
-                    self.NumberReads_Summary[entry["Lane"]]["total_sample_cluster"] += (
-                        int(entry["PF Clusters"].replace(",", ""))
-                    )
-                    self.NumberReads_Summary[entry["Lane"]]["total_sample_yield"] += (
-                        int(entry["Yield (Mbases)"].replace(",", ""))
-                    )
-            else:
-                if entry["Project"] != "default":
-                    self.NumberReads_Summary[entry["Lane"]]["total_sample_cluster"] += (
-                        int(entry["PF Clusters"].replace(",", ""))
-                    )
-                    self.NumberReads_Summary[entry["Lane"]]["total_sample_yield"] += (
-                        int(entry["Yield (Mbases)"].replace(",", ""))
-                    )
-
-        # Calculate the numbers clusters/yields of undet reads
-        for key, value in self.NumberReads_Summary.items():
-            value["undet_cluster"] = (
-                value["total_lane_cluster"] - value["total_sample_cluster"]
-            )
-            value["undet_yield"] = (
-                value["total_lane_yield"] - value["total_sample_yield"]
-            )
-
-        # Update the cluster/yield info of undet for complex lanes
-        for entry in html_report_laneBarcode_parser.sample_data:
-            if entry["Project"] == "default" and entry["Lane"] in complex_lanes.keys():
-                entry["PF Clusters"] = "{:,}".format(
-                    self.NumberReads_Summary[entry["Lane"]]["undet_cluster"]
-                )
-                entry["Yield (Mbases)"] = "{:,}".format(
-                    self.NumberReads_Summary[entry["Lane"]]["undet_yield"]
-                )
-
-        # Fix special case that when we assign fake indexes for NoIndex samples
-        if noindex_lanes and index_cycles != [0, 0]:
-            lane_project_sample = dict()
-            for entry in html_report_laneBarcode_parser.sample_data:
-                if entry["Lane"] in noindex_lanes and entry["Sample"] != "Undetermined":
-                    lane_project_sample[entry["Lane"]] = {
-                        "Project": entry["Project"],
-                        "Sample": entry["Sample"],
-                    }
-            for entry in html_report_laneBarcode_parser.sample_data[:]:
-                if entry["Lane"] in noindex_lanes and entry["Sample"] == "Undetermined":
-                    entry["Project"] = lane_project_sample[entry["Lane"]]["Project"]
-                    entry["Sample"] = lane_project_sample[entry["Lane"]]["Sample"]
-                elif (
-                    entry["Lane"] in noindex_lanes and entry["Sample"] != "Undetermined"
-                ):
-                    html_report_laneBarcode_parser.sample_data.remove(entry)
-
-        # Sort sample_data: first by lane then by sample ID
-        html_report_laneBarcode_parser.sample_data = sorted(
-            html_report_laneBarcode_parser.sample_data,
-            key=lambda k: (k["Lane"].lower(), k["Sample"]),
+        html_report_laneBarcode_parser = laneBarcode_reports[0]
+        laneBarcode_entries = []
+        for laneBarcode_report in laneBarcode_reports:
+            # No need to check samples occuring in more than one file as it would be spotted while softlinking
+            laneBarcode_entries.extend(laneBarcode_report.sample_data)
+        # For complex lanes, keep a single undetermined entry with the reads not
+        # assigned in any demux, and compute the sample and undetermined totals
+        html_report_laneBarcode_parser.sample_data = aggregate_lane_barcodes(
+            laneBarcode_entries,
+            complex_lanes.keys(),
+            noindex_lanes,
+            index_cycles,
+            self.NumberReads_Summary,
         )
 
         # Update the values in Flowcell Summary
-        html_report_laneBarcode_parser.flowcell_data["Clusters (Raw)"] = (
-            f"{Clusters_Raw:,}"
-        )
-        html_report_laneBarcode_parser.flowcell_data["Clusters(PF)"] = (
-            f"{Clusters_PF:,}"
-        )
-        html_report_laneBarcode_parser.flowcell_data["Yield (MBases)"] = (
-            f"{Yield_Mbases:,}"
-        )
+        html_report_laneBarcode_parser.flowcell_data.update(flowcell_summary)
         # Generate the new report for laneBarcode.html
         new_html_report_laneBarcode = os.path.join(
             new_html_report_lane_dir, "laneBarcode.html"
         )
-        _generate_lane_html(new_html_report_laneBarcode, html_report_laneBarcode_parser)
+        write_lane_report(new_html_report_laneBarcode, html_report_laneBarcode_parser)
 
     def _fix_demultiplexingstats_xml_dir(
         self,
@@ -888,250 +963,191 @@ class Run:
         # Create the DemultiplexingStats.xml (empty it is here only to say thay demux is done)
         DemultiplexingStats_xml_dir = _create_folder_structure(demux_folder, ["Stats"])
         # For creating DemuxSummary.txt files for complex lanes
-        DemuxSummaryFiles_complex_lanes = dict()
+        DemuxSummaryFiles_complex_lanes = []
         # Generate the Stats.json
-        with open(
-            os.path.join(DemultiplexingStats_xml_dir, "Stats.json"), "w"
-        ) as json_data_cumulative:
-            stats_list = {}
-            for stat_json in stats_json:
-                demux_id = re.findall("Demultiplexing_([0-9])", stat_json)[0]
-                with open(stat_json) as json_data_partial:
-                    data = json.load(json_data_partial)
-                    if len(stats_list) == 0:
-                        # First time I do this
-                        stats_list["RunNumber"] = data["RunNumber"]
-                        stats_list["Flowcell"] = data["Flowcell"]
-                        stats_list["RunId"] = data["RunId"]
-                        stats_list["ConversionResults"] = data["ConversionResults"]
-                        stats_list["ReadInfosForLanes"] = data["ReadInfosForLanes"]
-                        stats_list["UnknownBarcodes"] = []
-                    else:
-                        # Update only the importat fields
-                        lanes_present_in_stats_json = [
-                            entry["LaneNumber"]
-                            for entry in stats_list["ConversionResults"]
-                        ]
-                        for ReadInfosForLanes_lane in data["ReadInfosForLanes"]:
-                            if (
-                                ReadInfosForLanes_lane["LaneNumber"]
-                                not in lanes_present_in_stats_json
-                            ):
-                                stats_list["ReadInfosForLanes"].extend(
-                                    [ReadInfosForLanes_lane]
-                                )
-                        for ConversionResults_lane in data["ConversionResults"]:
-                            if (
-                                ConversionResults_lane["LaneNumber"]
-                                in lanes_present_in_stats_json
-                                and str(ConversionResults_lane["LaneNumber"])
-                                in complex_lanes.keys()
-                            ):
-                                # For complex lanes, we set all stats to 0, except for read number and yield which will use values from NumberReads_Summary
-                                ConversionResults_lane["Undetermined"][
-                                    "NumberReads"
-                                ] = self.NumberReads_Summary[
-                                    str(ConversionResults_lane["LaneNumber"])
-                                ]["undet_cluster"]
-                                ConversionResults_lane["Undetermined"]["Yield"] = (
-                                    self.NumberReads_Summary[
-                                        str(ConversionResults_lane["LaneNumber"])
-                                    ]["undet_yield"]
-                                    * 1000000
-                                )
-                                ConversionResults_lane["Undetermined"]["ReadMetrics"][
-                                    0
-                                ]["QualityScoreSum"] = 0
-                                ConversionResults_lane["Undetermined"]["ReadMetrics"][
-                                    0
-                                ]["TrimmedBases"] = 0
-                                ConversionResults_lane["Undetermined"]["ReadMetrics"][
-                                    0
-                                ]["Yield"] = 0
-                                ConversionResults_lane["Undetermined"]["ReadMetrics"][
-                                    0
-                                ]["YieldQ30"] = 0
-                                if (
-                                    len(
-                                        [
-                                            r
-                                            for r in self.runParserObj.runinfo.data[
-                                                "Reads"
-                                            ]
-                                            if r["IsIndexedRead"] == "N"
-                                        ]
-                                    )
-                                    == 2
-                                ):
-                                    ConversionResults_lane["Undetermined"][
-                                        "ReadMetrics"
-                                    ][1]["QualityScoreSum"] = 0
-                                    ConversionResults_lane["Undetermined"][
-                                        "ReadMetrics"
-                                    ][1]["TrimmedBases"] = 0
-                                    ConversionResults_lane["Undetermined"][
-                                        "ReadMetrics"
-                                    ][1]["Yield"] = 0
-                                    ConversionResults_lane["Undetermined"][
-                                        "ReadMetrics"
-                                    ][1]["YieldQ30"] = 0
-                                # Find the list containing info for this lane #TODO: can lane_to_update be removed?
-                                lane_to_update = [
-                                    entry
-                                    for entry in stats_list["ConversionResults"]
-                                    if entry["LaneNumber"]
-                                    == ConversionResults_lane["LaneNumber"]
-                                ][0]
-                                lane_to_update["DemuxResults"].extend(
-                                    ConversionResults_lane["DemuxResults"]
-                                )
-                                lane_to_update["Undetermined"] = ConversionResults_lane[
-                                    "Undetermined"
+        stats_merger = StatsJsonMerger(
+            self.CONFIG.get("top_unknown_barcodes", DEFAULT_TOP_UNKNOWN_BARCODES)
+        )
+        paired_end = (
+            len(
+                [
+                    r
+                    for r in self.runParserObj.runinfo.data["Reads"]
+                    if r["IsIndexedRead"] == "N"
+                ]
+            )
+            == 2
+        )
+
+        def _fix_undetermined(ConversionResults_lane):
+            # For complex lanes, we set all stats to 0, except for read number and yield which will use values from NumberReads_Summary
+            lane = str(ConversionResults_lane["LaneNumber"])
+            undetermined = ConversionResults_lane["Undetermined"]
+            undetermined["NumberReads"] = self.NumberReads_Summary[lane][
+                "undet_cluster"
+            ]
+            undetermined["Yield"] = (
+                self.NumberReads_Summary[lane]["undet_yield"] * 1000000
+            )
+            for read_metrics in undetermined["ReadMetrics"][: 2 if paired_end else 1]:
+                read_metrics["QualityScoreSum"] = 0
+                read_metrics["TrimmedBases"] = 0
+                read_metrics["Yield"] = 0
+                read_metrics["YieldQ30"] = 0
+
+        retired_lanes = self._retired_lanes()
+        # Rows of the sub-samplesheets, to leave their samples out of the
+        # unknown barcodes of complex lanes
+        samplesheets_data = {}
+        if complex_lanes:
+            for samplesheet in samplesheets:
+                demux_id_ss = os.path.splitext(os.path.split(samplesheet)[1])[0].split(
+                    "_"
+                )[1]
+                samplesheets_data[demux_id_ss] = parsed.load(
+                    SampleSheetParser, samplesheet
+                ).data
+        for stat_json in stats_json:
+            demux_id = re.findall("Demultiplexing_([0-9]+)", stat_json)[0]
+            with open(stat_json) as json_data_partial:
+                data = json.load(json_data_partial)
+            if demux_id in retired_lanes:
+                drop_stats_lanes(data, retired_lanes[demux_id])
+            stats_merger.add(data, complex_lanes, _fix_undetermined)
+            for unknown_barcode_lane in data["UnknownBarcodes"]:
+                if str(unknown_barcode_lane["Lane"]) in simple_lanes.keys():
+                    stats_merger.add_unknown_barcodes(
+                        unknown_barcode_lane["Lane"], unknown_barcode_lane["Barcodes"]
+                    )
+                elif str(unknown_barcode_lane["Lane"]) in complex_lanes.keys():
+                    if (
+                        list(complex_lanes[str(unknown_barcode_lane["Lane"])].keys())[0]
+                        == demux_id
+                    ):
+                        # First have the list of unknown indexes from the top priority demux run
+                        full_list_unknownbarcodes = unknown_barcode_lane
+                        # Remove the samples involved in the other samplesheets
+                        for demux_id_ss, samplesheet_data in samplesheets_data.items():
+                            if demux_id_ss != demux_id:
+                                ssparser_data_lane = [
+                                    row
+                                    for row in samplesheet_data
+                                    if row["Lane"] == str(unknown_barcode_lane["Lane"])
                                 ]
-                            else:
-                                stats_list["ConversionResults"].extend(
-                                    [ConversionResults_lane]
-                                )
-
-                    for unknown_barcode_lane in data["UnknownBarcodes"]:
-                        if str(unknown_barcode_lane["Lane"]) in simple_lanes.keys():
-                            stats_list["UnknownBarcodes"].extend([unknown_barcode_lane])
-                        elif str(unknown_barcode_lane["Lane"]) in complex_lanes.keys():
-                            if (
-                                list(
-                                    complex_lanes[
-                                        str(unknown_barcode_lane["Lane"])
-                                    ].keys()
-                                )[0]
-                                == demux_id
-                            ):
-                                # First have the list of unknown indexes from the top priority demux run
-                                full_list_unknownbarcodes = unknown_barcode_lane
-                                # Remove the samples involved in the other samplesheets
-                                for samplesheet in samplesheets:
-                                    demux_id_ss = os.path.splitext(
-                                        os.path.split(samplesheet)[1]
-                                    )[0].split("_")[1]
-                                    if demux_id_ss != demux_id:
-                                        ssparser = SampleSheetParser(samplesheet)
-                                        ssparser_data_lane = [
-                                            row
-                                            for row in ssparser.data
-                                            if row["Lane"]
-                                            == str(unknown_barcode_lane["Lane"])
-                                        ]
-                                        for row in ssparser_data_lane:
-                                            sample_idx1 = row.get("index", "")
-                                            sample_idx2 = row.get("index2", "")
-                                            idx_copy = tuple(
-                                                full_list_unknownbarcodes[
+                                for row in ssparser_data_lane:
+                                    sample_idx1 = row.get("index", "")
+                                    sample_idx2 = row.get("index2", "")
+                                    idx_copy = tuple(
+                                        full_list_unknownbarcodes["Barcodes"].keys()
+                                    )
+                                    for idx in idx_copy:
+                                        unknownbarcode_idx1 = (
+                                            idx.split("+")[0] if "+" in idx else idx
+                                        )
+                                        unknownbarcode_idx2 = (
+                                            idx.split("+")[1] if "+" in idx else ""
+                                        )
+                                        if sample_idx1 and sample_idx2:
+                                            comparepart_idx1 = (
+                                                sample_idx1
+                                                if len(sample_idx1)
+                                                <= len(unknownbarcode_idx1)
+                                                else sample_idx1[
+                                                    : len(unknownbarcode_idx1)
+                                                ]
+                                            )
+                                            comparepart_idx2 = (
+                                                sample_idx2
+                                                if len(sample_idx2)
+                                                <= len(unknownbarcode_idx2)
+                                                else sample_idx2[
+                                                    : len(unknownbarcode_idx2)
+                                                ]
+                                            )
+                                            if (
+                                                comparepart_idx1
+                                                == unknownbarcode_idx1[
+                                                    : len(comparepart_idx1)
+                                                ]
+                                                and comparepart_idx2
+                                                == unknownbarcode_idx2[
+                                                    : len(comparepart_idx2)
+                                                ]
+                                            ):
+                                                del full_list_unknownbarcodes[
                                                     "Barcodes"
-                                                ].keys()
+                                                ][idx]
+                                        elif sample_idx1 and not sample_idx2:
+                                            comparepart_idx1 = (
+                                                sample_idx1
+                                                if len(sample_idx1)
+                                                <= len(unknownbarcode_idx1)
+                                                else sample_idx1[
+                                                    : len(unknownbarcode_idx1)
+                                                ]
                                             )
-                                            for idx in idx_copy:
-                                                unknownbarcode_idx1 = (
-                                                    idx.split("+")[0]
-                                                    if "+" in idx
-                                                    else idx
-                                                )
-                                                unknownbarcode_idx2 = (
-                                                    idx.split("+")[1]
-                                                    if "+" in idx
-                                                    else ""
-                                                )
-                                                if sample_idx1 and sample_idx2:
-                                                    comparepart_idx1 = (
-                                                        sample_idx1
-                                                        if len(sample_idx1)
-                                                        <= len(unknownbarcode_idx1)
-                                                        else sample_idx1[
-                                                            : len(unknownbarcode_idx1)
-                                                        ]
-                                                    )
-                                                    comparepart_idx2 = (
-                                                        sample_idx2
-                                                        if len(sample_idx2)
-                                                        <= len(unknownbarcode_idx2)
-                                                        else sample_idx2[
-                                                            : len(unknownbarcode_idx2)
-                                                        ]
-                                                    )
-                                                    if (
-                                                        comparepart_idx1
-                                                        == unknownbarcode_idx1[
-                                                            : len(comparepart_idx1)
-                                                        ]
-                                                        and comparepart_idx2
-                                                        == unknownbarcode_idx2[
-                                                            : len(comparepart_idx2)
-                                                        ]
-                                                    ):
-                                                        del full_list_unknownbarcodes[
-                                                            "Barcodes"
-                                                        ][idx]
-                                                elif sample_idx1 and not sample_idx2:
-                                                    comparepart_idx1 = (
-                                                        sample_idx1
-                                                        if len(sample_idx1)
-                                                        <= len(unknownbarcode_idx1)
-                                                        else sample_idx1[
-                                                            : len(unknownbarcode_idx1)
-                                                        ]
-                                                    )
-                                                    if (
-                                                        comparepart_idx1
-                                                        == unknownbarcode_idx1[
-                                                            : len(comparepart_idx1)
-                                                        ]
-                                                    ):
-                                                        del full_list_unknownbarcodes[
-                                                            "Barcodes"
-                                                        ][idx]
-                                                elif not sample_idx1 and sample_idx2:
-                                                    comparepart_idx2 = (
-                                                        sample_idx2
-                                                        if len(sample_idx2)
-                                                        <= len(unknownbarcode_idx1)
-                                                        else sample_idx2[
-                                                            : len(unknownbarcode_idx1)
-                                                        ]
-                                                    )
-                                                    if (
-                                                        comparepart_idx1
-                                                        == unknownbarcode_idx1[
-                                                            : len(comparepart_idx2)
-                                                        ]
-                                                    ):
-                                                        del full_list_unknownbarcodes[
-                                                            "Barcodes"
-                                                        ][idx]
-                                stats_list["UnknownBarcodes"].extend(
-                                    [full_list_unknownbarcodes]
-                                )
-                                DemuxSummaryFiles_complex_lanes[
-                                    str(unknown_barcode_lane["Lane"])
-                                ] = full_list_unknownbarcodes
-                            else:
-                                pass
-
-            # Fix special case that when we assign fake indexes for NoIndex samples
-            if noindex_lanes and index_cycles != [0, 0]:
-                for entry in stats_list["ConversionResults"][:]:
-                    if str(entry["LaneNumber"]) in noindex_lanes:
-                        del entry["DemuxResults"][0]["IndexMetrics"]
-                        entry["DemuxResults"][0].update(entry["Undetermined"])
-                        del entry["Undetermined"]
-                # Reset unknown barcodes list
-                for entry in stats_list["UnknownBarcodes"][:]:
-                    if str(entry["Lane"]) in noindex_lanes:
-                        entry["Barcodes"] = {"unknown": 1}
-
-            # Write the final version of Stats.json file
-            json.dump(stats_list, json_data_cumulative)
-
-        # Create DemuxSummary.txt files for complex lanes
+                                            if (
+                                                comparepart_idx1
+                                                == unknownbarcode_idx1[
+                                                    : len(comparepart_idx1)
+                                                ]
+                                            ):
+                                                del full_list_unknownbarcodes[
+                                                    "Barcodes"
+                                                ][idx]
+                                        elif not sample_idx1 and sample_idx2:
+                                            comparepart_idx2 = (
+                                                sample_idx2
+                                                if len(sample_idx2)
+                                                <= len(unknownbarcode_idx1)
+                                                else sample_idx2[
+                                                    : len(unknownbarcode_idx1)
+                                                ]
+                                            )
+                                            if (
+                                                comparepart_idx1
+                                                == unknownbarcode_idx1[
+                                                    : len(comparepart_idx2)
+                                                ]
+                                            ):
+                                                del full_list_unknownbarcodes[
+                                                    "Barcodes"
+                                                ][idx]
+                        stats_merger.add_unknown_barcodes(
+                            full_list_unknownbarcodes["Lane"],
+                            full_list_unknownbarcodes["Barcodes"],
+                        )
+                        if (
+                            full_list_unknownbarcodes["Lane"]
+                            not in DemuxSummaryFiles_complex_lanes
+                        ):
+                            DemuxSummaryFiles_complex_lanes.append(
+                                full_list_unknownbarcodes["Lane"]
+                            )
+                    else:
+                        pass
+
+        # Fix special case that when we assign fake indexes for NoIndex samples
+        if noindex_lanes and index_cycles != [0, 0]:
+            for entry in stats_merger.conversion_results[:]:
+                if str(entry["LaneNumber"]) in noindex_lanes:
+                    del entry["DemuxResults"][0]["IndexMetrics"]
+                    entry["DemuxResults"][0].update(entry["Undetermined"])
+                    del entry["Undetermined"]
+            # Reset unknown barcodes list
+            for entry in stats_merger.unknown_barcodes:
+                if str(entry["Lane"]) in noindex_lanes:
+                    stats_merger.set_unknown_barcodes(entry["Lane"], {"unknown": 1})
+
+        # Write the final version of Stats.json file
+        with open(
+            os.path.join(DemultiplexingStats_xml_dir, "Stats.json"), "w"
+        ) as json_data_cumulative:
+            stats_merger.write(json_data_cumulative)
+
+        # Create DemuxSummary.txt files for complex lanes, from the merged top barcodes
         if len(DemuxSummaryFiles_complex_lanes) > 0:
-            for key, value in DemuxSummaryFiles_complex_lanes.items():
+            for key in DemuxSummaryFiles_complex_lanes:
                 with open(
                     os.path.join(
                         DemultiplexingStats_xml_dir, f"DemuxSummaryF1L{key}.txt"
@@ -1140,13 +1156,79 @@ class Run:
                 ) as DemuxSummaryFile:
                     DemuxSummaryFile.write("### Most Popular Unknown Index Sequences\n")
                     DemuxSummaryFile.write("### Columns: Index_Sequence Hit_Count\n")
-                    for idx, count in value["Barcodes"].items():
+                    for idx, count in stats_merger.lane_unknown_barcodes(key).items():
                         DemuxSummaryFile.write(f"{idx}\t{count}\n")
 
+        # Samples whose reads ended up among the unknown barcodes
+        self._report_index_swaps(
+            stats_merger.conversion_results,
+            stats_merger.unknown_barcodes,
+            DemultiplexingStats_xml_dir,
+        )
+
         open(
             os.path.join(DemultiplexingStats_xml_dir, "DemultiplexingStats.xml"), "a"
         ).close()
 
+    def _report_index_swaps(self, conversion_results, unknown_barcodes, stats_dir):
+        """Report the samples likely demultiplexed with the wrong index orientation.
+
+        Thresholds can be set under index_swaps in the config, see
+        taca.illumina.index_swaps. The samples found are logged and written to
+        index_swaps.json in the Stats folder.
+        """
+        swaps_config = self.CONFIG.get("index_swaps") or {}
+        swaps = find_index_swaps(
+            unknown_barcodes,
+            samplesheet_samples(self.runParserObj.samplesheet.data),
+            stats_assigned_reads(conversion_results),
+            max_mismatches=swaps_config.get("max_mismatches", 1),
+            min_hits=swaps_config.get("min_hits", DEFAULT_MIN_HITS),
+            min_fraction=swaps_config.get("min_fraction", DEFAULT_MIN_FRACTION),
+        )
+        for swap in swaps:
+            logger.warning(
+                f"{swap['hits']} unknown reads of lane {swap['lane']} of run "
+                f"{self.id} match sample {swap['sample']} with {swap['variant']} "
+                f"({swap['index']}+{swap['index2']}), "
+                f"{swap['assigned']} reads were assigned to it"
+            )
+        if swaps:
+            write_atomically(
+                os.path.join(stats_dir, INDEX_SWAPS_REPORT),
+                json.dumps(swaps, indent=2),
+            )
+        return swaps
+
+    def _report_single_demux_index_swaps(self, demux_id, legacy_path, noindex_lanes):
+        """Report the index swaps of a run with a single sub-demultiplexing.
+
+        index_swaps.json is written next to the Stats.json of the
+        sub-demultiplexing and linked into the Stats folder of the run.
+        """
+        stats_dir = os.path.join(
+            self.run_dir, f"Demultiplexing_{demux_id}", legacy_path, "Stats"
+        )
+        try:
+            with open(os.path.join(stats_dir, "Stats.json")) as json_data:
+                data = json.load(json_data)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Not able to look for index swaps in run {self.id}: {e}")
+            return []
+        # The reads of NoIndex samples given fake indexes are all unknown
+        unknown_barcodes = [
+            entry
+            for entry in data.get("UnknownBarcodes", [])
+            if str(entry["Lane"]) not in noindex_lanes
+        ]
+        swaps = self._report_index_swaps(
+            data["ConversionResults"], unknown_barcodes, stats_dir
+        )
+        dest = os.path.join(self.run_dir, self.demux_dir, "Stats", INDEX_SWAPS_REPORT)
+        if swaps and not os.path.lexists(dest):
+            os.symlink(os.path.join(stats_dir, INDEX_SWAPS_REPORT), dest)
+        return swaps
+
     def _process_demux_with_complex_lanes(
         self,
         demux_folder,
@@ -1157,49 +1239,28 @@ class Run:
         complex_lanes,
         noindex_lanes,
     ):
-        html_reports_lane = []
-        html_reports_laneBarcode = []
+        lane_reports = []
+        laneBarcode_reports = []
         stats_json = []
+        farm = SymlinkFarm()
+        retired_lanes = self._retired_lanes()
         for samplesheet in samplesheets:
-            ssparser = SampleSheetParser(samplesheet)
+            ssparser = parsed.load(SampleSheetParser, samplesheet)
             demux_id = os.path.splitext(os.path.split(samplesheet)[1])[0].split("_")[1]
-            html_report_lane = os.path.join(
-                self.run_dir,
-                f"Demultiplexing_{demux_id}",
-                legacy_path,
-                "Reports",
-                "html",
-                self.flowcell_id,
-                "all",
-                "all",
-                "all",
-                "lane.html",
+            demux_source = os.path.join(self.run_dir, f"Demultiplexing_{demux_id}")
+            lane_report, laneBarcode_report = self._load_lane_reports(
+                demux_id, legacy_path, ssparser.data
             )
-            if os.path.exists(html_report_lane):
-                html_reports_lane.append(html_report_lane)
-            else:
-                raise RuntimeError(
-                    f"Not able to find html report {html_report_lane}: possible cause is problem in demultiplexing"
+            if demux_id in retired_lanes:
+                # Lanes demultiplexed again in another sub-demultiplexing
+                lane_report.sample_data = drop_lane_entries(
+                    lane_report.sample_data, retired_lanes[demux_id]
                 )
-
-            html_report_laneBarcode = os.path.join(
-                self.run_dir,
-                f"Demultiplexing_{demux_id}",
-                legacy_path,
-                "Reports",
-                "html",
-                self.flowcell_id,
-                "all",
-                "all",
-                "all",
-                "laneBarcode.html",
-            )
-            if os.path.exists(html_report_laneBarcode):
-                html_reports_laneBarcode.append(html_report_laneBarcode)
-            else:
-                raise RuntimeError(
-                    f"Not able to find html report {html_report_laneBarcode}: possible cause is problem in demultiplexing"
+                laneBarcode_report.sample_data = drop_lane_entries(
+                    laneBarcode_report.sample_data, retired_lanes[demux_id]
                 )
+            lane_reports.append(lane_report)
+            laneBarcode_reports.append(laneBarcode_report)
 
             stat_json = os.path.join(
                 self.run_dir,
@@ -1223,83 +1284,22 @@ class Run:
                 else:
                     lanes_samples[row["Lane"]].append(row["Sample_Name"])
 
+            files, projects = scan_demux_dir(demux_source)
+            if demux_id in retired_lanes:
+                projects = drop_fastq_lanes(projects, retired_lanes[demux_id])
             # Special case that when we assign fake indexes for NoIndex samples
             if (
                 set(list(lanes_samples.keys())) & set(noindex_lanes)
             ) and index_cycles != [0, 0]:
-                sample_counter = 1
-                for entry in sorted(ssparser.data, key=lambda k: k["Lane"]):
-                    lane = entry["Lane"]
-                    project = entry["Sample_Project"]
-                    sample = entry["Sample_ID"]
-                    project_dest = os.path.join(demux_folder, project)
-                    if not os.path.exists(project_dest):
-                        os.makedirs(project_dest)
-                    sample_dest = os.path.join(project_dest, sample)
-                    if not os.path.exists(sample_dest):
-                        os.makedirs(sample_dest)
-                    for file in glob.glob(
-                        os.path.join(
-                            self.run_dir,
-                            f"Demultiplexing_{demux_id}",
-                            f"Undetermined*L0?{lane}*",
-                        )
-                    ):
-                        old_name = os.path.basename(file)
-                        old_name_comps = old_name.split("_")
-                        new_name_comps = [
-                            sample.replace("Sample_", ""),
-                            f"S{str(sample_counter)}",
-                        ] + old_name_comps[2:]
-                        new_name = "_".join(new_name_comps)
-                        os.symlink(file, os.path.join(sample_dest, new_name))
-                        logger.info(
-                            "For undet sample {}, renaming {} to {}".format(
-                                sample.replace("Sample_", ""), old_name, new_name
-                            )
-                        )
-                    sample_counter += 1
+                farm.add_noindex_fastqs(
+                    files, demux_source, demux_folder, ssparser.data
+                )
             # Ordinary cases
             else:
-                projects = [
-                    project
-                    for project in os.listdir(
-                        os.path.join(self.run_dir, f"Demultiplexing_{demux_id}")
-                    )
-                    if os.path.isdir(
-                        os.path.join(
-                            self.run_dir, f"Demultiplexing_{demux_id}", project
-                        )
-                    )
-                ]
-                for project in projects:
-                    if project in "Reports" or project in "Stats":
-                        continue
-                    project_source = os.path.join(
-                        self.run_dir, f"Demultiplexing_{demux_id}", project
-                    )
-                    project_dest = os.path.join(demux_folder, project)
-                    if not os.path.exists(project_dest):
-                        # There might be project seqeunced with multiple index lengths
-                        os.makedirs(project_dest)
-                    samples = [
-                        sample
-                        for sample in os.listdir(project_source)
-                        if os.path.isdir(os.path.join(project_source, sample))
-                    ]
-                    for sample in samples:
-                        sample_source = os.path.join(project_source, sample)
-                        sample_dest = os.path.join(project_dest, sample)
-                        if not os.path.exists(sample_dest):
-                            # There should never be the same sample sequenced with different index length,
-                            # however a sample might be pooled in several lanes and therefore sequenced using different samplesheets
-                            os.makedirs(sample_dest)
-                        fastqfiles = glob.glob(os.path.join(sample_source, "*.fastq*"))
-                        for fastqfile in fastqfiles:
-                            os.symlink(
-                                fastqfile,
-                                os.path.join(sample_dest, os.path.split(fastqfile)[1]),
-                            )
+                # There might be project seqeunced with multiple index lengths.
+                # There should never be the same sample sequenced with different index length,
+                # however a sample might be pooled in several lanes and therefore sequenced using different samplesheets
+                farm.add_project_fastqs(projects, demux_folder)
                 # Copy fastq files for undetermined and the undetermined stats for simple lanes only
                 lanes_in_sub_samplesheet = []
                 header = [
@@ -1324,47 +1324,36 @@ class Run:
                         if row[0] not in header:
                             lanes_in_sub_samplesheet.append(row[1])
                 lanes_in_sub_samplesheet = list(set(lanes_in_sub_samplesheet))
+                stats_source = os.path.join(demux_source, legacy_path, "Stats")
+                stats_files = (
+                    os.listdir(stats_source) if os.path.isdir(stats_source) else []
+                )
                 for lane in lanes_in_sub_samplesheet:
                     if lane in simple_lanes.keys():
-                        undetermined_fastq_files = glob.glob(
-                            os.path.join(
-                                self.run_dir,
-                                f"Demultiplexing_{demux_id}",
-                                f"Undetermined_S0_L00{lane}*.fastq*",
-                            )
-                        )  # Contains only simple lanes undetermined
-                        for fastqfile in undetermined_fastq_files:
-                            os.symlink(
-                                fastqfile,
-                                os.path.join(demux_folder, os.path.split(fastqfile)[1]),
-                            )
-                        DemuxSummaryFiles = glob.glob(
-                            os.path.join(
-                                self.run_dir,
-                                f"Demultiplexing_{demux_id}",
-                                legacy_path,
-                                "Stats",
-                                f"*L{lane}*txt",
+                        # Contains only simple lanes undetermined
+                        for fastqfile in fnmatch.filter(
+                            files, f"Undetermined_S0_L00{lane}*.fastq*"
+                        ):
+                            farm.add_link(
+                                os.path.join(demux_source, fastqfile),
+                                os.path.join(demux_folder, fastqfile),
                             )
-                        )
-                        if not os.path.exists(os.path.join(demux_folder, "Stats")):
-                            os.makedirs(os.path.join(demux_folder, "Stats"))
-                        for DemuxSummaryFile in DemuxSummaryFiles:
-                            os.symlink(
-                                DemuxSummaryFile,
-                                os.path.join(
-                                    demux_folder,
-                                    "Stats",
-                                    os.path.split(DemuxSummaryFile)[1],
-                                ),
+                        farm.add_dir(os.path.join(demux_folder, "Stats"))
+                        for DemuxSummaryFile in fnmatch.filter(
+                            stats_files, f"*L{lane}*txt"
+                        ):
+                            farm.add_link(
+                                os.path.join(stats_source, DemuxSummaryFile),
+                                os.path.join(demux_folder, "Stats", DemuxSummaryFile),
                             )
 
-        return html_reports_lane, html_reports_laneBarcode, stats_json
+        farm.build()
+        return lane_reports, laneBarcode_reports, stats_json
 
     def _aggregate_demux_results_simple_complex(self):
         runSetup = self.runParserObj.runinfo.get_read_configuration()
         demux_folder = os.path.join(self.run_dir, self.demux_dir)
-        samplesheets = glob.glob(os.path.join(self.run_dir, "*_[0-9].csv"))
+        samplesheets = self._sub_samplesheets()
         if self.software == "bcl2fastq":
             legacy_path = ""
         elif self.software == "bclconvert":
@@ -1385,9 +1374,13 @@ class Run:
             samplesheets
         )
 
-        # Case with only one sub-demultiplexing
-        if len(complex_lanes) == 0 and len(samplesheets) == 1:
-            demux_id = "0"  # in this case this is the only demux dir
+        # Case with only one sub-demultiplexing, with all its lanes
+        retired_lanes = self._retired_lanes()
+        if len(complex_lanes) == 0 and len(samplesheets) == 1 and not retired_lanes:
+            # In this case this is the only demux dir
+            demux_id = os.path.splitext(os.path.split(samplesheets[0])[1])[0].split(
+                "_"
+            )[1]
             # Special case that when we assign fake indexes for NoIndex samples
             if noindex_lanes and index_cycles != [0, 0]:
                 # We first softlink the FastQ files of undet as the FastQ files of samples
@@ -1399,12 +1392,14 @@ class Run:
                 self._process_simple_lane_with_single_demux(
                     demux_id, legacy_path, noindex_lanes
                 )
+            # Samples whose reads ended up among the unknown barcodes
+            self._report_single_demux_index_swaps(demux_id, legacy_path, noindex_lanes)
             return True
 
         # Case with multiple sub-demultiplexings
         (
-            html_reports_lane,
-            html_reports_laneBarcode,
+            lane_reports,
+            laneBarcode_reports,
             stats_json,
         ) = self._process_demux_with_complex_lanes(
             demux_folder,
@@ -1422,8 +1417,8 @@ class Run:
             index_cycles,
             complex_lanes,
             noindex_lanes,
-            html_reports_lane,
-            html_reports_laneBarcode,
+            lane_reports,
+            laneBarcode_reports,
         )
 
         # Fix contents under the DemultiplexingStats folder
@@ -1450,57 +1445,3 @@ def _create_folder_structure(root, dirs):
         if not os.path.exists(path):
             os.makedirs(path)
     return path
-
-
-def _generate_lane_html(html_file, html_report_lane_parser):
-    with open(html_file, "w") as html:
-        # HEADER
-        html.write(
-            '<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">\n'
-        )
-        html.write("<html xmlns:bcl2fastq>\n")
-        html.write(
-            '<link rel="stylesheet" href="../../../../Report.css" type="text/css">\n'
-        )
-        html.write("<body>\n")
-        html.write('<table width="100%"><tr>\n')
-        html.write("<td><p><p>C6L1WANXX /\n")
-        html.write("        [all projects] /\n")
-        html.write("        [all samples] /\n")
-        html.write("        [all barcodes]</p></p></td>\n")
-        html.write(
-            '<td><p align="right"><a href="../../../../FAKE/all/all/all/laneBarcode.html">show barcodes</a></p></td>\n'
-        )
-        html.write("</tr></table>\n")
-        # FLOWCELL SUMMARY TABLE
-        html.write("<h2>Flowcell Summary</h2>\n")
-        html.write('<table border="1" ID="ReportTable">\n')
-        html.write("<tr>\n")
-        fc_keys = sorted(list(html_report_lane_parser.flowcell_data.keys()))
-        for key in fc_keys:
-            html.write(f"<th>{key}</th>\n")
-        html.write("</tr>\n")
-        html.write("<tr>\n")
-        for key in fc_keys:
-            html.write(f"<td>{html_report_lane_parser.flowcell_data[key]}</td>\n")
-        html.write("</tr>\n")
-        html.write("</table>\n")
-        # LANE SUMMARY TABLE
-        html.write("<h2>Lane Summary</h2>\n")
-        html.write('<table border="1" ID="ReportTable">\n')
-        html.write("<tr>\n")
-        lane_keys = sorted(list(html_report_lane_parser.sample_data[0].keys()))
-        for key in lane_keys:
-            html.write(f"<th>{key}</th>\n")
-        html.write("</tr>\n")
-
-        for sample in html_report_lane_parser.sample_data:
-            html.write("<tr>\n")
-            for key in lane_keys:
-                html.write(f"<td>{sample[key]}</td>\n")
-            html.write("</tr>\n")
-        html.write("</table>\n")
-        # FOOTER
-        html.write("<p></p>\n")
-        html.write("</body>\n")
-        html.write("</html>\n")
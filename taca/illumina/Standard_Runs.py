@@ -1,19 +1,44 @@
 import logging
 import os
 import re
-from datetime import datetime
+import shutil
+import subprocess
 
 from flowcell_parser.classes import SampleSheetParser
 
+from taca.illumina import parsed
+from taca.illumina.bcl_check import DEFAULT_WORKERS, check_bcl_files, format_report
+from taca.illumina.demux_executor import LocalExecutor
+from taca.illumina.demux_plan import load_demux_plan, plan_demux, write_demux_plan
+from taca.illumina.index_distance import (
+    DEFAULT_BARCODE_MISMATCHES,
+    check_demux_indexes,
+)
+from taca.illumina.index_tables import (
+    index_kind,
+    load_10X_indexes,
+    load_smartseq_indexes,
+)
+from taca.illumina.lane_split import lane_job_id, lane_output_dir
+from taca.illumina.redemux import (
+    plan_redemux,
+    restrict_samplesheet,
+    samplesheet_lane_hashes,
+)
 from taca.illumina.Runs import Run
-from taca.utils import misc
-from taca.utils.filesystem import chdir
+from taca.illumina.trial_demux import (
+    DEFAULT_THRESHOLD,
+    assigned_fractions,
+    failing_lanes,
+    format_fractions,
+    reverse_complement_samplesheet,
+    trial_output_dir,
+    trial_tiles,
+)
+from taca.utils.filesystem import chdir, write_atomically
 
 logger = logging.getLogger(__name__)
 
-TENX_SINGLE_PAT = re.compile("SI-(?:GA|NA)-[A-H][1-9][0-2]?")
-TENX_DUAL_PAT = re.compile("SI-(?:TT|NT|NN|TN|TS)-[A-H][1-9][0-2]?")
-SMARTSEQ_PAT = re.compile("SMARTSEQ[1-9]?-[1-9][0-9]?[A-P]")
 IDT_UMI_PAT = re.compile("([ATCG]{4,}N+$)")
 RECIPE_PAT = re.compile("[0-9]+-[0-9]+")
 
@@ -30,7 +55,7 @@ class Standard_Run(Run):
 
     def _copy_samplesheet(self):
         ssname = self._get_samplesheet()
-        ssparser = SampleSheetParser(ssname)
+        ssparser = parsed.load(SampleSheetParser, ssname)
         indexfile = dict()
         runSetup = self.runParserObj.runinfo.get_read_configuration()
         # Loading index files
@@ -73,40 +98,23 @@ class Standard_Run(Run):
 
         # When demultiplexing SampleSheet.csv is the one I need to use
         # Need to rewrite so that SampleSheet_0.csv is always used.
-        self.runParserObj.samplesheet = SampleSheetParser(
-            os.path.join(self.run_dir, "SampleSheet.csv")
+        self.runParserObj.samplesheet = parsed.load(
+            SampleSheetParser, os.path.join(self.run_dir, "SampleSheet.csv")
         )
-        if not self.runParserObj.obj.get("samplesheet_csv"):
-            self.runParserObj.obj["samplesheet_csv"] = (
-                self.runParserObj.samplesheet.data
-            )
 
     def _parse_10X_indexes(self, indexfile):
         """
-        Takes a file of 10X indexes and returns them as a dict.
-        Todo: Set it up to take the file from config instead
+        Takes a file of 10X indexes and returns them as a read-only mapping
+        of index set name -> tuple of indexes, cached for the whole process.
         """
-        index_dict = {}
-        with open(indexfile) as f:
-            for line in f:
-                line_ = line.rstrip().split(",")
-                index_dict[line_[0]] = line_[1:5]
-        return index_dict
+        return load_10X_indexes(indexfile)
 
     def _parse_smartseq_indexes(self, indexfile):
         """
-        Takes a file of Smart-seq indexes and returns them as a dict.
-        Todo: Set it up to take the file from config instead
+        Takes a file of Smart-seq indexes and returns them as a read-only mapping
+        of index set name -> tuple of (index, index2), cached for the whole process.
         """
-        index_dict = {}
-        with open(indexfile) as f:
-            for line in f:
-                line_ = line.rstrip().split(",")
-                if index_dict.get(line_[0]):
-                    index_dict[line_[0]].append((line_[1], line_[2]))
-                else:
-                    index_dict.update({line_[0]: [(line_[1], line_[2])]})
-        return index_dict
+        return load_smartseq_indexes(indexfile)
 
     def _classify_samples(self, indexfile, ssparser, runSetup):
         """Given an ssparser object, go through all samples and decide sample types."""
@@ -135,6 +143,7 @@ class Standard_Run(Run):
                 sample["index"] = ""
             if not sample.get("index2"):
                 sample["index2"] = ""
+            kind = index_kind(sample["index"], index_dict_tenX)
             # Read the length of read 1 and read 2 from the field Recipe
             if sample.get("Recipe") and RECIPE_PAT.findall(sample.get("Recipe")):
                 ss_read_length = [
@@ -147,11 +156,11 @@ class Standard_Run(Run):
             if ss_read_length != [0, 0]:
                 read_length = [min(rd) for rd in zip(ss_read_length, read_length)]
             # 10X single index
-            if TENX_SINGLE_PAT.findall(sample["index"]):
+            if kind == "10X_SINGLE":
                 index_length = [len(index_dict_tenX[sample["index"]][0]), 0]
                 sample_type = "10X_SINGLE"
             # 10X dual index
-            elif TENX_DUAL_PAT.findall(sample["index"]):
+            elif kind == "10X_DUAL":
                 index_length = [
                     len(index_dict_tenX[sample["index"]][0]),
                     len(index_dict_tenX[sample["index"]][1]),
@@ -172,7 +181,7 @@ class Standard_Run(Run):
                     sample["index2"].upper().count("N"),
                 ]
             # Smart-seq
-            elif SMARTSEQ_PAT.findall(sample["index"]):
+            elif kind == "SMARTSEQ":
                 smartseq_index = sample["index"].split("-")[1]
                 index_length = [
                     len(index_dict_smartseq[smartseq_index][0][0]),
@@ -238,209 +247,472 @@ class Standard_Run(Run):
          - Decide correct bcl2fastq/bclconvert command parameters based on sample classes
          - run bcl2fastq/bclconvert conversion
         """
-        runSetup = self.runParserObj.runinfo.get_read_configuration()
-        # Check sample types
-        sample_type_list = []
-        for lane, lane_contents in self.sample_table.items():
-            for sample in lane_contents:
-                sample_detail = sample[1]
-                sample_type = sample_detail["sample_type"]
-                if sample_type not in sample_type_list:
-                    sample_type_list.append(sample_type)
-
-        # Go through sample_table for demultiplexing
-        bcl_cmd_counter = 0
-        for sample_type in sorted(sample_type_list):
-            # Looking for lanes with multiple masks under the same sample type
-            lane_table = dict()
-            for lane, lane_contents in self.sample_table.items():
-                for sample in lane_contents:
-                    sample_detail = sample[1]
-                    sample_type_t = sample_detail["sample_type"]
-                    sample_index_length = sample_detail["index_length"]
-                    sample_umi_length = sample_detail["umi_length"]
-                    sample_read_length = sample_detail["read_length"]
-                    if sample_type_t == sample_type:
-                        if lane_table.get(lane):
-                            if (
-                                sample_index_length,
-                                sample_umi_length,
-                                sample_read_length,
-                            ) not in lane_table[lane]:
-                                lane_table[lane].append(
-                                    (
-                                        sample_index_length,
-                                        sample_umi_length,
-                                        sample_read_length,
-                                    )
-                                )
-                        else:
-                            lane_table.update(
-                                {
-                                    lane: [
-                                        (
-                                            sample_index_length,
-                                            sample_umi_length,
-                                            sample_read_length,
-                                        )
-                                    ]
-                                }
-                            )
+        self.prepare_samplesheet()
+        # Do not start anything before all the BCL files are there
+        self._check_bcl_files()
+        # Group the samples by sample type and mask, unless already done
+        plan = load_demux_plan(self.run_dir, self.sample_table, self.software)
+        if plan is None:
+            plan = plan_demux(self.sample_table, self.software)
+        # Check the indexes of all sub-demultiplexings before starting any
+        barcode_mismatches = {
+            demux["demux_id"]: self._check_indexes(demux) for demux in plan["demuxes"]
+        }
 
-            # Determine the number of demux needed for the same sample type
-            if self.software == "bcl2fastq":
-                demux_number_with_the_same_sample_type = len(
-                    max([v for k, v in lane_table.items()], key=len)
-                )
-            elif self.software == "bclconvert":
-                unique_masks = []
-                for masks in lane_table.values():
-                    for mask in masks:
-                        if mask not in unique_masks:
-                            unique_masks.append(mask)
-                demux_number_with_the_same_sample_type = len(unique_masks)
-            # Prepare sub-samplesheets, masks and commands
-            for i in range(0, demux_number_with_the_same_sample_type):
-                # Prepare sub-samplesheet
-                # A dictionary with lane and sample IDs to include
-                samples_to_include = dict()
-                # A dictionary with lane and index length for generating masks
-                mask_table = dict()
-                if self.software == "bcl2fastq":
-                    for lane, lane_contents in self.sample_table.items():
-                        try:
-                            (index_length, umi_length, read_length) = lane_table[lane][
-                                i
-                            ]
-                            mask_table.update(
-                                {lane: (index_length, umi_length, read_length)}
-                            )
-                            for sample in lane_contents:
-                                sample_name = sample[0]
-                                sample_detail = sample[1]
-                                sample_type_t = sample_detail["sample_type"]
-                                sample_index_length = sample_detail["index_length"]
-                                sample_umi_length = sample_detail["umi_length"]
-                                sample_read_length = sample_detail["read_length"]
-                                if (
-                                    sample_type_t == sample_type
-                                    and sample_index_length == index_length
-                                    and sample_umi_length == umi_length
-                                    and sample_read_length == read_length
-                                ):
-                                    if samples_to_include.get(lane):
-                                        samples_to_include[lane].append(sample_name)
-                                    else:
-                                        samples_to_include.update({lane: [sample_name]})
-                        except (KeyError, IndexError):
-                            logger.info(
-                                f"No corresponding mask in lane {lane}. Skip it."
-                            )
-                            continue
-                elif self.software == "bclconvert":
-                    mask = unique_masks[i]
-                    for lane, lane_contents in self.sample_table.items():
-                        if lane_table.get(lane):
-                            if mask in lane_table[lane]:
-                                mask_table.update({lane: mask})
-                                for sample in lane_contents:
-                                    sample_name = sample[0]
-                                    sample_detail = sample[1]
-                                    sample_type_t = sample_detail["sample_type"]
-                                    sample_index_length = sample_detail["index_length"]
-                                    sample_umi_length = sample_detail["umi_length"]
-                                    sample_read_length = sample_detail["read_length"]
-                                    if (
-                                        sample_type_t == sample_type
-                                        and sample_index_length == mask[0]
-                                        and sample_umi_length == mask[1]
-                                        and sample_read_length == mask[2]
-                                    ):
-                                        if samples_to_include.get(lane):
-                                            samples_to_include[lane].append(sample_name)
-                                        else:
-                                            samples_to_include.update(
-                                                {lane: [sample_name]}
-                                            )
+        # One sub-samplesheet, mask and command per sub-demultiplexing
+        for demux in plan["demuxes"]:
+            demux["lane_hashes"] = self._write_sub_samplesheet(
+                demux, barcode_mismatches[demux["demux_id"]]
+            )
+            demux["split_lanes"] = self._lanes_to_split(demux)
+        # Try the sub-samplesheets on a single tile first, if configured
+        for demux in plan["demuxes"]:
+            self._trial_demux(demux, barcode_mismatches[demux["demux_id"]])
+        write_demux_plan(self.run_dir, plan)
+        for demux in plan["demuxes"]:
+            self._start_demux(demux, barcode_mismatches[demux["demux_id"]])
+        if self.demux_scheduler:
+            self.demux_scheduler.schedule()
+        return True
 
-                if self.software == "bclconvert":
-                    runSetup = self.runParserObj.runinfo.get_read_configuration()
-                    (index_length, umi_length, read_length) = mask
-                    index1_size = int(index_length[0])
-                    index2_size = int(index_length[1])
-                    umi1_size = int(umi_length[0])
-                    umi2_size = int(umi_length[1])
-                    read1_size = int(read_length[0])
-                    read2_size = int(read_length[1])
-                    is_dual_index = False
-                    if (index1_size != 0 and index2_size != 0) or (
-                        index1_size == 0 and index2_size != 0
-                    ):
-                        is_dual_index = True
-                    base_mask = self._compute_base_mask(
-                        runSetup,
-                        sample_type,
-                        index1_size,
-                        is_dual_index,
-                        index2_size,
-                        umi1_size,
-                        umi2_size,
-                        read1_size,
-                        read2_size,
-                    )
-                else:
-                    index1_size = 0
-                    index2_size = 0
-                    base_mask = []
-                # Make sub-samplesheet
-                with chdir(self.run_dir):
-                    samplesheet_dest = f"SampleSheet_{bcl_cmd_counter}.csv"
-                    with open(samplesheet_dest, "w") as fcd:
-                        fcd.write(
-                            self._generate_samplesheet_subset(
-                                self.runParserObj.samplesheet,
-                                samples_to_include,
-                                runSetup,
-                                self.software,
-                                sample_type,
-                                index1_size,
-                                index2_size,
-                                base_mask,
-                                self.CONFIG,
-                            )
-                        )
+    def redemultiplex(self):
+        """Demultiplex again only the lanes whose samplesheet changed.
 
-                # Prepare demultiplexing dir
-                with chdir(self.run_dir):
-                    # Create Demultiplexing dir, this changes the status to IN_PROGRESS
-                    if not os.path.exists("Demultiplexing"):
-                        os.makedirs("Demultiplexing")
+        The samplesheet is generated again from the LIMS one and the lanes of
+        the new plan are compared with the lane hashes of the demux plan, see
+        taca.illumina.redemux. Only the changed lanes are demultiplexed again,
+        the results are aggregated again once they are done.
 
-                # Prepare demultiplexing command
-                with chdir(self.run_dir):
-                    cmd = self.generate_bcl_command(
-                        sample_type, mask_table, bcl_cmd_counter
-                    )
-                    misc.call_external_command_detached(
-                        cmd, with_log_files=True, prefix=f"demux_{bcl_cmd_counter}"
+        :returns: True if sub-demultiplexings were started or lanes retired,
+            False if no lane changed
+        """
+        old_plan = load_demux_plan(self.run_dir)
+        if old_plan is None:
+            raise RuntimeError(
+                f"No demux plan found for run {self.id}, it has to be demultiplexed from scratch"
+            )
+        for demux in old_plan["demuxes"]:
+            if "lane_hashes" not in demux:
+                # Planned before lane hashes were kept
+                with open(
+                    os.path.join(self.run_dir, f"SampleSheet_{demux['demux_id']}.csv")
+                ) as sub_samplesheet:
+                    demux["lane_hashes"] = samplesheet_lane_hashes(
+                        sub_samplesheet.read()
                     )
-                    logger.info(
-                        "BCL to FASTQ conversion and demultiplexing "
-                        f"started for run {os.path.basename(self.id)} on {datetime.now()}"
+
+        # Generate the samplesheet again from the LIMS one
+        samplesheet = os.path.join(self.run_dir, "SampleSheet.csv")
+        previous_samplesheet = f"{samplesheet}.previous"
+        os.replace(samplesheet, previous_samplesheet)
+        try:
+            if self._copy_samplesheet() is False:
+                raise RuntimeError(f"Could not generate SampleSheet.csv for {self.id}")
+            new_plan = plan_demux(self.sample_table, self.software)
+            runSetup = self.runParserObj.runinfo.get_read_configuration()
+            barcode_mismatches = {
+                demux["demux_id"]: self._check_indexes(demux)
+                for demux in new_plan["demuxes"]
+            }
+            for demux in new_plan["demuxes"]:
+                demux["lane_hashes"] = samplesheet_lane_hashes(
+                    self._sub_samplesheet_text(
+                        demux, runSetup, barcode_mismatches[demux["demux_id"]]
                     )
+                )
+        except Exception:
+            # Nothing has been changed yet, the run is left as it was
+            os.replace(previous_samplesheet, samplesheet)
+            raise
+        plan, new_ids, trimmed_ids, retired_ids = plan_redemux(old_plan, new_plan)
+        if not (new_ids or trimmed_ids or retired_ids):
+            logger.info(f"No lane of run {self.id} changed, nothing to demultiplex")
+            os.remove(previous_samplesheet)
+            return False
+
+        # Keep the untouched lanes of the sub-demultiplexings that lost lanes
+        for demux in plan["demuxes"]:
+            if demux["demux_id"] in trimmed_ids:
+                sub_samplesheet = os.path.join(
+                    self.run_dir, f"SampleSheet_{demux['demux_id']}.csv"
+                )
+                with open(sub_samplesheet) as sub_samplesheet_file:
+                    contents = sub_samplesheet_file.read()
+                write_atomically(
+                    sub_samplesheet,
+                    restrict_samplesheet(contents, demux["mask_table"]),
+                )
+                logger.info(
+                    f"Lanes {', '.join(demux['retired_lanes'])} of Demultiplexing_"
+                    f"{demux['demux_id']} of run {self.id} are demultiplexed again"
+                )
+        for demux_id in retired_ids:
+            os.replace(
+                os.path.join(self.run_dir, f"SampleSheet_{demux_id}.csv"),
+                os.path.join(self.run_dir, f"SampleSheet_{demux_id}.csv.retired"),
+            )
+            logger.info(
+                f"Demultiplexing_{demux_id} of run {self.id} is no longer used "
+                "and can be removed"
+            )
+        # Aggregate again, the merged folder only holds symlinks and reports
+        demux_folder = os.path.join(self.run_dir, self.demux_dir)
+        if os.path.exists(demux_folder):
+            shutil.rmtree(demux_folder)
 
-                # Demultiplexing done for one mask type and scripts will continue
-                # Working with the next type. Command counter should increase by 1
-                bcl_cmd_counter += 1
+        new_demuxes = [
+            demux for demux in plan["demuxes"] if demux["demux_id"] in new_ids
+        ]
+        barcode_mismatches = {
+            demux["demux_id"]: self._check_indexes(demux) for demux in new_demuxes
+        }
+        for demux in new_demuxes:
+            self._write_sub_samplesheet(demux, barcode_mismatches[demux["demux_id"]])
+            demux["split_lanes"] = self._lanes_to_split(demux)
+        write_demux_plan(self.run_dir, plan)
+        # The new plan replaces the old one, along with its samplesheet
+        os.remove(previous_samplesheet)
+        for demux in new_demuxes:
+            self._start_demux(demux, barcode_mismatches[demux["demux_id"]])
+        # Nothing to wait for when lanes were only removed
+        os.makedirs(demux_folder, exist_ok=True)
+        if self.demux_scheduler:
+            self.demux_scheduler.schedule()
         return True
 
+    def _sub_samplesheet_text(self, demux, runSetup, barcode_mismatches):
+        """Return the contents of the sub-samplesheet of a planned sub-demultiplexing."""
+        sample_type = demux["sample_type"]
+        if self.software == "bclconvert":
+            (index_length, umi_length, read_length) = demux["mask"]
+            index1_size = int(index_length[0])
+            index2_size = int(index_length[1])
+            umi1_size = int(umi_length[0])
+            umi2_size = int(umi_length[1])
+            read1_size = int(read_length[0])
+            read2_size = int(read_length[1])
+            is_dual_index = False
+            if (index1_size != 0 and index2_size != 0) or (
+                index1_size == 0 and index2_size != 0
+            ):
+                is_dual_index = True
+            base_mask = self._compute_base_mask(
+                runSetup,
+                sample_type,
+                index1_size,
+                is_dual_index,
+                index2_size,
+                umi1_size,
+                umi2_size,
+                read1_size,
+                read2_size,
+            )
+        else:
+            index1_size = 0
+            index2_size = 0
+            base_mask = []
+        return self._generate_samplesheet_subset(
+            self.runParserObj.samplesheet,
+            demux["samples_to_include"],
+            runSetup,
+            self.software,
+            sample_type,
+            index1_size,
+            index2_size,
+            base_mask,
+            self.CONFIG,
+            barcode_mismatches,
+        )
+
+    def _write_sub_samplesheet(self, demux, barcode_mismatches):
+        """Write SampleSheet_N.csv of a planned sub-demultiplexing.
+
+        :returns: The hashes of the lanes of the sub-samplesheet
+        """
+        runSetup = self.runParserObj.runinfo.get_read_configuration()
+        contents = self._sub_samplesheet_text(demux, runSetup, barcode_mismatches)
+        with chdir(self.run_dir):
+            samplesheet_dest = f"SampleSheet_{demux['demux_id']}.csv"
+            with open(samplesheet_dest, "w") as fcd:
+                fcd.write(contents)
+        return samplesheet_lane_hashes(contents)
+
+    def _run_trial_demux(self, demux, barcode_mismatches, timeout):
+        """Demultiplex a single tile of a sub-demultiplexing and wait for it.
+
+        :returns: The fraction of the reads assigned to samples in each lane
+        """
+        demux_id = demux["demux_id"]
+        output_dir = trial_output_dir(self.run_dir, demux_id)
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        cmd = self.generate_bcl_command(
+            demux["sample_type"],
+            demux["mask_table"],
+            demux_id,
+            barcode_mismatches,
+            trial=True,
+        )
+        log_prefix = os.path.join(self.run_dir, f"trial_{demux_id}_{self.software}")
+        with (
+            open(f"{log_prefix}.out", "w") as out,
+            open(f"{log_prefix}.err", "w") as err,
+        ):
+            try:
+                subprocess.run(
+                    cmd,
+                    cwd=self.run_dir,
+                    stdout=out,
+                    stderr=err,
+                    timeout=timeout,
+                    check=True,
+                )
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                raise RuntimeError(
+                    f"Trial of sub-demultiplexing {demux_id} of run {self.id} failed: {e}"
+                )
+        fractions = assigned_fractions(output_dir, self.software)
+        shutil.rmtree(output_dir)
+        return fractions
+
+    def _trial_demux(self, demux, barcode_mismatches):
+        """Check a sub-samplesheet on a single tile, if trial_demux is configured.
+
+        Lanes with fewer reads assigned to samples than the threshold are tried
+        again with index2 reverse complemented, which is then kept if all lanes
+        pass, see taca.illumina.trial_demux. Raises if lanes still fail.
+        """
+        trial = (self.CONFIG.get(self.software) or {}).get("trial_demux")
+        if not trial:
+            return
+        trial = trial if isinstance(trial, dict) else {}
+        threshold = trial.get("threshold", DEFAULT_THRESHOLD)
+        timeout = trial.get("timeout")
+        demux_id = demux["demux_id"]
+        lanes = sorted(demux["mask_table"])
+        fractions = self._run_trial_demux(demux, barcode_mismatches, timeout)
+        failing = failing_lanes(fractions, lanes, threshold)
+        if not failing:
+            logger.info(
+                f"Trial of sub-demultiplexing {demux_id} of run {self.id} passed: "
+                f"{format_fractions(fractions)}"
+            )
+            return
+        samplesheet = os.path.join(self.run_dir, f"SampleSheet_{demux_id}.csv")
+        with open(samplesheet) as samplesheet_file:
+            contents = samplesheet_file.read()
+        reverse_complemented = reverse_complement_samplesheet(contents, lanes=failing)
+        if reverse_complemented != contents:
+            logger.warning(
+                f"Lanes {', '.join(failing)} of sub-demultiplexing {demux_id} of run "
+                f"{self.id} below {threshold} in trial ({format_fractions(fractions)}), "
+                "trying again with index2 reverse complemented"
+            )
+            write_atomically(samplesheet, reverse_complemented)
+            rc_fractions = self._run_trial_demux(demux, barcode_mismatches, timeout)
+            if not failing_lanes(rc_fractions, lanes, threshold):
+                logger.warning(
+                    f"Using index2 reverse complemented in lanes {', '.join(failing)} "
+                    f"of sub-demultiplexing {demux_id} of run {self.id}: "
+                    f"{format_fractions(rc_fractions)}"
+                )
+                # The lane hashes stay those of the samplesheet from the LIMS
+                demux["index2_reverse_complemented"] = failing
+                return
+            write_atomically(samplesheet, contents)
+        raise RuntimeError(
+            f"Too few reads assigned in lanes {', '.join(failing)} in the trial of "
+            f"sub-demultiplexing {demux_id} of run {self.id} "
+            f"({format_fractions(fractions)}), check its samplesheet"
+        )
+
+    def _lanes_to_split(self, demux):
+        """Return the lanes of a sub-demultiplexing to run as separate jobs.
+
+        Lanes are split when split_lanes is set in the config of the software,
+        and there is more than one lane to split.
+        """
+        lanes = sorted(demux["mask_table"])
+        if (self.CONFIG.get(self.software) or {}).get("split_lanes") and len(lanes) > 1:
+            return lanes
+        return []
+
+    def _start_demux(self, demux, barcode_mismatches):
+        """Start, or queue, the bcl2fastq/bclconvert jobs of a sub-demultiplexing.
+
+        A single job converts all the lanes, unless the lanes are split. The
+        job of a split lane allows the mismatches safe for that lane alone on
+        the bcl2fastq command line, see _check_indexes. bcl-convert reads them
+        from the sub-samplesheet shared by all the lanes.
+        """
+        bcl_cmd_counter = demux["demux_id"]
+        # A dictionary with lane and index length for generating masks
+        mask_table = demux["mask_table"]
+        # Prepare demultiplexing dir
+        with chdir(self.run_dir):
+            # Create Demultiplexing dir, this changes the status to IN_PROGRESS
+            if not os.path.exists("Demultiplexing"):
+                os.makedirs("Demultiplexing")
+
+        executor = self.demux_executor or LocalExecutor(self.demux_scheduler)
+        split_lanes = demux.get("split_lanes") or []
+        if split_lanes:
+            jobs = [(lane_job_id(bcl_cmd_counter, lane), lane) for lane in split_lanes]
+        else:
+            jobs = [(str(bcl_cmd_counter), None)]
+        runSetup = self.runParserObj.runinfo.get_read_configuration()
+        # Every lane is converted over all cycles
+        lane_cost = sum(int(read["NumCycles"]) for read in runSetup)
+        lane_barcode_mismatches = demux.get("lane_barcode_mismatches") or {}
+        # Prepare demultiplexing commands
+        with chdir(self.run_dir):
+            for job_id, lane in jobs:
+                job_barcode_mismatches = barcode_mismatches
+                if lane is not None and lane in lane_barcode_mismatches:
+                    job_barcode_mismatches = lane_barcode_mismatches[lane]
+                cmd = self.generate_bcl_command(
+                    demux["sample_type"],
+                    mask_table,
+                    bcl_cmd_counter,
+                    job_barcode_mismatches,
+                    lane,
+                )
+                executor.submit(
+                    self.id,
+                    self.run_dir,
+                    job_id,
+                    cmd,
+                    self.software,
+                    lane_cost * (1 if lane else len(mask_table)),
+                )
+
+    def _configured_barcode_mismatches(self, sample_type):
+        """Return the mismatches allowed for index 1 and 2 by the config of sample_type."""
+        mismatches = [DEFAULT_BARCODE_MISMATCHES, DEFAULT_BARCODE_MISMATCHES]
+        software_config = self.CONFIG.get(self.software) or {}
+        if self.software == "bclconvert":
+            settings = software_config.get("settings") or {}
+            for setting in (settings.get("common") or []) + (
+                settings.get(sample_type) or []
+            ):
+                for k, v in setting.items():
+                    if k == "BarcodeMismatchesIndex1":
+                        mismatches[0] = int(v)
+                    elif k == "BarcodeMismatchesIndex2":
+                        mismatches[1] = int(v)
+        else:
+            options = software_config.get("options") or {}
+            for option in (options.get("common") or []) + (
+                options.get(sample_type) or []
+            ):
+                if isinstance(option, dict) and "barcode-mismatches" in option:
+                    # e.g. 1 or 1,0, the last value applies to the next indexes
+                    values = str(option["barcode-mismatches"]).split(",")
+                    mismatches = [int(values[0]), int(values[-1])]
+        return tuple(mismatches)
+
+    def _check_bcl_files(self):
+        """Check the BCL files of the run if bcl_check is configured.
+
+        Raises with a report of the missing or truncated files, if any, so
+        that the run stays TO_START until they are fixed.
+        """
+        bcl_check = self.CONFIG.get("bcl_check")
+        if bcl_check is None:
+            return
+        problems = check_bcl_files(
+            self.run_dir,
+            workers=(bcl_check or {}).get("workers", DEFAULT_WORKERS),
+        )
+        if problems:
+            raise RuntimeError(
+                f"{len(problems)} BCL files of run {self.id} are missing or "
+                f"incomplete, not starting the demultiplexing:\n"
+                f"{format_report(problems)}"
+            )
+
+    def _check_indexes(self, demux):
+        """Check the index distances of a planned sub-demultiplexing.
+
+        Raises if samples of a lane have the same indexes. The mismatches safe
+        for each lane on its own are kept in lane_barcode_mismatches of demux,
+        for the jobs of lanes that are split, see _start_demux.
+        :returns: The mismatches to allow for each index read, if fewer than
+            configured are needed to keep the samples apart, None otherwise
+        """
+        configured = self._configured_barcode_mismatches(demux["sample_type"])
+        results = check_demux_indexes(
+            self.runParserObj.samplesheet.data,
+            demux["samples_to_include"],
+            demux["mask_table"],
+            configured,
+        )
+        collisions = [
+            f"{sample_a} and {sample_b} in lane {lane}"
+            for lane, result in sorted(results.items())
+            for sample_a, sample_b in result["collisions"]
+        ]
+        if collisions:
+            raise RuntimeError(
+                f"Index collisions in sub-demultiplexing {demux['demux_id']} "
+                f"of run {self.id}: {', '.join(collisions)}"
+            )
+        for lane, result in sorted(results.items()):
+            logger.info(
+                f"Minimum index distances in lane {lane} of sub-demultiplexing "
+                f"{demux['demux_id']}: {result['min_distance']}"
+            )
+
+        def _allowed(safe, masks):
+            if safe == configured:
+                return None
+            # Only the index reads that are used
+            dual = any(int(mask[0][1]) for mask in masks)
+            return safe if dual else safe[:1]
+
+        demux["lane_barcode_mismatches"] = {
+            lane: _allowed(
+                tuple(result["barcode_mismatches"]), [demux["mask_table"][lane]]
+            )
+            for lane, result in results.items()
+        }
+        # Mismatches apply to the whole command, the most constrained lane decides
+        safe = tuple(
+            min(result["barcode_mismatches"][i] for result in results.values())
+            for i in range(2)
+        )
+        if safe == configured:
+            return None
+        logger.warning(
+            f"Allowing {safe} instead of {configured} index mismatches in "
+            f"sub-demultiplexing {demux['demux_id']} of run {self.id}, "
+            "to keep samples apart"
+        )
+        return _allowed(safe, demux["mask_table"].values())
+
     def _aggregate_demux_results(self):
         """Take the Stats.json files from the different
         demultiplexing folders and merges them into one
         """
         self._aggregate_demux_results_simple_complex()
 
-    def generate_bcl_command(self, sample_type, mask_table, bcl_cmd_counter):
+    def generate_bcl_command(
+        self,
+        sample_type,
+        mask_table,
+        bcl_cmd_counter,
+        barcode_mismatches=None,
+        split_lane=None,
+        trial=False,
+    ):
+        """Build the bcl2fastq/bclconvert command of a sub-demultiplexing.
+
+        If split_lane is given, the command only converts that lane, into its own
+        output folder, see taca.illumina.lane_split. If trial is True, the
+        command only converts one tile, see taca.illumina.trial_demux.
+        """
+        if split_lane is not None:
+            mask_table = {split_lane: mask_table[split_lane]}
         with chdir(self.run_dir):
             # Software
             cl = [self.CONFIG.get(self.software)["bin"]]
@@ -460,14 +732,38 @@ class Standard_Run(Run):
                     ][0]  # Get the base_mask
                     base_mask_expr = f"{lane}:" + ",".join(base_mask)
                     cl.extend(["--use-bases-mask", base_mask_expr])
+                if split_lane is not None:
+                    # All the tiles of the lane
+                    cl.extend(["--tiles", f"s_{split_lane}"])
+                elif trial:
+                    cl.extend(
+                        [
+                            "--tiles",
+                            trial_tiles(
+                                os.path.join(self.run_dir, "RunInfo.xml"),
+                                [str(lane) for lane in lanes],
+                            ),
+                        ]
+                    )
             # Case with bclconvert
             elif self.software == "bclconvert":
                 logger.info("Building a bclconvert command")
                 cl.extend(["--bcl-input-directory", self.run_dir])
+                if split_lane is not None:
+                    cl.extend(["--bcl-only-lane", str(split_lane)])
+                elif trial:
+                    cl.extend(["--first-tile-only", "true"])
             else:
                 raise RuntimeError("Unrecognized software!")
             # Output dir
-            output_dir = os.path.join(self.run_dir, f"Demultiplexing_{bcl_cmd_counter}")
+            if split_lane is not None:
+                output_dir = lane_output_dir(self.run_dir, bcl_cmd_counter, split_lane)
+            elif trial:
+                output_dir = trial_output_dir(self.run_dir, bcl_cmd_counter)
+            else:
+                output_dir = os.path.join(
+                    self.run_dir, f"Demultiplexing_{bcl_cmd_counter}"
+                )
             if not os.path.exists(output_dir):
                 os.makedirs(output_dir)
             cl.extend(["--output-dir", output_dir])
@@ -492,10 +788,20 @@ class Standard_Run(Run):
                 for option in cl_options:
                     if isinstance(option, dict):
                         opt, val = list(option.items())[0]
-                        if "output-dir" not in opt:
+                        if "output-dir" not in opt and not (
+                            barcode_mismatches and opt == "barcode-mismatches"
+                        ):
                             cl.extend([f"--{opt}", str(val).lower()])
                     else:
                         cl.append(f"--{option}")
+            # Fewer mismatches than configured, from the index check
+            if barcode_mismatches and self.software == "bcl2fastq":
+                cl.extend(
+                    [
+                        "--barcode-mismatches",
+                        ",".join(str(m) for m in barcode_mismatches),
+                    ]
+                )
         return cl
 
     def _generate_per_lane_base_mask(self, sample_type, mask_table):
@@ -778,7 +1084,7 @@ class Standard_Run(Run):
             if sample["index"] in index_dict_tenX.keys():
                 tenX_index = sample["index"]
                 # In the case of 10X dual indexes, replace index and index2
-                if TENX_DUAL_PAT.findall(tenX_index):
+                if index_dict_tenX.kinds[tenX_index] == "10X_DUAL":
                     sample["index"] = index_dict_tenX[tenX_index][0]
                     sample["index2"] = index_dict_tenX[tenX_index][1]
                 # In the case of 10X single indexes, replace the index name with the 4 actual indicies
@@ -792,7 +1098,7 @@ class Standard_Run(Run):
                         x += 1
                     # Set the original 10X index to the 4th correct index
                     sample["index"] = index_dict_tenX[tenX_index][x]
-            elif SMARTSEQ_PAT.findall(sample["index"]):
+            elif index_kind(sample["index"], index_dict_tenX) == "SMARTSEQ":
                 x = 0
                 smartseq_index = sample["index"].split("-")[1]
                 indices_number = len(index_dict_smartseq[smartseq_index])
@@ -859,6 +1165,7 @@ class Standard_Run(Run):
         index2_size,
         base_mask,
         CONFIG,
+        barcode_mismatches=None,
     ):
         output = ""
         # Prepare index cycles
@@ -885,11 +1192,15 @@ class Standard_Run(Run):
                     if CONFIG["bclconvert"]["settings"].get("common"):
                         for setting in CONFIG["bclconvert"]["settings"]["common"]:
                             for k, v in setting.items():
+                                if barcode_mismatches and "BarcodeMismatchesIndex" in k:
+                                    continue
                                 output += f"{k},{v}{os.linesep}"
                     # Put special settings:
                     if sample_type in CONFIG["bclconvert"]["settings"].keys():
                         for setting in CONFIG["bclconvert"]["settings"][sample_type]:
                             for k, v in setting.items():
+                                if barcode_mismatches and "BarcodeMismatchesIndex" in k:
+                                    continue
                                 if (
                                     (
                                         k == "BarcodeMismatchesIndex1"
@@ -902,6 +1213,16 @@ class Standard_Run(Run):
                                     or "BarcodeMismatchesIndex" not in k
                                 ):
                                     output += f"{k},{v}{os.linesep}"
+            # Fewer mismatches than configured, from the index check
+            if barcode_mismatches:
+                if index1_size != 0:
+                    output += (
+                        f"BarcodeMismatchesIndex1,{barcode_mismatches[0]}{os.linesep}"
+                    )
+                if index2_size != 0 and len(barcode_mismatches) > 1:
+                    output += (
+                        f"BarcodeMismatchesIndex2,{barcode_mismatches[1]}{os.linesep}"
+                    )
         # Data
         output += f"[Data]{os.linesep}"
         datafields = []
@@ -0,0 +1,208 @@
+"""Pre-flight check of the BCL and CBCL files of a run.
+
+The files expected under Data/Intensities/BaseCalls are enumerated from the
+lanes, surfaces, cycles and tiles of RunInfo.xml, in the layout found in the
+first lane:
+
+- CBCL, one per lane, cycle and surface: L001/C1.1/L001_1.cbcl. The size of
+  the file must match its header, i.e. the compressed sizes of its tiles
+- BGZF, one per lane and cycle: L001/0001.bcl.bgzf, which must end with the
+  BGZF end-of-file block
+- BCL, one per lane, cycle and tile: L001/C1.1/s_1_1101.bcl(.gz). The size
+  of uncompressed files must match their cluster count
+
+Checking a file only takes a stat and a small read, but runs have tens of
+thousands of them, often on network file systems, so they are checked in a
+thread pool.
+"""
+
+import glob
+import logging
+import os
+import struct
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+BASECALLS_DIR = os.path.join("Data", "Intensities", "BaseCalls")
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+# Version, header size, bits per basecall, bits per q-score, number of q-score bins
+CBCL_HEADER = struct.Struct("<HIBBI")
+DEFAULT_WORKERS = 16
+
+
+def read_run_layout(run_info):
+    """Read the layout of a flowcell from RunInfo.xml.
+
+    :returns: {lanes, surfaces, cycles, tiles, tile_naming}, tiles being the
+        list of (lane, tile) of the TileSet, empty if not listed, and
+        tile_naming its TileNamingConvention, e.g. FiveDigit, None if not given
+    """
+    root = ET.parse(run_info).getroot()
+    cycles = sum(int(read.get("NumCycles", 0)) for read in root.iter("Read"))
+    layout = root.find(".//FlowcellLayout")
+    if layout is None:
+        raise ValueError(f"No FlowcellLayout in {run_info}")
+    tile_set = layout.find("TileSet")
+    tiles = []
+    for tile in layout.iter("Tile"):
+        lane, _, name = (tile.text or "").strip().partition("_")
+        if name:
+            tiles.append((int(lane), name))
+    return {
+        "lanes": int(layout.get("LaneCount", 0)),
+        "surfaces": int(layout.get("SurfaceCount", 1)),
+        "cycles": cycles,
+        "tiles": tiles,
+        "tile_naming": None
+        if tile_set is None
+        else tile_set.get("TileNamingConvention"),
+    }
+
+
+def expected_files(run_dir, layout):
+    """Return the (path, kind) of each BCL file expected in a run folder.
+
+    :param dict layout: As returned by read_run_layout
+    """
+    basecalls = os.path.join(run_dir, BASECALLS_DIR)
+    lanes = range(1, layout["lanes"] + 1)
+    cycles = range(1, layout["cycles"] + 1)
+    first_cycle = os.path.join(basecalls, "L001", "C1.1")
+    if glob.glob(os.path.join(first_cycle, "*.cbcl")):
+        return [
+            (
+                os.path.join(
+                    basecalls,
+                    f"L{lane:03d}",
+                    f"C{cycle}.1",
+                    f"L{lane:03d}_{surface}.cbcl",
+                ),
+                "cbcl",
+            )
+            for lane in lanes
+            for cycle in cycles
+            for surface in range(1, layout["surfaces"] + 1)
+        ]
+    if glob.glob(os.path.join(basecalls, "L001", "*.bcl.bgzf")):
+        return [
+            (os.path.join(basecalls, f"L{lane:03d}", f"{cycle:04d}.bcl.bgzf"), "bgzf")
+            for lane in lanes
+            for cycle in cycles
+        ]
+    # One file per tile, listed in RunInfo.xml or else found in the first cycle
+    if glob.glob(os.path.join(first_cycle, "*.bcl.gz")):
+        extension = ".bcl.gz"
+    else:
+        extension = ".bcl"
+    tiles = list(layout["tiles"])
+    if not tiles:
+        for lane in lanes:
+            lane_cycle = os.path.join(basecalls, f"L{lane:03d}", "C1.1")
+            for path in sorted(glob.glob(os.path.join(lane_cycle, f"*{extension}"))):
+                tile = os.path.basename(path)[: -len(extension)].split("_")[-1]
+                tiles.append((lane, tile))
+    return [
+        (
+            os.path.join(
+                basecalls,
+                f"L{lane:03d}",
+                f"C{cycle}.1",
+                f"s_{lane}_{tile}{extension}",
+            ),
+            "bcl.gz" if extension == ".bcl.gz" else "bcl",
+        )
+        for lane, tile in tiles
+        for cycle in cycles
+    ]
+
+
+def _check_cbcl(bcl_file, size):
+    header = bcl_file.read(CBCL_HEADER.size)
+    if len(header) < CBCL_HEADER.size:
+        return "truncated header"
+    version, header_size, _, _, bins = CBCL_HEADER.unpack(header)
+    if version != 1:
+        return f"unknown CBCL version {version}"
+    bcl_file.seek(CBCL_HEADER.size + 8 * bins)
+    tile_count = bcl_file.read(4)
+    if len(tile_count) < 4:
+        return "truncated header"
+    (tiles,) = struct.unpack("<I", tile_count)
+    tile_records = bcl_file.read(16 * tiles)
+    if len(tile_records) < 16 * tiles or size < header_size:
+        return "truncated header"
+    # Tile, clusters, uncompressed and compressed sizes of each tile
+    compressed = sum(record[3] for record in struct.iter_unpack("<IIII", tile_records))
+    if size < header_size + compressed:
+        return f"truncated, {size} bytes instead of {header_size + compressed}"
+    return None
+
+
+def check_file(path, kind):
+    """Check that a BCL file exists and looks complete.
+
+    :param str kind: cbcl, bgzf, bcl or bcl.gz
+    :returns: What is wrong with the file, None if nothing is
+    """
+    try:
+        size = os.stat(path).st_size
+        if size == 0:
+            return "empty"
+        with open(path, "rb") as bcl_file:
+            if kind == "cbcl":
+                return _check_cbcl(bcl_file, size)
+            if kind in ("bgzf", "bcl.gz"):
+                if bcl_file.read(2) != GZIP_MAGIC:
+                    return "not gzip compressed"
+                if kind == "bgzf":
+                    bcl_file.seek(max(size - len(BGZF_EOF), 0))
+                    if bcl_file.read() != BGZF_EOF:
+                        return "truncated, no BGZF end-of-file block"
+                return None
+            cluster_count = bcl_file.read(4)
+            if len(cluster_count) < 4:
+                return "truncated header"
+            (clusters,) = struct.unpack("<I", cluster_count)
+            if size != 4 + clusters:
+                return f"{size} bytes instead of {4 + clusters}"
+            return None
+    except FileNotFoundError:
+        return "missing"
+    except OSError as e:
+        return f"unreadable: {e}"
+
+
+def check_bcl_files(run_dir, workers=DEFAULT_WORKERS):
+    """Check all the BCL files of a run.
+
+    :param str run_dir: The run folder
+    :param int workers: Number of files checked at the same time
+    :returns: List of (path relative to the run folder, problem), sorted
+    """
+    layout = read_run_layout(os.path.join(run_dir, "RunInfo.xml"))
+    files = expected_files(run_dir, layout)
+    if not files:
+        return [(BASECALLS_DIR, "no BCL files found")]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda expected: check_file(*expected), files)
+        problems = [
+            (os.path.relpath(path, run_dir), problem)
+            for (path, _), problem in zip(files, results)
+            if problem
+        ]
+    logger.info(
+        f"Checked {len(files)} BCL files of {os.path.basename(run_dir)}, "
+        f"{len(problems)} with problems"
+    )
+    return sorted(problems)
+
+
+def format_report(problems, limit=20):
+    """Return a readable report of the problems found by check_bcl_files."""
+    lines = [f"{path}: {problem}" for path, problem in problems[:limit]]
+    if len(problems) > limit:
+        lines.append(f"... and {len(problems) - limit} more")
+    return "\n".join(lines)
@@ -0,0 +1,239 @@
+"""Lane and laneBarcode tables built from the native reports of bcl-convert.
+
+bcl-convert writes its demultiplexing statistics as CSV files in the Reports
+folder of each sub-demultiplexing. The tables of lane.html and laneBarcode.html
+are computed from them with DataFrame group-bys, rather than by parsing the
+legacy html reports.
+
+The tables are exposed in the format of flowcell_parser's LaneBarcodeParser,
+i.e. sample_data as a list of dicts with the columns of the html tables as
+formatted strings, and flowcell_data with the Flowcell Summary fields.
+
+bcl-convert only reports clusters passing filter. The raw clusters and the %
+PF clusters of each lane are taken from the InterOp tile metrics of the run
+when given, and left out of the tables otherwise. They are not known per
+sample, so the laneBarcode table has no % PF clusters.
+
+Top_Unknown_Barcodes.csv is not read. The unknown barcodes of each lane are
+those of the legacy Stats.json, which are merged across sub-demultiplexings
+with the complex lanes taken into account, see taca.illumina.stats_json.
+"""
+
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEMULTIPLEX_STATS = "Demultiplex_Stats.csv"
+QUALITY_METRICS = "Quality_Metrics.csv"
+
+# Project, sample and barcode of the undetermined entries, as in bcl2fastq reports
+UNDETERMINED_PROJECT = "default"
+UNDETERMINED_SAMPLE = "Undetermined"
+UNDETERMINED_BARCODE = "unknown"
+
+# Columns of the tables, as read by LaneBarcodeParser
+LANE_COLUMNS = [
+    "Lane",
+    "PF Clusters",
+    "% of thelane",
+    "% Perfectbarcode",
+    "% One mismatchbarcode",
+    "Yield (Mbases)",
+    "% PFClusters",
+    "% >= Q30bases",
+    "Mean QualityScore",
+]
+LANE_BARCODE_COLUMNS = LANE_COLUMNS[:1] + ["Project", "Sample", "Barcode sequence"]
+LANE_BARCODE_COLUMNS += LANE_COLUMNS[1:]
+
+_SUMMED = ["reads", "perfect", "one_mismatch", "yield", "yield_q30", "qscore_sum"]
+
+
+def has_native_reports(reports_dir):
+    """Return True if reports_dir holds the reports needed by BclConvertReport."""
+    return all(
+        os.path.exists(os.path.join(reports_dir, report))
+        for report in (DEMULTIPLEX_STATS, QUALITY_METRICS)
+    )
+
+
+class LaneTable:
+    """Stand-in for LaneBarcodeParser, holding a table built from native reports."""
+
+    def __init__(self, sample_data, flowcell_data):
+        self.sample_data = sample_data
+        self.flowcell_data = flowcell_data
+
+
+def _percent(numerator, denominator):
+    """Element-wise percentage, 0 where the denominator is 0."""
+    return (100 * numerator / denominator.where(denominator != 0)).fillna(0)
+
+
+def _format_table(df, columns):
+    """Format the numeric columns of df as in the html reports."""
+    if "percent_pf" not in df or df["percent_pf"].isna().any():
+        columns = [column for column in columns if column != "% PFClusters"]
+    formatted = pd.DataFrame(index=df.index)
+    for column in columns:
+        if column == "PF Clusters":
+            formatted[column] = df["reads"].map("{:,}".format)
+        elif column == "Yield (Mbases)":
+            formatted[column] = (
+                (df["yield"] / 1e6).round().astype("int64").map("{:,}".format)
+            )
+        elif column == "% of thelane":
+            formatted[column] = _percent(df["reads"], df["lane_reads"]).map(
+                "{:.2f}".format
+            )
+        elif column == "% Perfectbarcode":
+            formatted[column] = _percent(df["perfect"], df["reads"]).map(
+                "{:.2f}".format
+            )
+        elif column == "% One mismatchbarcode":
+            formatted[column] = _percent(df["one_mismatch"], df["reads"]).map(
+                "{:.2f}".format
+            )
+        elif column == "% PFClusters":
+            formatted[column] = df["percent_pf"].map("{:.2f}".format)
+        elif column == "% >= Q30bases":
+            formatted[column] = _percent(df["yield_q30"], df["yield"]).map(
+                "{:.2f}".format
+            )
+        elif column == "Mean QualityScore":
+            formatted[column] = (
+                (df["qscore_sum"] / df["yield"].where(df["yield"] != 0))
+                .fillna(0)
+                .map("{:.2f}".format)
+            )
+        else:
+            formatted[column] = df[column].astype(str)
+    return formatted[columns].to_dict("records")
+
+
+class BclConvertReport:
+    """Lane and laneBarcode tables of a bcl-convert sub-demultiplexing.
+
+    :param str reports_dir: The Reports folder of the sub-demultiplexing
+    :param list samplesheet_data: Rows of the samplesheet used for the
+        demultiplexing, to name samples and projects as in the bcl2fastq
+        reports. Without it, the Sample_ID and Sample_Project of the reports
+        are used
+    :param dict tile_metrics: {lane: {clusters, percent_pf}} of the run, as
+        read by taca.illumina.interop.read_tile_metrics
+    """
+
+    def __init__(self, reports_dir, samplesheet_data=None, tile_metrics=None):
+        self.reports_dir = reports_dir
+        self.barcodes = self._load_barcodes(samplesheet_data or [])
+        self.lanes = self._load_lanes(tile_metrics or {})
+
+    def _read_csv(self, name):
+        return pd.read_csv(
+            os.path.join(self.reports_dir, name),
+            dtype={"Lane": str, "SampleID": str, "Sample_Project": str, "Index": str},
+            keep_default_na=False,
+        )
+
+    def _load_barcodes(self, samplesheet_data):
+        """One row per lane and sample, with the read counts and base metrics."""
+        stats = self._read_csv(DEMULTIPLEX_STATS)
+        stats = stats.rename(
+            columns={
+                "# Reads": "reads",
+                "# Perfect Index Reads": "perfect",
+                "# One Mismatch Index Reads": "one_mismatch",
+            }
+        )
+        if "Sample_Project" not in stats.columns:
+            stats["Sample_Project"] = ""
+        stats = stats.groupby(
+            ["Lane", "SampleID", "Sample_Project", "Index"], as_index=False, sort=False
+        )[["reads", "perfect", "one_mismatch"]].sum()
+
+        metrics = self._read_csv(QUALITY_METRICS)
+        # Index reads are not part of the yield of the html reports
+        metrics = metrics[pd.to_numeric(metrics["ReadNumber"], errors="coerce").notna()]
+        metrics = metrics.rename(
+            columns={
+                "Yield": "yield",
+                "YieldQ30": "yield_q30",
+                "QualityScoreSum": "qscore_sum",
+            }
+        )
+        metrics = metrics.groupby(["Lane", "SampleID"], as_index=False, sort=False)[
+            ["yield", "yield_q30", "qscore_sum"]
+        ].sum()
+
+        barcodes = stats.merge(metrics, on=["Lane", "SampleID"], how="left")
+        barcodes[_SUMMED] = barcodes[_SUMMED].fillna(0).astype("int64")
+
+        names = {
+            (row["Lane"], row["Sample_ID"]): (row["Sample_Project"], row["Sample_Name"])
+            for row in samplesheet_data
+        }
+        undetermined = barcodes["SampleID"] == UNDETERMINED_SAMPLE
+        keys = list(zip(barcodes["Lane"], barcodes["SampleID"]))
+        barcodes["Project"] = [
+            names.get(key, (project, None))[0]
+            for key, project in zip(keys, barcodes["Sample_Project"])
+        ]
+        barcodes["Sample"] = [
+            names.get(key, (None, key[1]))[1] or key[1] for key in keys
+        ]
+        barcodes["Barcode sequence"] = barcodes["Index"]
+        barcodes.loc[undetermined, "Project"] = UNDETERMINED_PROJECT
+        barcodes.loc[undetermined, "Sample"] = UNDETERMINED_SAMPLE
+        barcodes.loc[undetermined, "Barcode sequence"] = UNDETERMINED_BARCODE
+        barcodes["lane_reads"] = barcodes.groupby("Lane")["reads"].transform("sum")
+        barcodes["undetermined"] = undetermined
+        return barcodes
+
+    def _load_lanes(self, tile_metrics):
+        """One row per lane, the perfect and one mismatch barcodes are over all reads."""
+        identified = self.barcodes[~self.barcodes["undetermined"]]
+        lanes = self.barcodes.groupby("Lane", sort=False)[_SUMMED].sum()
+        lanes[["perfect", "one_mismatch"]] = (
+            identified.groupby("Lane", sort=False)[["perfect", "one_mismatch"]]
+            .sum()
+            .reindex(lanes.index, fill_value=0)
+        )
+        lanes["lane_reads"] = lanes["reads"]
+        lanes = lanes.reset_index()
+        lane_metrics = [tile_metrics.get(lane, {}) for lane in lanes["Lane"]]
+        lanes["clusters_raw"] = pd.array(
+            [metrics.get("clusters") for metrics in lane_metrics], dtype="Int64"
+        )
+        lanes["percent_pf"] = pd.array(
+            [metrics.get("percent_pf") for metrics in lane_metrics], dtype="Float64"
+        )
+        return lanes
+
+    @property
+    def flowcell_data(self):
+        """The Flowcell Summary, without raw clusters if not known for all lanes."""
+        clusters_pf = int(self.lanes["reads"].sum())
+        yield_mbases = int(round(self.lanes["yield"].sum() / 1e6))
+        flowcell_data = {}
+        if self.lanes["clusters_raw"].notna().all():
+            flowcell_data["Clusters (Raw)"] = (
+                f"{int(self.lanes['clusters_raw'].sum()):,}"
+            )
+        flowcell_data["Clusters(PF)"] = f"{clusters_pf:,}"
+        flowcell_data["Yield (MBases)"] = f"{yield_mbases:,}"
+        return flowcell_data
+
+    def lane_table(self):
+        """The table of lane.html."""
+        lanes = self.lanes.sort_values("Lane", key=lambda lane: lane.astype(int))
+        return LaneTable(_format_table(lanes, LANE_COLUMNS), self.flowcell_data)
+
+    def laneBarcode_table(self):
+        """The table of laneBarcode.html, sorted by lane and sample."""
+        barcodes = self.barcodes.sort_values(["Lane", "Sample"])
+        return LaneTable(
+            _format_table(barcodes, LANE_BARCODE_COLUMNS), self.flowcell_data
+        )
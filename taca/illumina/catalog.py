@@ -0,0 +1,118 @@
+"""SQLite-backed catalog of the last known state of Illumina runs.
+
+The catalog stores, for every run id, the status reached at the end of the last
+processing cycle together with a fingerprint (mtime and size) of the sentinel
+files that status depends on. Runs whose fingerprint has not moved since can be
+skipped without instantiating Run objects or parsing any run metadata.
+"""
+
+import contextlib
+import glob
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Files and folders, relative to the run folder, whose state determines the run status
+SENTINEL_PATTERNS = [
+    "RTAComplete.txt",
+    "CopyComplete.txt",
+    "transferring",
+    "Demultiplexing",
+    "Demultiplexing*/Stats",
+    "Demultiplexing*/Reports/legacy/Stats",
+    "demux_*.err",
+]
+
+# Statuses in which nothing happens to a run unless something changes on disk.
+# Sequencing runs are not skipped: their progress is uploaded to statusdb at
+# every cycle, while none of the sentinel files change.
+DEFAULT_SKIP_STATUSES = ["IN_PROGRESS", "TRANSFERRED"]
+
+
+def run_fingerprint(run_dir):
+    """Return a string summarising the mtime and size of the run sentinel files.
+
+    :param str run_dir: Path to the run folder
+    :rtype: str
+    """
+    entries = []
+    for pattern in SENTINEL_PATTERNS:
+        for path in glob.glob(os.path.join(run_dir, pattern)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed while we were looking at it
+                continue
+            entries.append(
+                [os.path.relpath(path, run_dir), stat.st_mtime_ns, stat.st_size]
+            )
+    return json.dumps(sorted(entries))
+
+
+class RunCatalog:
+    """Persistent run id -> (status, fingerprint) mapping."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_id TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, "
+                "fingerprint TEXT NOT NULL, "
+                "updated TEXT NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Several TACA processes may share the catalog, wait for each other's locks
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, run_id):
+        """Return (status, fingerprint) recorded for run_id, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status, fingerprint FROM runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def update(self, run_id, status, fingerprint):
+        """Record the status and fingerprint of run_id."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO runs (run_id, status, fingerprint, updated) "
+                "VALUES (?, ?, ?, ?)",
+                (run_id, status, fingerprint, str(datetime.now())),
+            )
+
+    def remove(self, run_id):
+        """Forget about run_id, e.g. once it has been archived."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+    def is_unchanged(self, run_id, fingerprint, statuses=DEFAULT_SKIP_STATUSES):
+        """Check whether run_id can be skipped.
+
+        :param str run_id: The run id
+        :param str fingerprint: Current fingerprint, see run_fingerprint
+        :param list statuses: Statuses for which an unchanged run can be skipped
+        :returns: True if the last recorded status is one of statuses and the
+            fingerprint has not changed since it was recorded
+        """
+        record = self.get(run_id)
+        if record is None:
+            return False
+        status, last_fingerprint = record
+        return status in statuses and last_fingerprint == fingerprint
@@ -0,0 +1,115 @@
+"""Executors starting the bcl2fastq/bcl-convert jobs of a run.
+
+A job is a sub-demultiplexing, or one lane of it when its lanes are split. Its
+id names its log files, demux_<job_id>_<software>.out/.err in the run folder,
+and whether it is done is read from its output folder, so executors only
+have to start jobs:
+
+- LocalExecutor starts them on this host, right away as detached processes or
+  through the DemuxScheduler queue when one is configured
+- BatchExecutor writes a job script and hands it to a batch scheduler with a
+  configurable submit command, e.g. sbatch
+"""
+
+import logging
+import os
+import shlex
+import subprocess
+from datetime import datetime
+
+from taca.utils import misc
+from taca.utils.filesystem import chdir, write_atomically
+
+logger = logging.getLogger(__name__)
+
+
+class DemuxExecutor:
+    """Interface of the executors of demultiplexing jobs."""
+
+    def submit(self, run_id, run_dir, job_id, cmd, software, cost):
+        """Start, or queue, a demultiplexing job.
+
+        :param str run_id: The run id
+        :param str run_dir: Run folder, the command is started from it
+        :param str job_id: Id of the job, e.g. 1 or 1_L2 for lane 2 of demux 1
+        :param list cmd: The command line
+        :param str software: bcl2fastq or bclconvert
+        :param float cost: Estimate of how long the command runs
+        """
+        raise NotImplementedError("Please Implement this method")
+
+
+class LocalExecutor(DemuxExecutor):
+    """Start jobs on this host.
+
+    :param DemuxScheduler scheduler: Queue admitting the jobs within the CPU
+        and memory budget of the host, jobs are started right away if None
+    """
+
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler
+
+    def submit(self, run_id, run_dir, job_id, cmd, software, cost):
+        if self.scheduler:
+            self.scheduler.enqueue(run_id, run_dir, job_id, cmd, software, cost)
+            return
+        with chdir(run_dir):
+            misc.call_external_command_detached(
+                cmd, with_log_files=True, prefix=f"demux_{job_id}"
+            )
+        logger.info(
+            "BCL to FASTQ conversion and demultiplexing "
+            f"started for job {job_id} of run {run_id} on {datetime.now()}"
+        )
+
+
+class BatchExecutor(DemuxExecutor):
+    """Submit jobs to a batch scheduler.
+
+    Each job is written to demux_<job_id>.sh in the run folder, which is passed
+    as last argument to the submit command.
+
+    :param submit_command: Command submitting a job script, as a list or a
+        string, e.g. "sbatch --parsable -p demux"
+    """
+
+    def __init__(self, submit_command):
+        if isinstance(submit_command, str):
+            submit_command = shlex.split(submit_command)
+        self.submit_command = list(submit_command)
+
+    def job_script(self, run_dir, job_id, cmd):
+        """Return the contents of the script of a job."""
+        log_prefix = os.path.join(run_dir, f"demux_{job_id}_{os.path.basename(cmd[0])}")
+        return (
+            "#!/bin/bash\n"
+            f"cd {shlex.quote(run_dir)}\n"
+            f'echo "Started command {shlex.join(cmd)} on $(date)" '
+            f">> {shlex.quote(log_prefix + '.out')}\n"
+            f"exec {shlex.join(cmd)} >> {shlex.quote(log_prefix + '.out')} "
+            f"2>> {shlex.quote(log_prefix + '.err')}\n"
+        )
+
+    def submit(self, run_id, run_dir, job_id, cmd, software, cost):
+        """Submit a job.
+
+        :returns: The output of the submit command, e.g. the batch job id
+        """
+        script = os.path.join(run_dir, f"demux_{job_id}.sh")
+        write_atomically(script, self.job_script(run_dir, job_id, cmd))
+        os.chmod(script, 0o755)
+        try:
+            submitted = subprocess.run(
+                self.submit_command + [script],
+                cwd=run_dir,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(
+                f"Could not submit job {job_id} of run {run_id}: {e.stderr.strip()}"
+            )
+        batch_job = submitted.stdout.strip()
+        logger.info(f"Submitted job {job_id} of run {run_id} as batch job {batch_job}")
+        return batch_job
@@ -0,0 +1,141 @@
+"""Incremental scanning of bcl2fastq and bcl-convert logs.
+
+The demux logs of large flowcells grow huge and are checked on every
+processing cycle until the sub-demultiplexing is done. DemuxLogScanner keeps
+the byte offset reached and the running counters in a JSON sidecar next to the
+log, so that each scan only reads what has been appended since the last one.
+Only the first and last messages are kept, for the summary email.
+"""
+
+import json
+import logging
+import os
+import re
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+BCL2FASTQ_SUMMARY_PAT = re.compile(
+    r"Processing completed with (\d+) errors and (\d+) warnings"
+)
+SIDECAR_SUFFIX = ".scan.json"
+
+
+class DemuxLogScanner:
+    """Checkpointed scanner of a bcl2fastq or bcl-convert log file.
+
+    :param str log_path: Path to the log, e.g. demux_0_bcl-convert.err
+    :param str software: bcl2fastq or bclconvert
+    :param int keep: Number of first and last messages to keep
+    """
+
+    def __init__(self, log_path, software, keep=5):
+        if software not in ("bcl2fastq", "bclconvert"):
+            raise RuntimeError("Unrecognized software!")
+        self.log_path = log_path
+        self.software = software
+        self.keep = keep
+        self.sidecar_path = log_path + SIDECAR_SUFFIX
+
+    def _empty_state(self, stat):
+        return {
+            "software": self.software,
+            "inode": stat.st_ino,
+            "offset": 0,
+            "errors": 0,
+            "warnings": 0,
+            "message_count": 0,
+            "first_messages": [],
+            "last_messages": [],
+            "last_line": "",
+        }
+
+    def _load_state(self, stat):
+        try:
+            with open(self.sidecar_path) as sidecar:
+                state = json.load(sidecar)
+        except (OSError, ValueError):
+            return self._empty_state(stat)
+        if (
+            state.get("software") != self.software
+            or state.get("inode") != stat.st_ino
+            or state.get("offset", 0) > stat.st_size
+        ):
+            # The log has been replaced or truncated, e.g. demultiplexing restarted
+            return self._empty_state(stat)
+        return state
+
+    def _save_state(self, state):
+        tmp_path = self.sidecar_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as sidecar:
+                json.dump(state, sidecar)
+            os.replace(tmp_path, self.sidecar_path)
+        except OSError as e:
+            # The next scan will just have to start over
+            logger.warning(
+                f"Could not save demux log checkpoint {self.sidecar_path}: {e}"
+            )
+
+    def _scan_line(self, state, line, last_messages):
+        if self.software == "bcl2fastq":
+            is_message = "ERROR" in line or "WARN" in line
+        elif "ERROR" in line:
+            state["errors"] += 1
+            is_message = True
+        elif "WARNING" in line:
+            state["warnings"] += 1
+            is_message = True
+        else:
+            is_message = False
+        if is_message:
+            state["message_count"] += 1
+            if len(state["first_messages"]) < self.keep:
+                state["first_messages"].append(line)
+            last_messages.append(line)
+
+    def scan(self, complete=False):
+        """Read what has been appended to the log since the last scan.
+
+        A last line without a newline is left for the next scan, as it may
+        still be being written, unless the log is complete.
+
+        :param bool complete: Whether the job writing the log is done
+        :returns: (errors, warnings, first_messages, last_messages, message_count)
+        """
+        stat = os.stat(self.log_path)
+        state = self._load_state(stat)
+        last_messages = deque(state["last_messages"], maxlen=self.keep)
+        partial_line = ""
+        with open(self.log_path, "rb") as log_file:
+            log_file.seek(state["offset"])
+            for raw_line in log_file:
+                line = raw_line.decode(errors="replace")
+                if not raw_line.endswith(b"\n") and not complete:
+                    # Still being written, leave it for the next scan
+                    partial_line = line
+                    break
+                state["offset"] += len(raw_line)
+                state["last_line"] = line
+                self._scan_line(state, line, last_messages)
+        state["last_messages"] = list(last_messages)
+        self._save_state(state)
+
+        errors, warnings = state["errors"], state["warnings"]
+        if self.software == "bcl2fastq":
+            # Totals are only available from the final line of the log
+            match = BCL2FASTQ_SUMMARY_PAT.search(partial_line or state["last_line"])
+            if not match:
+                raise RuntimeError(
+                    f"Bad format with log file {os.path.basename(self.log_path)}"
+                )
+            errors, warnings = int(match.group(1)), int(match.group(2))
+            if not (errors or warnings):
+                return errors, warnings, [], [], 0
+        return (
+            errors,
+            warnings,
+            list(state["first_messages"]),
+            list(state["last_messages"]),
+            state["message_count"],
+        )
@@ -0,0 +1,153 @@
+"""Planning of the sub-demultiplexings of a run.
+
+The samples of the sample table are grouped in a single pass by sample type
+and mask, i.e. (index_length, umi_length, read_length), into
+(sample_type, index_length, umi_length, read_length) -> {lane: [samples]}.
+Each sub-demultiplexing then takes one mask per lane for a sample type:
+
+- bcl2fastq: the Nth mask of each lane, as bcl2fastq takes a base mask per lane
+- bclconvert: all the lanes with a given mask, as bcl-convert takes one mask
+
+The plan is written to demux_plan.json in the run folder, together with a
+fingerprint of the sample table it was computed from, so that it can be reused
+when checking the status of the run or when demultiplexing again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from taca.utils.filesystem import write_atomically
+
+logger = logging.getLogger(__name__)
+
+DEMUX_PLAN = "demux_plan.json"
+
+
+def _mask(sample_detail):
+    return tuple(
+        tuple(sample_detail[key])
+        for key in ("index_length", "umi_length", "read_length")
+    )
+
+
+def group_samples(sample_table):
+    """Group the samples of a sample table by sample type and mask.
+
+    :param dict sample_table: {lane: [(sample_name, sample_detail)]} as built
+        by _classify_samples
+    :returns: (groups, lane_masks) where groups maps
+        (sample_type, index_length, umi_length, read_length) to {lane: [samples]},
+        and lane_masks maps each sample type to {lane: [masks]}, with the masks
+        of each lane in order of appearance
+    """
+    groups = {}
+    lane_masks = {}
+    for lane, lane_contents in sample_table.items():
+        for sample_name, sample_detail in lane_contents:
+            sample_type = sample_detail["sample_type"]
+            mask = _mask(sample_detail)
+            lanes = groups.setdefault((sample_type,) + mask, {})
+            lanes.setdefault(lane, []).append(sample_name)
+            # Dicts as ordered sets
+            lane_masks.setdefault(sample_type, {}).setdefault(lane, {})[mask] = None
+    return groups, {
+        sample_type: {lane: list(masks) for lane, masks in lanes.items()}
+        for sample_type, lanes in lane_masks.items()
+    }
+
+
+def sample_table_fingerprint(sample_table, software):
+    """Hash of the sample table and software a plan is computed from."""
+    encoded = json.dumps([software, sample_table], sort_keys=True)
+    return hashlib.sha1(encoded.encode()).hexdigest()
+
+
+def plan_demux(sample_table, software):
+    """Plan the sub-demultiplexings of a run.
+
+    :param dict sample_table: The sample table of the run
+    :param str software: bcl2fastq or bclconvert
+    :returns: The plan, with a list of sub-demultiplexings in order, each
+        with its demux_id, sample_type, mask_table ({lane: mask}),
+        samples_to_include ({lane: [samples]}) and, for bclconvert, its mask
+    """
+    if software not in ("bcl2fastq", "bclconvert"):
+        raise RuntimeError("Unrecognized software!")
+    groups, lane_masks = group_samples(sample_table)
+    demuxes = []
+    for sample_type in sorted(lane_masks):
+        lane_table = lane_masks[sample_type]
+        if software == "bcl2fastq":
+            # As many sub-demultiplexings as masks in the lane with the most
+            rounds = [
+                (
+                    None,
+                    {
+                        lane: masks[i]
+                        for lane, masks in lane_table.items()
+                        if i < len(masks)
+                    },
+                )
+                for i in range(max(len(masks) for masks in lane_table.values()))
+            ]
+        else:
+            # One sub-demultiplexing per mask
+            unique_masks = dict.fromkeys(
+                mask for masks in lane_table.values() for mask in masks
+            )
+            rounds = [
+                (
+                    mask,
+                    {lane: mask for lane, masks in lane_table.items() if mask in masks},
+                )
+                for mask in unique_masks
+            ]
+        for mask, mask_table in rounds:
+            demuxes.append(
+                {
+                    "demux_id": len(demuxes),
+                    "sample_type": sample_type,
+                    "mask": mask,
+                    "mask_table": mask_table,
+                    "samples_to_include": {
+                        lane: groups[(sample_type,) + lane_mask][lane]
+                        for lane, lane_mask in mask_table.items()
+                    },
+                }
+            )
+    return {
+        "software": software,
+        "fingerprint": sample_table_fingerprint(sample_table, software),
+        "demuxes": demuxes,
+    }
+
+
+def write_demux_plan(run_dir, plan):
+    write_atomically(os.path.join(run_dir, DEMUX_PLAN), json.dumps(plan, indent=1))
+
+
+def load_demux_plan(run_dir, sample_table=None, software=None):
+    """Load the demux plan of a run.
+
+    :param str run_dir: The run folder
+    :param dict sample_table: If given, the plan is only returned if it was
+        computed from this sample table and software
+    :param str software: bcl2fastq or bclconvert
+    :returns: The plan, or None if there is no usable plan
+    """
+    try:
+        with open(os.path.join(run_dir, DEMUX_PLAN)) as plan_file:
+            plan = json.load(plan_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read the demux plan of {run_dir}: {e}")
+        return None
+    if sample_table is not None and plan.get("fingerprint") != sample_table_fingerprint(
+        sample_table, software
+    ):
+        logger.info(f"The demux plan of {run_dir} is outdated")
+        return None
+    return plan
@@ -0,0 +1,270 @@
+"""Resource-aware queue of sub-demultiplexing jobs shared by all runs.
+
+Instead of starting every bcl2fastq/bcl-convert command as soon as its
+sub-samplesheet is written, commands are queued in an SQLite database in the
+status dir and admitted while their CPU and memory requirements fit within the
+configured budget of the preprocessing node. The jobs with the largest
+estimated cost are admitted first. The queue survives TACA restarts, and the
+jobs that have been started are followed by pid and process start time, so
+that a pid reused by another process after a reboot is not taken for the job.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+from taca.utils import misc
+from taca.utils.filesystem import chdir
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+FINISHED = "FINISHED"
+
+# Command line options setting the number of threads of each software
+THREAD_OPTIONS = {
+    "bcl2fastq": ["--loading-threads", "--processing-threads", "--writing-threads"],
+    "bclconvert": [
+        "--bcl-num-conversion-threads",
+        "--bcl-num-compression-threads",
+        "--bcl-num-decompression-threads",
+    ],
+}
+
+
+def command_cpus(cmd, software, default=1):
+    """Return the number of CPUs a demultiplexing command is set up to use.
+
+    :param list cmd: The command line
+    :param str software: bcl2fastq or bclconvert
+    :param int default: CPUs to assume if no thread option is given
+    """
+    cpus = 0
+    for option in THREAD_OPTIONS.get(software, []):
+        if option in cmd[:-1]:
+            try:
+                cpus += int(cmd[cmd.index(option) + 1])
+            except ValueError:
+                continue
+    return cpus or default
+
+
+def _pid_start_time(pid):
+    """Return the start time of a process from /proc, None if not available."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # The fields after the command name, which may hold spaces, start with the
+    # third one. The start time is the 22nd, in clock ticks since boot
+    return int(stat.rpartition(")")[2].split()[19])
+
+
+def _pid_alive(pid, start_time=None):
+    """Return True if the process pid, started at start_time if known, is running."""
+    try:
+        # Reap it if it is a child of this process, e.g. under `taca analysis watch`
+        reaped_pid, _ = os.waitpid(pid, os.WNOHANG)
+        return reaped_pid == 0
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if start_time is not None:
+        current_start_time = _pid_start_time(pid)
+        if current_start_time is not None and current_start_time != start_time:
+            # The pid has been reused by another process
+            return False
+    return True
+
+
+def _launch(job):
+    """Start a queued job the way demultiplex_run used to, return its pid."""
+    with chdir(job["run_dir"]):
+        p_handle = misc.call_external_command_detached(
+            job["cmd"], with_log_files=True, prefix=f"demux_{job['demux_id']}"
+        )
+    return p_handle.pid
+
+
+class DemuxScheduler:
+    """Queue of sub-demultiplexing jobs admitted within CPU and memory budgets.
+
+    :param str db_path: Path to the SQLite database holding the queue
+    :param int cpus: Number of CPUs demultiplexing jobs may use in total
+    :param float mem_gb: Memory in GB demultiplexing jobs may use in total
+    :param int job_cpus: CPUs of a job whose command sets no thread options
+    :param float job_mem_gb: Memory in GB used by each job
+    :param launch: Function starting a job and returning its pid
+    """
+
+    def __init__(self, db_path, cpus, mem_gb, job_cpus=1, job_mem_gb=0, launch=_launch):
+        self.db_path = db_path
+        self.cpus = cpus
+        self.mem_gb = mem_gb
+        self.job_cpus = job_cpus
+        self.job_mem_gb = job_mem_gb
+        self.launch = launch
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "run_id TEXT NOT NULL, "
+                "demux_id TEXT NOT NULL, "
+                "run_dir TEXT NOT NULL, "
+                "cmd TEXT NOT NULL, "
+                "cpus INTEGER NOT NULL, "
+                "mem_gb REAL NOT NULL, "
+                "cost REAL NOT NULL, "
+                "state TEXT NOT NULL, "
+                "pid INTEGER, "
+                "pid_start_time INTEGER, "
+                "queued TEXT, "
+                "started TEXT, "
+                "finished TEXT, "
+                "PRIMARY KEY (run_id, demux_id))"
+            )
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "pid_start_time" not in columns:
+                # Queue created before start times were kept
+                conn.execute("ALTER TABLE jobs ADD COLUMN pid_start_time INTEGER")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            # Only one TACA process at a time may admit jobs
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def enqueue(self, run_id, run_dir, demux_id, cmd, software, cost):
+        """Queue a sub-demultiplexing command, replacing any earlier one.
+
+        :param str run_id: The run id
+        :param str run_dir: Run folder, the command is started from it
+        :param demux_id: Number of the sub-demultiplexing (N in SampleSheet_N.csv)
+        :param list cmd: The command line
+        :param str software: bcl2fastq or bclconvert
+        :param float cost: Estimate of how long the command runs, longest first
+        """
+        cpus = command_cpus(cmd, software, self.job_cpus)
+        mem_gb = self.job_mem_gb
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (run_id, demux_id, run_dir, cmd, cpus, "
+                "mem_gb, cost, state, queued) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    str(demux_id),
+                    run_dir,
+                    json.dumps(cmd),
+                    cpus,
+                    mem_gb,
+                    cost,
+                    QUEUED,
+                    str(datetime.now()),
+                ),
+            )
+        logger.info(
+            f"Queued sub-demultiplexing {demux_id} of run {run_id} "
+            f"({cpus} CPUs, {mem_gb} GB)"
+        )
+
+    def schedule(self):
+        """Update the state of started jobs and start the queued jobs that fit.
+
+        :returns: List of (run_id, demux_id) of the jobs started
+        """
+        started = []
+        with self._connect() as conn:
+            used_cpus = 0
+            used_mem = 0.0
+            running = conn.execute(
+                "SELECT * FROM jobs WHERE state = ?", (RUNNING,)
+            ).fetchall()
+            for job in running:
+                if _pid_alive(job["pid"], job["pid_start_time"]):
+                    used_cpus += job["cpus"]
+                    used_mem += job["mem_gb"]
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET state = ?, finished = ? "
+                        "WHERE run_id = ? AND demux_id = ?",
+                        (FINISHED, str(datetime.now()), job["run_id"], job["demux_id"]),
+                    )
+            queued = conn.execute(
+                "SELECT * FROM jobs WHERE state = ? ORDER BY cost DESC, queued",
+                (QUEUED,),
+            ).fetchall()
+            for job in queued:
+                if not os.path.exists(job["run_dir"]):
+                    # The run has been removed or archived in the meantime
+                    conn.execute(
+                        "DELETE FROM jobs WHERE run_id = ? AND demux_id = ?",
+                        (job["run_id"], job["demux_id"]),
+                    )
+                    continue
+                fits = (
+                    used_cpus + job["cpus"] <= self.cpus
+                    and used_mem + job["mem_gb"] <= self.mem_gb
+                )
+                # A job larger than the whole budget still runs, on its own
+                if not fits and (used_cpus or used_mem):
+                    continue
+                job = dict(job)
+                job["cmd"] = json.loads(job["cmd"])
+                pid = self.launch(job)
+                conn.execute(
+                    "UPDATE jobs SET state = ?, pid = ?, pid_start_time = ?, "
+                    "started = ? WHERE run_id = ? AND demux_id = ?",
+                    (
+                        RUNNING,
+                        pid,
+                        _pid_start_time(pid),
+                        str(datetime.now()),
+                        job["run_id"],
+                        job["demux_id"],
+                    ),
+                )
+                used_cpus += job["cpus"]
+                used_mem += job["mem_gb"]
+                started.append((job["run_id"], job["demux_id"]))
+                logger.info(
+                    f"Started sub-demultiplexing {job['demux_id']} of run "
+                    f"{job['run_id']} on {datetime.now()}"
+                )
+        return started
+
+    def job_states(self, run_id):
+        """Return a dict of demux_id -> state of the jobs of run_id."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT demux_id, state FROM jobs WHERE run_id = ?", (run_id,)
+            ).fetchall()
+        return {row["demux_id"]: row["state"] for row in rows}
+
+    def has_pending(self, run_id):
+        """Return True if run_id has jobs that are queued or running."""
+        return any(
+            state in (QUEUED, RUNNING) for state in self.job_states(run_id).values()
+        )
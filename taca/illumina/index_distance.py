@@ -0,0 +1,135 @@
+"""Pre-flight check of the index distances of the samples of a demultiplexing.
+
+The index and index2 sequences of the samples of a lane are encoded as uint8
+arrays and compared all against all, giving the Hamming distance matrices of
+index 1 and index 2. Two samples collide when their indexes are identical.
+With m1 and m2 mismatches allowed, two samples are ambiguous when their index 1
+are within 2 * m1 of each other and their index 2 within 2 * m2, which is what
+bcl2fastq and bcl-convert refuse. The largest numbers of mismatches, up to the
+configured ones, that keep all samples of the lane apart are derived from that.
+Rows of a same sample, e.g. the four indexes of a 10X single index set, are
+not compared with each other.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Mismatches allowed by bcl2fastq and bcl-convert when not configured
+DEFAULT_BARCODE_MISMATCHES = 1
+COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+
+def reverse_complement(sequence):
+    return sequence.translate(COMPLEMENT)[::-1]
+
+
+def encode_indexes(indexes, length):
+    """Encode index sequences as a (number of indexes, length) uint8 array.
+
+    Sequences are truncated or padded with N to length.
+    """
+    padded = "".join(index[:length].upper().ljust(length, "N") for index in indexes)
+    return np.frombuffer(padded.encode("ascii"), dtype=np.uint8).reshape(
+        len(indexes), length
+    )
+
+
+def hamming_distances(encoded):
+    """Pairwise Hamming distances between the rows of an encoded index array."""
+    return (encoded[:, None, :] != encoded[None, :, :]).sum(axis=2, dtype=np.int32)
+
+
+def check_lane_indexes(samples, index1_size, index2_size, max_mismatches=(1, 1)):
+    """Check the indexes of the samples of a lane.
+
+    :param list samples: (sample, index, index2) of each samplesheet row
+    :param int index1_size: Number of index 1 cycles used to demultiplex
+    :param int index2_size: Number of index 2 cycles used to demultiplex
+    :param tuple max_mismatches: Mismatches configured for index 1 and 2
+    :returns: dict with collisions, the list of pairs of samples with the same
+        indexes, min_distance, the smallest distances of index 1 and 2 between
+        different samples, and barcode_mismatches, the safe number of
+        mismatches for index 1 and 2
+    """
+    names = np.array([sample for sample, _, _ in samples], dtype=object)
+    distance1 = hamming_distances(
+        encode_indexes([index for _, index, _ in samples], index1_size)
+    )
+    distance2 = hamming_distances(
+        encode_indexes([index2 for _, _, index2 in samples], index2_size)
+    )
+    # Each pair of rows of different samples once
+    pairs = np.triu(names[:, None] != names[None, :], k=1)
+    distance1 = distance1[pairs]
+    distance2 = distance2[pairs]
+    first, second = np.nonzero(pairs)
+
+    colliding = (distance1 == 0) & (distance2 == 0)
+    collisions = sorted(
+        {(names[i], names[j]) for i, j in zip(first[colliding], second[colliding])}
+    )
+    barcode_mismatches = (0, 0)
+    if not collisions:
+        # Most mismatches in total first, then most on index 1. The mismatches
+        # of an index that is not read stay as configured, as it never differs
+        candidates = sorted(
+            (
+                (m1, m2)
+                for m1 in range(max_mismatches[0] + 1)
+                for m2 in range(max_mismatches[1] + 1)
+            ),
+            key=lambda m: (m[0] + m[1], m[0]),
+            reverse=True,
+        )
+        for m1, m2 in candidates:
+            if not np.any((distance1 <= 2 * m1) & (distance2 <= 2 * m2)):
+                barcode_mismatches = (m1, m2)
+                break
+    return {
+        "collisions": collisions,
+        "min_distance": (
+            int(distance1.min()) if distance1.size else None,
+            int(distance2.min()) if distance2.size else None,
+        ),
+        "barcode_mismatches": barcode_mismatches,
+    }
+
+
+def check_demux_indexes(
+    samplesheet_data, samples_to_include, mask_table, max_mismatches=(1, 1)
+):
+    """Check the indexes of each lane of a sub-demultiplexing.
+
+    :param list samplesheet_data: Rows of the (clean) samplesheet of the run
+    :param dict samples_to_include: {lane: [sample names]} of the demux
+    :param dict mask_table: {lane: (index_length, umi_length, read_length)}
+    :param tuple max_mismatches: Mismatches configured for index 1 and 2
+    :returns: {lane: result of check_lane_indexes}
+    """
+    lane_samples = {lane: [] for lane in samples_to_include}
+    for row in samplesheet_data:
+        lane = row["Lane"]
+        sample_name = row.get("Sample_Name") or row.get("SampleName")
+        if sample_name not in samples_to_include.get(lane, ()):
+            continue
+        if "NOINDEX" in row.get("index", "").upper():
+            # Fake indexes are given to the single sample of the lane
+            continue
+        lane_samples[lane].append(
+            (
+                row.get("Sample_ID") or sample_name,
+                # UMIs are not part of the index
+                row.get("index", "").replace("N", ""),
+                row.get("index2", "").replace("N", ""),
+            )
+        )
+    results = {}
+    for lane, samples in lane_samples.items():
+        index_length = mask_table[lane][0]
+        results[lane] = check_lane_indexes(
+            samples, int(index_length[0]), int(index_length[1]), max_mismatches
+        )
+    return results
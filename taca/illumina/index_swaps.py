@@ -0,0 +1,179 @@
+"""Detection of samples demultiplexed with the wrong index orientation.
+
+When the index2 of a sample is given in the wrong orientation, or index and
+index2 are swapped, its reads do not match its indexes and end up among the
+top unknown barcodes of its lane. After demultiplexing, the unknown barcodes
+of each lane are encoded as uint8 arrays, as in taca.illumina.index_distance,
+and compared all against all with the variants of the expected index pairs of
+the lane: index and/or index2 reverse complemented, index and index2 swapped,
+and swapped and reverse complemented. The reads of the unknown barcodes
+matching a variant of a sample, within the mismatches allowed, are summed,
+and a sample is reported when a variant collects at least min_hits reads and
+at least min_fraction of the reads assigned to the sample itself.
+"""
+
+import logging
+
+import numpy as np
+
+from taca.illumina.index_distance import encode_indexes, reverse_complement
+
+logger = logging.getLogger(__name__)
+
+INDEX_SWAPS_REPORT = "index_swaps.json"
+DEFAULT_MIN_HITS = 1000
+DEFAULT_MIN_FRACTION = 0.5
+
+
+def index_variants(index, index2):
+    """Return {variant: (index, index2)} of the misoriented variants of a pair."""
+    if not index2:
+        return {"index reverse complemented": (reverse_complement(index), "")}
+    return {
+        "index2 reverse complemented": (index, reverse_complement(index2)),
+        "index reverse complemented": (reverse_complement(index), index2),
+        "both reverse complemented": (
+            reverse_complement(index),
+            reverse_complement(index2),
+        ),
+        "index and index2 swapped": (index2, index),
+        "swapped and reverse complemented": (
+            reverse_complement(index2),
+            reverse_complement(index),
+        ),
+    }
+
+
+def _split_barcode(barcode):
+    index, _, index2 = barcode.partition("+")
+    return index, index2
+
+
+def _lane_hits(barcodes, counts, expected, max_mismatches):
+    """Reads of the unknown barcodes matching each expected pair.
+
+    :param list barcodes: (index, index2) of the unknown barcodes, all of the
+        same lengths
+    :param counts: Reads of each unknown barcode
+    :param list expected: (index, index2) of the expected pairs
+    :returns: Array of the reads matching each expected pair
+    """
+    length1 = len(barcodes[0][0])
+    length2 = len(barcodes[0][1])
+    unknown1 = encode_indexes([index for index, _ in barcodes], length1)
+    expected1 = encode_indexes([index for index, _ in expected], length1)
+    matches = (unknown1[:, None, :] != expected1[None, :, :]).sum(
+        axis=2
+    ) <= max_mismatches
+    if length2:
+        unknown2 = encode_indexes([index2 for _, index2 in barcodes], length2)
+        expected2 = encode_indexes([index2 for _, index2 in expected], length2)
+        matches &= (unknown2[:, None, :] != expected2[None, :, :]).sum(
+            axis=2
+        ) <= max_mismatches
+    return counts @ matches
+
+
+def find_index_swaps(
+    unknown_barcodes,
+    samples,
+    assigned_reads=None,
+    max_mismatches=1,
+    min_hits=DEFAULT_MIN_HITS,
+    min_fraction=DEFAULT_MIN_FRACTION,
+):
+    """Find the samples whose reads are likely among the unknown barcodes.
+
+    :param list unknown_barcodes: {Lane, Barcodes} of each lane, as in
+        the UnknownBarcodes of Stats.json, barcodes being index+index2
+    :param dict samples: {lane: [(sample, index, index2)]} of the samplesheet
+    :param dict assigned_reads: {(lane, sample): reads assigned to the sample}
+    :param int max_mismatches: Mismatches allowed per index
+    :param int min_hits: Smallest number of reads of a variant to report it
+    :param float min_fraction: Smallest fraction of the reads assigned to the
+        sample for a variant to be reported
+    :returns: List of {lane, sample, variant, index, index2, hits, assigned},
+        sorted by lane and hits
+    """
+    assigned_reads = assigned_reads or {}
+    swaps = []
+    for lane_barcodes in unknown_barcodes:
+        lane = str(lane_barcodes["Lane"])
+        lane_samples = samples.get(lane, [])
+        if not lane_samples or not lane_barcodes["Barcodes"]:
+            continue
+        # The variants of all the samples of the lane, in one array
+        expected = []
+        for sample, index, index2 in lane_samples:
+            for variant, (variant1, variant2) in index_variants(index, index2).items():
+                if (variant1, variant2) != (index, index2):
+                    expected.append((sample, variant, variant1, variant2))
+        if not expected:
+            continue
+        # Unknown barcodes of different lengths, e.g. with and without index2
+        by_lengths = {}
+        for barcode, count in lane_barcodes["Barcodes"].items():
+            index, index2 = _split_barcode(barcode)
+            by_lengths.setdefault((len(index), len(index2)), []).append(
+                ((index, index2), count)
+            )
+        hits = np.zeros(len(expected), dtype=np.int64)
+        for barcodes_counts in by_lengths.values():
+            barcodes = [barcode for barcode, _ in barcodes_counts]
+            counts = np.array([count for _, count in barcodes_counts], dtype=np.int64)
+            hits += _lane_hits(
+                barcodes,
+                counts,
+                [(variant1, variant2) for _, _, variant1, variant2 in expected],
+                max_mismatches,
+            )
+        for (sample, variant, variant1, variant2), variant_hits in zip(
+            expected, hits.tolist()
+        ):
+            assigned = assigned_reads.get((lane, sample))
+            if variant_hits < min_hits:
+                continue
+            if assigned is not None and variant_hits < min_fraction * assigned:
+                continue
+            swaps.append(
+                {
+                    "lane": lane,
+                    "sample": sample,
+                    "variant": variant,
+                    "index": variant1,
+                    "index2": variant2,
+                    "hits": variant_hits,
+                    "assigned": assigned,
+                }
+            )
+    return sorted(swaps, key=lambda swap: (int(swap["lane"]), -swap["hits"]))
+
+
+def samplesheet_samples(samplesheet_data):
+    """Return {lane: [(sample, index, index2)]} of the rows of a samplesheet.
+
+    The Ns of the UMIs of IDT indexes are left out, as they are not part of
+    the barcodes.
+    """
+    samples = {}
+    for row in samplesheet_data:
+        index = row.get("index", "")
+        if not index or index.upper() == "NOINDEX":
+            continue
+        samples.setdefault(str(row["Lane"]), []).append(
+            (
+                row.get("Sample_ID", ""),
+                index.replace("N", ""),
+                row.get("index2", "").replace("N", ""),
+            )
+        )
+    return samples
+
+
+def stats_assigned_reads(conversion_results):
+    """Return {(lane, sample): reads} of the ConversionResults of Stats.json."""
+    return {
+        (str(lane["LaneNumber"]), sample["SampleId"]): sample["NumberReads"]
+        for lane in conversion_results
+        for sample in lane.get("DemuxResults", [])
+    }
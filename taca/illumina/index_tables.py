@@ -0,0 +1,118 @@
+"""Process-wide cache of the parsed 10X and Smart-seq index tables.
+
+The index files rarely change, yet every run used to re-read them at least
+twice per processing cycle. Parsed tables are cached per path and re-read only
+when the mtime or size of the file changes. The tables are immutable, so the
+same object can safely be shared by every run in the process.
+"""
+
+import logging
+import os
+import re
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+TENX_SINGLE_PAT = re.compile("SI-(?:GA|NA)-[A-H][1-9][0-2]?")
+TENX_DUAL_PAT = re.compile("SI-(?:TT|NT|NN|TN|TS)-[A-H][1-9][0-2]?")
+SMARTSEQ_PAT = re.compile("SMARTSEQ[1-9]?-[1-9][0-9]?[A-P]")
+
+_cache: dict[tuple[str, str], tuple[tuple[int, int], "IndexTable"]] = {}
+_cache_lock = threading.Lock()
+
+
+def _tenX_kind(name):
+    if TENX_SINGLE_PAT.findall(name):
+        return "10X_SINGLE"
+    elif TENX_DUAL_PAT.findall(name):
+        return "10X_DUAL"
+    return None
+
+
+class IndexTable(Mapping):
+    """Read-only mapping of index set name -> tuple of index sequences.
+
+    :param dict indexes: Index set name -> tuple of sequences (10X) or
+        tuple of (index, index2) tuples (Smart-seq)
+    :param kind: Function returning the sample type of an index set name
+    """
+
+    def __init__(self, indexes, kind):
+        self._indexes = MappingProxyType(indexes)
+        self.kinds = MappingProxyType({name: kind(name) for name in indexes})
+
+    def __getitem__(self, name):
+        return self._indexes[name]
+
+    def __iter__(self):
+        return iter(self._indexes)
+
+    def __len__(self):
+        return len(self._indexes)
+
+
+def _read_10X_indexes(indexfile):
+    indexes = {}
+    with open(indexfile) as f:
+        for line in f:
+            line_ = line.rstrip().split(",")
+            indexes[line_[0]] = tuple(line_[1:5])
+    return IndexTable(indexes, _tenX_kind)
+
+
+def _read_smartseq_indexes(indexfile):
+    indexes = {}
+    with open(indexfile) as f:
+        for line in f:
+            line_ = line.rstrip().split(",")
+            indexes.setdefault(line_[0], []).append((line_[1], line_[2]))
+    return IndexTable(
+        {name: tuple(pairs) for name, pairs in indexes.items()},
+        lambda name: "SMARTSEQ",
+    )
+
+
+def _load(reader, indexfile):
+    stat = os.stat(indexfile)
+    key = (reader.__name__, os.path.abspath(indexfile))
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is None or cached[0] != signature:
+            logger.debug(f"Parsing index file {indexfile}")
+            cached = (signature, reader(indexfile))
+            _cache[key] = cached
+    return cached[1]
+
+
+def load_10X_indexes(indexfile):
+    """Return the IndexTable of a 10X index file, e.g. Chromium_10X_indexes.txt."""
+    return _load(_read_10X_indexes, indexfile)
+
+
+def load_smartseq_indexes(indexfile):
+    """Return the IndexTable of a Smart-seq index file, e.g. Smart-seq3_v1.5.csv."""
+    return _load(_read_smartseq_indexes, indexfile)
+
+
+def index_kind(index, tenX_table):
+    """Return "10X_SINGLE", "10X_DUAL", "SMARTSEQ" or None for a samplesheet index.
+
+    Names of the 10X table are resolved with a dict lookup, only values that
+    look like index set names fall back to the regular expressions.
+
+    :param str index: The index column of a samplesheet row
+    :param IndexTable tenX_table: Table returned by load_10X_indexes
+    """
+    kind = tenX_table.kinds.get(index)
+    if kind:
+        return kind
+    if "SI-" in index:
+        kind = _tenX_kind(index)
+        if kind:
+            return kind
+    if "SMARTSEQ" in index and SMARTSEQ_PAT.findall(index):
+        return "SMARTSEQ"
+    return None
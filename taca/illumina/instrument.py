@@ -0,0 +1,141 @@
+"""Detection of the type of instrument a run comes from.
+
+The type is first derived from the run folder name, i.e. from the prefix of the
+instrument id (A00123 is a NovaSeq, LH00123 a NovaSeqXPlus...) or from the
+MiSeq flowcell ids, such as 000000000-ABCDE. Only when the name is not
+conclusive is (r|R)unParameters.xml read, with iterparse, stopping at the first
+element that tells the instrument type rather than parsing the whole file.
+Results are cached per run id for the lifetime of the process.
+"""
+
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+# As in Run.__init__: date, instrument id, run number, position and flowcell id
+RUN_NAME_PAT = re.compile(r"^(\d{6,8})_([ST-]*\w+\d+)_\d+_([AB]?)([A-Z0-9\-]+)$")
+# Instrument id prefixes, in order of precedence
+INSTRUMENT_ID_PATS = [
+    (re.compile(r"^LH\d+$"), "NovaSeqXPlus"),
+    (re.compile(r"^A\d+$"), "NovaSeq"),
+    (re.compile(r"^(VH|NS|NB)\d+$"), "NextSeq"),
+    (re.compile(r"^M\d+$"), "MiSeq"),
+    (re.compile(r"^ST-E\d+$"), "HiSeq X"),
+    (re.compile(r"^(D|SN|J|K)\d+$"), "HiSeq"),
+]
+# Substrings of the runParameters fields naming the instrument, in order of precedence
+INSTRUMENT_NAMES = [
+    ("NovaSeqXPlus", "NovaSeqXPlus"),
+    ("NovaSeq", "NovaSeq"),
+    ("NextSeq", "NextSeq"),
+    ("MiSeq", "MiSeq"),
+    ("HiSeq X", "HiSeq X"),
+    ("HiSeq", "HiSeq"),
+    ("TruSeq", "HiSeq"),
+]
+# runParameters fields naming the instrument, the first ones win
+SETUP_FIELDS = ["Flowcell", "ApplicationName"]
+TOP_LEVEL_FIELDS = ["InstrumentType", "ApplicationName", "Application"]
+
+_instruments: dict[str, str] = {}
+
+
+def classify_run_name(run_name):
+    """Return the instrument type of a run from its folder name, or None."""
+    m = RUN_NAME_PAT.match(run_name)
+    if not m:
+        return None
+    instrument_id = m.group(2)
+    for pattern, instrument in INSTRUMENT_ID_PATS:
+        if pattern.match(instrument_id):
+            return instrument
+    if "-" in m.group(4):
+        # MiSeq flowcell ids, e.g. 000000000-ABCDE
+        return "MiSeq"
+    return None
+
+
+def classify_instrument_name(name):
+    """Return the instrument type named in a runParameters field, or None."""
+    for substring, instrument in INSTRUMENT_NAMES:
+        if substring in name:
+            return instrument
+    return None
+
+
+def run_parameters_file(run_dir):
+    """Return the path of the runParameters.xml of a run, or None."""
+    for name in ["runParameters.xml", "RunParameters.xml"]:
+        path = os.path.join(run_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_instrument_field(run_parameters):
+    """Read the field of a runParameters.xml naming the instrument.
+
+    As RunParametersParser based detection did: Setup/Flowcell, or else
+    Setup/ApplicationName, if there is a Setup section, and InstrumentType,
+    ApplicationName or Application otherwise. The file is read until
+    Setup/Flowcell, or InstrumentType ahead of any Setup section, is found.
+
+    :returns: The text of the field, or an empty string
+    """
+    found = {}
+    path = []
+    has_setup = False
+    for event, elem in ET.iterparse(run_parameters, events=("start", "end")):
+        if event == "start":
+            path.append(elem.tag)
+            has_setup = has_setup or path[1:] == ["Setup"]
+            continue
+        text = (elem.text or "").strip()
+        if path[1:] == ["Setup", "Flowcell"] or (
+            path[1:] == ["InstrumentType"] and not has_setup
+        ):
+            if text:
+                return text
+        elif len(path) in (2, 3) and text:
+            found.setdefault(tuple(path[1:]), text)
+        path.pop()
+        if len(path) < 3:
+            # Only the first two levels are looked at
+            elem.clear()
+    if has_setup:
+        fields = [("Setup", field) for field in SETUP_FIELDS]
+    else:
+        fields = [(field,) for field in TOP_LEVEL_FIELDS]
+    for field in fields:
+        if field in found:
+            return found[field]
+    return ""
+
+
+def detect_instrument(run_dir):
+    """Return the type of instrument of a run.
+
+    :param str run_dir: The run folder
+    :returns: NovaSeqXPlus, NovaSeq, NextSeq, MiSeq, HiSeq X or HiSeq, else the
+        field of runParameters.xml naming the instrument, or an empty string
+    """
+    run_id = os.path.basename(os.path.normpath(run_dir))
+    if run_id in _instruments:
+        return _instruments[run_id]
+    instrument = classify_run_name(run_id)
+    if instrument is None:
+        run_parameters = run_parameters_file(run_dir)
+        if run_parameters is None:
+            # Not cached, the file may not have been written yet
+            return ""
+        try:
+            field = read_instrument_field(run_parameters)
+        except (OSError, ET.ParseError) as e:
+            logger.warning(f"Could not read {run_parameters}: {e}")
+            return ""
+        instrument = classify_instrument_name(field) or field
+    _instruments[run_id] = instrument
+    return instrument
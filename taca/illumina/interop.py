@@ -0,0 +1,425 @@
+"""Live metrics of a run read from its InterOp files while it is sequencing.
+
+The binary InterOp files are memory-mapped as arrays of numpy structured
+records and aggregated per lane:
+
+- TileMetricsOut.bin: clusters, PF clusters, %PF and cluster density
+- ExtractionMetricsOut.bin: the last cycle extracted
+- QMetricsOut.bin: %>=Q30 of the cycles so far
+
+ExtractionMetricsOut.bin and QMetricsOut.bin grow by one batch of records per
+cycle, so the offset of the first record not read yet is kept along with the
+running sums and each update only reads the records written since the last
+one. TileMetricsOut.bin is rewritten as a whole and is read again when it
+changes. Readers are kept per run in memory while the run is sequencing and,
+with a state_dir, pickled after each update, so that the next invocation of
+TACA, e.g. from cron, carries on from the same offsets.
+"""
+
+import logging
+import os
+import pickle
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INTEROP_DIR = "InterOp"
+TILE_METRICS = "TileMetricsOut.bin"
+EXTRACTION_METRICS = "ExtractionMetricsOut.bin"
+Q_METRICS = "QMetricsOut.bin"
+
+# Codes of the tile metrics of version 2
+CLUSTER_DENSITY = 100
+CLUSTER_COUNT = 102
+PF_CLUSTER_COUNT = 103
+
+LIVE_METRICS_DIR = "live_metrics"
+
+_live_metrics: dict[str, "LiveMetrics"] = {}
+
+
+class InterOpReader:
+    """Incremental reader of one InterOp file.
+
+    :param str path: The InterOp file
+    """
+
+    # Whether records are only ever appended to the file
+    append_only = True
+
+    def __init__(self, path):
+        self.path = path
+        self._file_id = None
+        self.offset = None
+        self.dtype = None
+        self.reset()
+
+    def reset(self):
+        """Forget the records read so far."""
+
+    def parse_header(self, raw):
+        """Read the header of the file.
+
+        :param raw: The file as an array of bytes
+        :returns: (size of the header, dtype of the records)
+        """
+        raise NotImplementedError("Please Implement this method")
+
+    def fold(self, records):
+        """Add new records to the aggregates."""
+        raise NotImplementedError("Please Implement this method")
+
+    def update(self):
+        """Read the records written since the last update.
+
+        :returns: Number of records read
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        if self.append_only:
+            file_id = (stat.st_dev, stat.st_ino)
+        else:
+            file_id = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_id != self._file_id or stat.st_size < (self.offset or 0):
+            self._file_id = file_id
+            self.offset = None
+            self.reset()
+        elif self.offset is not None and not self.append_only:
+            return 0
+        if stat.st_size == 0:
+            return 0
+        if self.offset is None:
+            raw = np.memmap(self.path, dtype=np.uint8, mode="r")
+            header_size, self.dtype = self.parse_header(raw)
+            del raw
+            self.offset = header_size
+        count = (stat.st_size - self.offset) // self.dtype.itemsize
+        if count <= 0:
+            return 0
+        records = np.memmap(
+            self.path, dtype=self.dtype, mode="r", offset=self.offset, shape=(count,)
+        )
+        self.fold(records)
+        self.offset += count * self.dtype.itemsize
+        return count
+
+
+def _check_record_size(path, version, dtype, record_size):
+    if dtype.itemsize != record_size:
+        raise ValueError(
+            f"Unexpected record size {record_size} for version {version} of {path}"
+        )
+
+
+def _per_lane(lanes, values, reduce):
+    """Reduce values per lane, e.g. with np.add or np.maximum."""
+    unique_lanes, inverse = np.unique(lanes, return_inverse=True)
+    dtype = np.float64 if values.dtype.kind == "f" else np.int64
+    reduced = np.zeros(len(unique_lanes), dtype=dtype)
+    reduce.at(reduced, inverse, values)
+    return dict(zip(unique_lanes.tolist(), reduced.tolist()))
+
+
+class TileMetricsReader(InterOpReader):
+    """Clusters, PF clusters and density per lane, versions 2 and 3."""
+
+    append_only = False
+
+    def reset(self):
+        self.lanes = {}
+
+    def parse_header(self, raw):
+        version, record_size = int(raw[0]), int(raw[1])
+        if version == 2:
+            header_size = 2
+            dtype = np.dtype(
+                [("lane", "<u2"), ("tile", "<u2"), ("code", "<u2"), ("value", "<f4")]
+            )
+        elif version == 3:
+            header_size = 6
+            self.tile_area = float(raw[2:6].view("<f4")[0])
+            dtype = np.dtype(
+                [
+                    ("lane", "<u2"),
+                    ("tile", "<u4"),
+                    ("code", "u1"),
+                    ("value1", "<f4"),
+                    ("value2", "<f4"),
+                ]
+            )
+        else:
+            raise ValueError(f"Unsupported version {version} of {self.path}")
+        _check_record_size(self.path, version, dtype, record_size)
+        self.version = version
+        return header_size, dtype
+
+    def fold(self, records):
+        if self.version == 2:
+            codes = records["code"]
+            counts = records[codes == CLUSTER_COUNT]
+            pf_counts = records[codes == PF_CLUSTER_COUNT]
+            densities = records[codes == CLUSTER_DENSITY]
+            clusters = _per_lane(counts["lane"], counts["value"], np.add)
+            clusters_pf = _per_lane(pf_counts["lane"], pf_counts["value"], np.add)
+            density_sums = _per_lane(densities["lane"], densities["value"], np.add)
+            tiles = _per_lane(
+                densities["lane"], np.ones(len(densities), dtype=np.int64), np.add
+            )
+            density = {lane: density_sums[lane] / tiles[lane] for lane in tiles}
+        else:
+            tile_records = records[records["code"] == ord("t")]
+            lanes = tile_records["lane"]
+            clusters = _per_lane(lanes, tile_records["value1"], np.add)
+            clusters_pf = _per_lane(lanes, tile_records["value2"], np.add)
+            tiles = _per_lane(lanes, np.ones(len(lanes), dtype=np.int64), np.add)
+            density = {
+                lane: clusters[lane] / (tiles[lane] * self.tile_area)
+                for lane in tiles
+                if self.tile_area
+            }
+        for lane in clusters:
+            lane_clusters_pf = clusters_pf.get(lane, 0)
+            self.lanes[lane] = {
+                "clusters": int(clusters[lane]),
+                "clusters_pf": int(lane_clusters_pf),
+            }
+            if clusters[lane]:
+                self.lanes[lane]["percent_pf"] = round(
+                    100 * lane_clusters_pf / clusters[lane], 2
+                )
+            if lane in density:
+                self.lanes[lane]["density_k_mm2"] = round(density[lane] / 1000, 1)
+
+
+class ExtractionMetricsReader(InterOpReader):
+    """Last cycle extracted per lane, versions 2 and 3."""
+
+    def reset(self):
+        self.cycles = {}
+
+    def parse_header(self, raw):
+        version, record_size = int(raw[0]), int(raw[1])
+        if version == 2:
+            header_size = 2
+            dtype = np.dtype(
+                [
+                    ("lane", "<u2"),
+                    ("tile", "<u2"),
+                    ("cycle", "<u2"),
+                    ("fwhm", "<f4", (4,)),
+                    ("intensity", "<u2", (4,)),
+                    ("datetime", "<u8"),
+                ]
+            )
+        elif version == 3:
+            header_size = 3
+            channels = int(raw[2])
+            dtype = np.dtype(
+                [
+                    ("lane", "<u2"),
+                    ("tile", "<u4"),
+                    ("cycle", "<u2"),
+                    ("fwhm", "<f4", (channels,)),
+                    ("intensity", "<u2", (channels,)),
+                ]
+            )
+        else:
+            raise ValueError(f"Unsupported version {version} of {self.path}")
+        _check_record_size(self.path, version, dtype, record_size)
+        return header_size, dtype
+
+    def fold(self, records):
+        cycles = _per_lane(records["lane"], records["cycle"], np.maximum)
+        for lane, cycle in cycles.items():
+            self.cycles[lane] = max(self.cycles.get(lane, 0), cycle)
+
+
+class QMetricsReader(InterOpReader):
+    """Quality score histograms summed per lane, versions 4 to 7."""
+
+    def reset(self):
+        self.histograms = {}
+        self.q_scores = None
+
+    def parse_header(self, raw):
+        version, record_size = int(raw[0]), int(raw[1])
+        if version not in (4, 5, 6, 7):
+            raise ValueError(f"Unsupported version {version} of {self.path}")
+        header_size = 2
+        bin_values = None
+        if version >= 5:
+            has_bins = bool(raw[2])
+            header_size = 3
+            if has_bins:
+                bin_count = int(raw[3])
+                # Lower bounds, upper bounds, then values of the bins
+                bin_values = raw[4 + 2 * bin_count : 4 + 3 * bin_count].astype(int)
+                header_size = 4 + 3 * bin_count
+        tile_type = "<u4" if version == 7 else "<u2"
+        tile_size = np.dtype(tile_type).itemsize
+        bins = (record_size - 4 - tile_size) // 4
+        dtype = np.dtype(
+            [
+                ("lane", "<u2"),
+                ("tile", tile_type),
+                ("cycle", "<u2"),
+                ("histogram", "<u4", (bins,)),
+            ]
+        )
+        _check_record_size(self.path, version, dtype, record_size)
+        if bin_values is not None and len(bin_values) == bins:
+            self.q_scores = bin_values
+        else:
+            self.q_scores = np.arange(1, bins + 1)
+        return header_size, dtype
+
+    def fold(self, records):
+        lanes = records["lane"]
+        histograms = records["histogram"].astype(np.uint64)
+        for lane in np.unique(lanes).tolist():
+            histogram = histograms[lanes == lane].sum(axis=0)
+            if lane in self.histograms:
+                histogram += self.histograms[lane]
+            self.histograms[lane] = histogram
+
+    def percent_q30(self):
+        """Return the %>=Q30 of each lane."""
+        percent_q30 = {}
+        if self.q_scores is None:
+            return percent_q30
+        above = self.q_scores >= 30
+        for lane, histogram in self.histograms.items():
+            total = float(histogram.sum())
+            if total:
+                percent_q30[lane] = round(
+                    100 * float(histogram[above].sum()) / total, 2
+                )
+        return percent_q30
+
+
+class LiveMetrics:
+    """The InterOp readers of a run.
+
+    :param str run_dir: The run folder
+    """
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        interop_dir = os.path.join(run_dir, INTEROP_DIR)
+        self.tiles = TileMetricsReader(os.path.join(interop_dir, TILE_METRICS))
+        self.extraction = ExtractionMetricsReader(
+            os.path.join(interop_dir, EXTRACTION_METRICS)
+        )
+        self.quality = QMetricsReader(os.path.join(interop_dir, Q_METRICS))
+
+    def update(self):
+        """Read the new records and return the metrics per lane.
+
+        Unreadable InterOp files are logged and their metrics left out.
+
+        :returns: {lane: {cycle, clusters, clusters_pf, percent_pf,
+            density_k_mm2, percent_q30}}, with only the metrics available so
+            far for each lane
+        """
+        for reader in (self.tiles, self.extraction, self.quality):
+            try:
+                reader.update()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read {reader.path}: {e}")
+                reader.offset = None
+                reader.reset()
+        lanes = {}
+        for lane, metrics in self.tiles.lanes.items():
+            lanes.setdefault(str(lane), {}).update(metrics)
+        for lane, cycle in self.extraction.cycles.items():
+            lanes.setdefault(str(lane), {})["cycle"] = int(cycle)
+        for lane, percent_q30 in self.quality.percent_q30().items():
+            lanes.setdefault(str(lane), {})["percent_q30"] = percent_q30
+        return dict(sorted(lanes.items()))
+
+
+def read_tile_metrics(run_dir):
+    """Return the {clusters, clusters_pf, percent_pf, density_k_mm2} of each lane.
+
+    :returns: The metrics by lane, as a string, {} if TileMetricsOut.bin
+        cannot be read
+    """
+    reader = TileMetricsReader(os.path.join(run_dir, INTEROP_DIR, TILE_METRICS))
+    try:
+        reader.update()
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read {reader.path}: {e}")
+        return {}
+    return {str(lane): metrics for lane, metrics in reader.lanes.items()}
+
+
+def _state_path(state_dir, run_dir):
+    return os.path.join(state_dir, f"{os.path.basename(run_dir)}.pickle")
+
+
+def _load_state(state_dir, run_dir):
+    try:
+        with open(_state_path(state_dir, run_dir), "rb") as pickled:
+            live_metrics = pickle.load(pickled)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.debug(f"Could not unpickle the live metrics of {run_dir}: {e}")
+        return None
+    if not isinstance(live_metrics, LiveMetrics) or live_metrics.run_dir != run_dir:
+        return None
+    return live_metrics
+
+
+def _dump_state(state_dir, live_metrics):
+    path = _state_path(state_dir, live_metrics.run_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(state_dir, exist_ok=True)
+        with open(tmp_path, "wb") as pickled:
+            pickle.dump(live_metrics, pickled)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.debug(
+            f"Could not pickle the live metrics of {live_metrics.run_dir}: {e}"
+        )
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_live_metrics(run_dir, state_dir=None):
+    """Return the live metrics of a run, see LiveMetrics.update.
+
+    :param str run_dir: The run folder
+    :param str state_dir: Folder where the readers are pickled between
+        invocations, kept in memory only if None
+    """
+    run_dir = os.path.abspath(run_dir)
+    live_metrics = _live_metrics.get(run_dir)
+    if live_metrics is None and state_dir:
+        live_metrics = _load_state(state_dir, run_dir)
+    if live_metrics is None:
+        live_metrics = LiveMetrics(run_dir)
+    _live_metrics[run_dir] = live_metrics
+    metrics = live_metrics.update()
+    if state_dir:
+        _dump_state(state_dir, live_metrics)
+    return metrics
+
+
+def forget_live_metrics(run_dir, state_dir=None):
+    """Drop the readers of a run that is no longer sequencing.
+
+    :param str run_dir: The run folder
+    :param str state_dir: Folder where the readers are pickled, if any
+    """
+    run_dir = os.path.abspath(run_dir)
+    _live_metrics.pop(run_dir, None)
+    if state_dir:
+        try:
+            os.remove(_state_path(state_dir, run_dir))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,238 @@
+"""Aggregation of the lane and laneBarcode reports of several sub-demultiplexings.
+
+The reports are handled as the sample_data lists of LaneBarcodeParser, i.e.
+lists of dicts with the columns of the html tables as comma-formatted strings.
+Lanes are indexed in dicts and sets, and the numeric columns are parsed once.
+The merged reports are rendered as html, with a JSON twin holding the same data.
+"""
+
+import json
+import logging
+import os
+
+from taca.utils.filesystem import write_atomically
+
+logger = logging.getLogger(__name__)
+
+# Columns of the laneBarcode report kept for the undetermined entry of complex lanes
+CONSTANT_KEYS = ["Lane", "Barcode sequence", "Project", "Sample"]
+
+
+def _to_int(value):
+    """Parse a comma-formatted number, e.g. 1,234,567."""
+    return int(value.replace(",", ""))
+
+
+def _is_undetermined(entry):
+    return entry["Project"] in "default"
+
+
+def merge_lane_entries(reports):
+    """Merge the sample_data of lane reports, keeping the first report of each lane.
+
+    :param reports: sample_data lists of the lane.html reports, in order of priority
+    :returns: The merged list of lane entries
+    """
+    merged = []
+    lanes_in_report = set()
+    for i, sample_data in enumerate(reports):
+        new_entries = [
+            entry
+            for entry in sample_data
+            if i == 0 or entry["Lane"] not in lanes_in_report
+        ]
+        merged.extend(new_entries)
+        lanes_in_report.update(entry["Lane"] for entry in new_entries)
+    return merged
+
+
+def summarize_lanes(lane_entries, complex_lanes):
+    """Compute the per-lane totals and the flowcell summary of the lane report.
+
+    The barcode percentages of complex lanes are meaningless once merged, they
+    are cleared in lane_entries.
+
+    :param list lane_entries: Merged lane report entries
+    :param complex_lanes: Lane numbers, as strings, of the complex lanes
+    :returns: (NumberReads_Summary, flowcell_data) where NumberReads_Summary
+        maps lanes to their total_lane_cluster and total_lane_yield, and
+        flowcell_data holds the updated Flowcell Summary fields, without raw
+        clusters if the % PF clusters of a lane is not known
+    """
+    number_reads_summary = {}
+    clusters_raw = 0
+    clusters_pf = 0
+    yield_mbases = 0
+    for entry in lane_entries:
+        pf_clusters = _to_int(entry["PF Clusters"])
+        lane_yield = _to_int(entry["Yield (Mbases)"])
+        number_reads_summary[entry["Lane"]] = {
+            "total_lane_cluster": pf_clusters,
+            "total_lane_yield": lane_yield,
+        }
+        if clusters_raw is not None and entry.get("% PFClusters"):
+            clusters_raw += int(pf_clusters / float(entry["% PFClusters"]) * 100)
+        else:
+            clusters_raw = None
+        clusters_pf += pf_clusters
+        yield_mbases += lane_yield
+        if entry["Lane"] in complex_lanes:
+            entry["% Perfectbarcode"] = None
+            entry["% One mismatchbarcode"] = None
+    flowcell_data = {}
+    if clusters_raw is not None:
+        flowcell_data["Clusters (Raw)"] = f"{clusters_raw:,}"
+    flowcell_data["Clusters(PF)"] = f"{clusters_pf:,}"
+    flowcell_data["Yield (MBases)"] = f"{yield_mbases:,}"
+    return number_reads_summary, flowcell_data
+
+
+def aggregate_lane_barcodes(
+    entries, complex_lanes, noindex_lanes, index_cycles, number_reads_summary
+):
+    """Aggregate the laneBarcode entries of all sub-demultiplexings.
+
+    - Complex lanes keep a single undetermined entry, holding the reads that
+      were not assigned to any sample in any sub-demultiplexing
+    - The sample and undetermined totals of each lane are added to
+      number_reads_summary (total_sample_cluster, total_sample_yield,
+      undet_cluster and undet_yield)
+    - NoIndex lanes with fake indexes get their undetermined entry renamed
+      after the sample of the lane
+    - Entries are sorted by lane and sample
+
+    :param list entries: Concatenated sample_data of the laneBarcode reports
+    :param complex_lanes: Lane numbers, as strings, of the complex lanes
+    :param noindex_lanes: Lane numbers, as strings, of the NoIndex lanes
+    :param list index_cycles: Number of cycles of index 1 and 2
+    :param dict number_reads_summary: Lane totals from summarize_lanes, updated
+    :returns: The new list of laneBarcode entries
+    """
+    complex_lanes = set(complex_lanes)
+    kept = []
+    complex_undetermined = {}
+    sample_totals = {}
+    for entry in entries:
+        lane = entry["Lane"]
+        if lane in complex_lanes and _is_undetermined(entry):
+            if lane in complex_undetermined:
+                continue
+            for key in entry:
+                if key not in CONSTANT_KEYS:
+                    entry[key] = "0"
+            complex_undetermined[lane] = entry
+        kept.append(entry)
+        totals = sample_totals.setdefault(lane, [0, 0])
+        if entry["Project"] != "default":
+            totals[0] += _to_int(entry["PF Clusters"])
+            totals[1] += _to_int(entry["Yield (Mbases)"])
+
+    for lane, (cluster, lane_yield) in sample_totals.items():
+        number_reads_summary[lane]["total_sample_cluster"] = cluster
+        number_reads_summary[lane]["total_sample_yield"] = lane_yield
+    for summary in number_reads_summary.values():
+        summary["undet_cluster"] = summary["total_lane_cluster"] - summary.get(
+            "total_sample_cluster", 0
+        )
+        summary["undet_yield"] = summary["total_lane_yield"] - summary.get(
+            "total_sample_yield", 0
+        )
+
+    for lane, entry in complex_undetermined.items():
+        if entry["Project"] == "default":
+            entry["PF Clusters"] = "{:,}".format(
+                number_reads_summary[lane]["undet_cluster"]
+            )
+            entry["Yield (Mbases)"] = "{:,}".format(
+                number_reads_summary[lane]["undet_yield"]
+            )
+
+    # Fix special case that when we assign fake indexes for NoIndex samples
+    if noindex_lanes and index_cycles != [0, 0]:
+        lane_project_sample = dict()
+        for entry in kept:
+            if entry["Lane"] in noindex_lanes and entry["Sample"] != "Undetermined":
+                lane_project_sample[entry["Lane"]] = {
+                    "Project": entry["Project"],
+                    "Sample": entry["Sample"],
+                }
+        noindex_kept = []
+        for entry in kept:
+            if entry["Lane"] in noindex_lanes:
+                if entry["Sample"] != "Undetermined":
+                    continue
+                entry["Project"] = lane_project_sample[entry["Lane"]]["Project"]
+                entry["Sample"] = lane_project_sample[entry["Lane"]]["Sample"]
+            noindex_kept.append(entry)
+        kept = noindex_kept
+
+    # Sort sample_data: first by lane then by sample ID
+    return sorted(kept, key=lambda k: (k["Lane"].lower(), k["Sample"]))
+
+
+_HTML_HEADER = (
+    '<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">\n'
+    "<html xmlns:bcl2fastq>\n"
+    '<link rel="stylesheet" href="../../../../Report.css" type="text/css">\n'
+    "<body>\n"
+    '<table width="100%"><tr>\n'
+    "<td><p><p>C6L1WANXX /\n"
+    "        [all projects] /\n"
+    "        [all samples] /\n"
+    "        [all barcodes]</p></p></td>\n"
+    '<td><p align="right"><a href="../../../../FAKE/all/all/all/laneBarcode.html">show barcodes</a></p></td>\n'
+    "</tr></table>\n"
+)
+_HTML_FOOTER = "<p></p>\n</body>\n</html>\n"
+
+
+def _html_table(keys, rows):
+    parts = ['<table border="1" ID="ReportTable">\n<tr>\n']
+    parts.extend(f"<th>{key}</th>\n" for key in keys)
+    parts.append("</tr>\n")
+    for row in rows:
+        parts.append("<tr>\n")
+        parts.extend(f"<td>{row[key]}</td>\n" for key in keys)
+        parts.append("</tr>\n")
+    parts.append("</table>\n")
+    return "".join(parts)
+
+
+def render_lane_html(flowcell_data, sample_data):
+    """Render a lane.html or laneBarcode.html report as a string.
+
+    :param dict flowcell_data: Fields of the Flowcell Summary table
+    :param list sample_data: Rows of the Lane Summary table
+    """
+    return "".join(
+        [
+            _HTML_HEADER,
+            "<h2>Flowcell Summary</h2>\n",
+            _html_table(sorted(flowcell_data), [flowcell_data]),
+            "<h2>Lane Summary</h2>\n",
+            _html_table(sorted(sample_data[0]), sample_data),
+            _HTML_FOOTER,
+        ]
+    )
+
+
+def json_twin(html_file):
+    """Path of the JSON version of an html report, e.g. laneBarcode.json."""
+    return os.path.splitext(html_file)[0] + ".json"
+
+
+def write_lane_report(html_file, report):
+    """Write a report as html and as JSON next to it, each atomically.
+
+    :param str html_file: Path of the html report
+    :param report: LaneBarcodeParser or LaneTable with the report
+    """
+    write_atomically(
+        html_file, render_lane_html(report.flowcell_data, report.sample_data)
+    )
+    write_atomically(
+        json_twin(html_file),
+        json.dumps(
+            {"flowcell_data": report.flowcell_data, "sample_data": report.sample_data}
+        ),
+    )
@@ -0,0 +1,159 @@
+"""Sub-demultiplexings split in one job per lane.
+
+When the lanes of a sub-demultiplexing are split, each of its lanes is
+converted by its own bcl-convert (--bcl-only-lane) or bcl2fastq (--tiles)
+job, with its own output folder Demultiplexing_N_L<lane> and its own logs
+demux_N_L<lane>_<software>.out/.err. Once all lanes are done, their outputs
+are merged into Demultiplexing_N, which then looks like the output of a
+single job to the aggregation of the run:
+
+- FastQ files are symlinked into Demultiplexing_N
+- Stats.json files are concatenated lane after lane, the per-lane files of the
+  Stats folder, e.g. DemuxSummaryF1L1.txt, are symlinked
+- the CSV reports of bcl-convert are concatenated under a single header, the
+  other files of the Reports folder are symlinked from the first lane
+
+The lane.html and laneBarcode.html reports and DemultiplexingStats.xml, which
+marks Demultiplexing_N as done, are left to the caller.
+"""
+
+import csv
+import fnmatch
+import io
+import json
+import logging
+import os
+
+from taca.illumina.stats_json import StatsJsonMerger
+from taca.illumina.symlink_farm import SymlinkFarm, scan_demux_dir
+from taca.utils.filesystem import write_atomically
+
+logger = logging.getLogger(__name__)
+
+# Files of the Stats folder that are merged, or written by the caller
+MERGED_STATS = ["Stats.json", "DemultiplexingStats.xml"]
+
+
+def lane_job_id(demux_id, lane):
+    """Id of the job of a lane of a sub-demultiplexing, e.g. 1_L2."""
+    return f"{demux_id}_L{lane}"
+
+
+def lane_output_dir(run_dir, demux_id, lane):
+    return os.path.join(run_dir, f"Demultiplexing_{lane_job_id(demux_id, lane)}")
+
+
+def lane_outputs_done(run_dir, demux_id, lanes, legacy_path):
+    """Return True if the jobs of all lanes of a sub-demultiplexing are done."""
+    return all(
+        os.path.exists(
+            os.path.join(
+                lane_output_dir(run_dir, demux_id, lane),
+                legacy_path,
+                "Stats",
+                "DemultiplexingStats.xml",
+            )
+        )
+        for lane in lanes
+    )
+
+
+def merge_stats_json(stats_files):
+    """Merge the Stats.json files of the lanes of a sub-demultiplexing."""
+    stats_merger = StatsJsonMerger()
+    for stats_file in stats_files:
+        with open(stats_file) as stats_json:
+            data = json.load(stats_json)
+        stats_merger.add(data)
+        for unknown_barcode_lane in data["UnknownBarcodes"]:
+            stats_merger.add_unknown_barcodes(
+                unknown_barcode_lane["Lane"], unknown_barcode_lane["Barcodes"]
+            )
+    return stats_merger
+
+
+def merge_csv_reports(csv_files, dest):
+    """Concatenate CSV reports with the same header, keeping one header."""
+    header = None
+    rows = []
+    for csv_file in csv_files:
+        with open(csv_file, newline="") as report:
+            reader = csv.reader(report)
+            file_header = next(reader, None)
+            if header is None:
+                header = file_header
+            elif file_header != header:
+                raise RuntimeError(
+                    f"Header of {csv_file} differs from the one of {csv_files[0]}"
+                )
+            rows.extend(reader)
+    merged = io.StringIO()
+    if header is not None:
+        writer = csv.writer(merged, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+    write_atomically(dest, merged.getvalue())
+
+
+def merge_lane_outputs(run_dir, demux_id, lanes, legacy_path):
+    """Merge the outputs of the lane jobs of a sub-demultiplexing.
+
+    :param str run_dir: The run folder
+    :param demux_id: Number of the sub-demultiplexing
+    :param list lanes: Lanes of the sub-demultiplexing, in order
+    :param str legacy_path: Path of the Stats folder in the output folders
+    :returns: Number of symlinks created
+    """
+    demux_dir = os.path.join(run_dir, f"Demultiplexing_{demux_id}")
+    lane_dirs = [lane_output_dir(run_dir, demux_id, lane) for lane in lanes]
+    stats_dest = os.path.join(demux_dir, legacy_path, "Stats")
+    farm = SymlinkFarm()
+    farm.add_dir(stats_dest)
+    stats = {}
+    for lane_dir in lane_dirs:
+        files, projects = scan_demux_dir(lane_dir)
+        farm.add_project_fastqs(projects, demux_dir)
+        for fastq_file in fnmatch.filter(files, "*.fastq*"):
+            farm.add_link(
+                os.path.join(lane_dir, fastq_file), os.path.join(demux_dir, fastq_file)
+            )
+        stats_source = os.path.join(lane_dir, legacy_path, "Stats")
+        for stats_name in os.listdir(stats_source):
+            stats.setdefault(stats_name, []).append(
+                os.path.join(stats_source, stats_name)
+            )
+    for stats_name, stats_files in sorted(stats.items()):
+        if stats_name in MERGED_STATS:
+            continue
+        if len(stats_files) == 1:
+            farm.add_link(stats_files[0], os.path.join(stats_dest, stats_name))
+        else:
+            # Not per lane, e.g. ConversionStats.xml, and not merged
+            logger.debug(f"Not merging {stats_name} of the lanes of demux {demux_id}")
+
+    # Reports of bcl-convert, the legacy Stats folder is handled above
+    reports_dest = os.path.join(demux_dir, "Reports")
+    reports = {}
+    for lane_dir in lane_dirs:
+        reports_source = os.path.join(lane_dir, "Reports")
+        if not os.path.isdir(reports_source):
+            continue
+        with os.scandir(reports_source) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    reports.setdefault(entry.name, []).append(entry.path)
+    for report_name, report_files in sorted(reports.items()):
+        if report_name.endswith(".csv"):
+            os.makedirs(reports_dest, exist_ok=True)
+            merge_csv_reports(report_files, os.path.join(reports_dest, report_name))
+        else:
+            farm.add_link(report_files[0], os.path.join(reports_dest, report_name))
+
+    created = farm.build()
+    if "Stats.json" in stats:
+        with open(os.path.join(stats_dest, "Stats.json"), "w") as stats_json:
+            merge_stats_json(stats["Stats.json"]).write(stats_json)
+    logger.info(
+        f"Merged the outputs of lanes {', '.join(lanes)} into Demultiplexing_{demux_id}"
+    )
+    return created
@@ -0,0 +1,163 @@
+"""Process-wide cache of the flowcell_parser objects of runs.
+
+Parsing a run folder or a samplesheet is far more expensive than checking
+whether the files changed, yet a single processing cycle used to parse the
+same files several times. Parsed objects are cached per parser and path,
+keyed by the mtime and size of the files they are read from, and parsed again
+only when one of them changes. The least recently used objects are evicted
+beyond maxsize.
+
+With a cache_dir, parsed objects are also pickled to disk, so that the next
+cron invocation only parses the files that changed in between.
+
+The cached objects themselves are never handed out: each caller gets its own
+deep copy, which is still much cheaper than parsing the files again, and can
+modify it, e.g. the rows of a samplesheet, without affecting the next caller.
+"""
+
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAXSIZE = 256
+
+# Files read by RunParser, relative to the run folder, besides the html reports
+RUN_PARSER_FILES = [
+    "RunInfo.xml",
+    "runParameters.xml",
+    "RunParameters.xml",
+    "SampleSheet.csv",
+    os.path.join("Logs", "CycleTimes.txt"),
+    os.path.join("Demultiplexing", "Stats", "Stats.json"),
+    os.path.join("Demultiplexing", "Stats", "DemultiplexingStats.xml"),
+]
+
+
+def _signature(paths):
+    """Return the (path, mtime, size) of each path, None for missing ones."""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append((path, None, None))
+        else:
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def run_parser_files(run_dir):
+    """Return the files RunParser reads in a run folder."""
+    files = [os.path.join(run_dir, name) for name in RUN_PARSER_FILES]
+    html_dir = os.path.join(run_dir, "Demultiplexing", "Reports", "html")
+    if os.path.isdir(html_dir):
+        for flowcell in sorted(os.listdir(html_dir)):
+            reports = os.path.join(html_dir, flowcell, "all", "all", "all")
+            files.append(os.path.join(reports, "lane.html"))
+            files.append(os.path.join(reports, "laneBarcode.html"))
+    return files
+
+
+class ParsedCache:
+    """LRU cache of parsed objects, with an optional on-disk pickle tier.
+
+    :param int maxsize: Number of objects kept in memory
+    :param str cache_dir: Folder of the pickled objects, none are if None
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self._objects = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pickle_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.pickle")
+
+    def _load_pickle(self, key, signature):
+        try:
+            with open(self._pickle_path(key), "rb") as pickled:
+                pickled_key, pickled_signature, obj = pickle.load(pickled)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug(f"Could not unpickle {key[1]}: {e}")
+            return None
+        if pickled_key != key or pickled_signature != signature:
+            return None
+        return obj
+
+    def _dump_pickle(self, key, signature, obj):
+        path = self._pickle_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as pickled:
+                pickle.dump((key, signature, obj), pickled)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.debug(f"Could not pickle {key[1]}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load(self, parser, path, depends_on=None):
+        """Return a copy of parser(path), parsed again only if its files changed.
+
+        :param parser: Class, or function, parsing path
+        :param str path: The file, or folder, to parse
+        :param list depends_on: Files read by the parser, path if None
+        """
+        key = (f"{parser.__module__}.{parser.__qualname__}", os.path.abspath(path))
+        signature = _signature(depends_on if depends_on is not None else [path])
+        with self._lock:
+            cached = self._objects.get(key)
+            if cached is not None and cached[0] == signature:
+                self._objects.move_to_end(key)
+                return copy.deepcopy(cached[1])
+        obj = None
+        if self.cache_dir:
+            obj = self._load_pickle(key, signature)
+        if obj is None:
+            logger.debug(f"Parsing {path} with {key[0]}")
+            obj = parser(path)
+            if self.cache_dir:
+                self._dump_pickle(key, signature, obj)
+        with self._lock:
+            self._objects[key] = (signature, obj)
+            self._objects.move_to_end(key)
+            while len(self._objects) > self.maxsize:
+                self._objects.popitem(last=False)
+        return copy.deepcopy(obj)
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+
+_cache = ParsedCache()
+
+
+def configure(maxsize=DEFAULT_MAXSIZE, cache_dir=None):
+    """Set the size and the pickle folder of the process-wide cache."""
+    with _cache._lock:
+        _cache.maxsize = maxsize
+        _cache.cache_dir = cache_dir
+        while len(_cache._objects) > maxsize:
+            _cache._objects.popitem(last=False)
+
+
+def load(parser, path, depends_on=None):
+    """Return parser(path) from the process-wide cache, see ParsedCache.load."""
+    return _cache.load(parser, path, depends_on)
+
+
+def load_run(parser, run_dir):
+    """Return the RunParser of a run folder from the process-wide cache."""
+    return _cache.load(parser, run_dir, run_parser_files(run_dir))
@@ -0,0 +1,216 @@
+"""Partial re-demultiplexing of a run after its samplesheet changed.
+
+Each sub-demultiplexing of the demux plan keeps a hash of each of its lanes in
+its SampleSheet_N.csv, covering the [Settings] section, the data fields and the
+rows of the lane, keyed by lane in lane_hashes. The [Header] section is left
+out, as it does not change the demultiplexing.
+
+When the LIMS samplesheet is corrected, the run is planned again and the lanes
+are compared group by group, a group being (sample_type, mask, lane):
+
+- groups with the same hash keep the outputs of their sub-demultiplexing
+- changed and new groups are demultiplexed again, in new sub-demultiplexings
+  with the next free ids, one per sample type and mask
+- the lanes of the other groups are retired from their sub-demultiplexing,
+  whose SampleSheet_N.csv then only keeps its untouched lanes, or which is
+  retired altogether when none is left
+
+The outputs of a sub-demultiplexing for its retired lanes are ignored when the
+results are aggregated again.
+"""
+
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def _sections(samplesheet_text):
+    """Split a samplesheet in (section, lines), lines keeping their line ends."""
+    sections = []
+    for line in samplesheet_text.splitlines(keepends=True):
+        if line.startswith("["):
+            sections.append((line.strip().split(",")[0], [line]))
+        elif sections:
+            sections[-1][1].append(line)
+    return sections
+
+
+def _lane_index(datafields_line):
+    return datafields_line.strip().split(",").index("Lane")
+
+
+def samplesheet_lane_hashes(samplesheet_text):
+    """Hash each lane of a sub-samplesheet.
+
+    :param str samplesheet_text: Contents of a SampleSheet_N.csv
+    :returns: {lane: sha1 of the settings, data fields and rows of the lane}
+    """
+    settings = []
+    lane_rows = {}
+    for section, lines in _sections(samplesheet_text):
+        if section == "[Settings]":
+            settings = [line.strip() for line in lines[1:] if line.strip()]
+        elif section == "[Data]" and len(lines) > 1:
+            datafields = lines[1].strip()
+            lane_index = _lane_index(datafields)
+            for line in lines[2:]:
+                if line.strip():
+                    lane = line.strip().split(",")[lane_index]
+                    lane_rows.setdefault(lane, [datafields]).append(line.strip())
+    return {
+        lane: hashlib.sha1("\n".join(settings + rows).encode()).hexdigest()
+        for lane, rows in lane_rows.items()
+    }
+
+
+def restrict_samplesheet(samplesheet_text, lanes):
+    """Return a sub-samplesheet with only the rows of the given lanes."""
+    output = ""
+    for section, lines in _sections(samplesheet_text):
+        if section == "[Data]" and len(lines) > 1:
+            lane_index = _lane_index(lines[1])
+            output += lines[0] + lines[1]
+            for line in lines[2:]:
+                if line.strip() and line.strip().split(",")[lane_index] in lanes:
+                    output += line
+        else:
+            output += "".join(lines)
+    return output
+
+
+def _freeze(mask):
+    return tuple(tuple(part) for part in mask)
+
+
+def _lane_groups(plan):
+    """Map (sample_type, mask, lane) to (demux, hash) for each lane of a plan."""
+    groups = {}
+    for demux in plan["demuxes"]:
+        for lane, mask in demux["mask_table"].items():
+            groups[(demux["sample_type"], _freeze(mask), lane)] = (
+                demux,
+                demux["lane_hashes"][lane],
+            )
+    return groups
+
+
+def plan_redemux(old_plan, new_plan):
+    """Plan the partial re-demultiplexing of a run.
+
+    :param dict old_plan: The plan the run was demultiplexed with, with the
+        lane_hashes of each sub-demultiplexing
+    :param dict new_plan: The plan of the corrected samplesheet, with
+        lane_hashes computed the same way
+    :returns: (plan, new_ids, trimmed_ids, retired_ids) where plan merges the
+        untouched sub-demultiplexings of old_plan with the new ones, new_ids
+        are the sub-demultiplexings to run, trimmed_ids the ones that lost
+        lanes and retired_ids the ones that lost all their lanes
+    """
+    old_groups = _lane_groups(old_plan)
+    new_groups = _lane_groups(new_plan)
+    unchanged = {
+        key
+        for key, (_, lane_hash) in new_groups.items()
+        if key in old_groups and old_groups[key][1] == lane_hash
+    }
+
+    demuxes = []
+    trimmed_ids = []
+    retired_ids = list(old_plan.get("retired", []))
+    newly_retired = []
+    for demux in old_plan["demuxes"]:
+        kept = [
+            lane
+            for lane, mask in demux["mask_table"].items()
+            if (demux["sample_type"], _freeze(mask), lane) in unchanged
+        ]
+        if len(kept) == len(demux["mask_table"]):
+            demuxes.append(demux)
+        elif kept:
+            trimmed = dict(demux)
+            for key in ("mask_table", "samples_to_include", "lane_hashes"):
+                trimmed[key] = {lane: demux[key][lane] for lane in kept}
+            trimmed["retired_lanes"] = sorted(
+                set(demux.get("retired_lanes", []))
+                | (set(demux["mask_table"]) - set(kept))
+            )
+            demuxes.append(trimmed)
+            trimmed_ids.append(demux["demux_id"])
+        else:
+            newly_retired.append(demux["demux_id"])
+
+    # The changed groups, one sub-demultiplexing per sample type and mask
+    next_id = (
+        max([demux["demux_id"] for demux in old_plan["demuxes"]] + retired_ids) + 1
+    )
+    new_demuxes = {}
+    for key, (demux, lane_hash) in new_groups.items():
+        if key in unchanged:
+            continue
+        sample_type, mask, lane = key
+        new_demux = new_demuxes.get((sample_type, mask))
+        if new_demux is None:
+            new_demux = new_demuxes[(sample_type, mask)] = {
+                "demux_id": next_id + len(new_demuxes),
+                "sample_type": sample_type,
+                "mask": mask if new_plan["software"] == "bclconvert" else None,
+                "mask_table": {},
+                "samples_to_include": {},
+                "lane_hashes": {},
+            }
+        new_demux["mask_table"][lane] = mask
+        new_demux["samples_to_include"][lane] = demux["samples_to_include"][lane]
+        new_demux["lane_hashes"][lane] = lane_hash
+    demuxes.extend(new_demuxes.values())
+
+    plan = {
+        "software": new_plan["software"],
+        "fingerprint": new_plan["fingerprint"],
+        "demuxes": demuxes,
+        "retired": sorted(retired_ids + newly_retired),
+    }
+    new_ids = [new_demux["demux_id"] for new_demux in new_demuxes.values()]
+    return plan, new_ids, trimmed_ids, newly_retired
+
+
+def drop_lane_entries(entries, lanes, key="Lane"):
+    """Return the entries of a report or Stats.json list not in lanes."""
+    return [entry for entry in entries if str(entry[key]) not in lanes]
+
+
+def drop_stats_lanes(data, lanes):
+    """Remove the lanes from the data of a Stats.json file, in place."""
+    data["ConversionResults"] = drop_lane_entries(
+        data["ConversionResults"], lanes, "LaneNumber"
+    )
+    data["ReadInfosForLanes"] = drop_lane_entries(
+        data["ReadInfosForLanes"], lanes, "LaneNumber"
+    )
+    data["UnknownBarcodes"] = drop_lane_entries(data["UnknownBarcodes"], lanes)
+    return data
+
+
+def drop_fastq_lanes(projects, lanes):
+    """Remove the FastQ files of the lanes from projects, as from scan_demux_dir.
+
+    Samples left without FastQ files by this are removed too.
+    """
+    patterns = tuple(f"_L{int(lane):03d}_" for lane in lanes)
+    kept_projects = {}
+    for project, samples in projects.items():
+        kept_samples = {}
+        for sample, fastq_files in samples.items():
+            kept_files = [
+                fastq_file
+                for fastq_file in fastq_files
+                if not any(
+                    pattern in os.path.basename(fastq_file) for pattern in patterns
+                )
+            ]
+            if kept_files or not fastq_files:
+                kept_samples[sample] = kept_files
+        if kept_samples:
+            kept_projects[project] = kept_samples
+    return kept_projects
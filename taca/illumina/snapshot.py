@@ -0,0 +1,60 @@
+"""Point-in-time view of the files that determine the status of an Illumina run.
+
+On NFS-mounted volumes every os.path.exists is a round trip to the server. A
+RunSnapshot lists the run root, the demultiplexing folder and its Stats folder
+once with os.scandir, and answers status checks from memory until refreshed.
+"""
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def _list_dir(path):
+    """Return the set of entry names in path, or an empty set if it is missing."""
+    try:
+        with os.scandir(path) as entries:
+            return {entry.name for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
+class RunSnapshot:
+    """Names of the entries in a run folder and its demultiplexing folder.
+
+    :param str run_dir: Path to the run folder
+    :param str demux_dir: Name of the demultiplexing folder within the run folder
+    """
+
+    def __init__(self, run_dir, demux_dir="Demultiplexing"):
+        self.run_dir = run_dir
+        self.demux_dir = demux_dir
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the run folder, e.g. after an action that changed its state."""
+        self.root = _list_dir(self.run_dir)
+        self.demux = set()
+        self.stats = set()
+        if self.demux_dir in self.root:
+            demux_path = os.path.join(self.run_dir, self.demux_dir)
+            self.demux = _list_dir(demux_path)
+            if "Stats" in self.demux:
+                self.stats = _list_dir(os.path.join(demux_path, "Stats"))
+
+    def has(self, name):
+        """Return True if name is an entry of the run root."""
+        return name in self.root
+
+    @property
+    def sequencing_done(self):
+        return self.has("RTAComplete.txt") and self.has("CopyComplete.txt")
+
+    @property
+    def demultiplexing_started(self):
+        return self.has(self.demux_dir)
+
+    @property
+    def demultiplexing_done(self):
+        return "Stats.json" in self.stats
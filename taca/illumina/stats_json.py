@@ -0,0 +1,150 @@
+"""Merging of the Stats.json files of the sub-demultiplexings of a run.
+
+The conversion results of the partial Stats.json files are indexed by lane, so
+merging the results of a complex lane is a dict lookup rather than a scan of
+all the results merged so far. Each partial file is still loaded whole with
+json.load, and the merged results are held in memory until they are written.
+The cumulative file is then encoded one element at a time, so that its JSON
+text is never built as a single string.
+
+The unknown barcodes of the partial files are summed per lane and only the
+top_unknown_barcodes most frequent ones of each lane are kept, so that the
+cumulative file stays bounded however many sub-demultiplexings a lane has.
+"""
+
+import heapq
+import json
+import logging
+from collections import Counter
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+HEADER_FIELDS = ["RunNumber", "Flowcell", "RunId"]
+# ConversionResults > lane > DemuxResults > sample are written one sample at a time
+_WRITE_DEPTH = 4
+# Unknown barcodes reported per lane by bcl2fastq
+DEFAULT_TOP_UNKNOWN_BARCODES = 1000
+
+
+def _write_json(obj, out, depth):
+    """Write obj to out as json.dump would, encoding containers element by element."""
+    if depth == 0 or not obj or not isinstance(obj, (dict, list)):
+        out.write(json.dumps(obj))
+    elif isinstance(obj, dict):
+        out.write("{")
+        for i, (key, value) in enumerate(obj.items()):
+            if i:
+                out.write(", ")
+            out.write(json.dumps(str(key)))
+            out.write(": ")
+            _write_json(value, out, depth - 1)
+        out.write("}")
+    else:
+        out.write("[")
+        for i, value in enumerate(obj):
+            if i:
+                out.write(", ")
+            _write_json(value, out, depth - 1)
+        out.write("]")
+
+
+def _top(barcodes, count):
+    """Return the count most frequent barcodes, most frequent first."""
+    return heapq.nlargest(count, barcodes.items(), key=itemgetter(1))
+
+
+class StatsJsonMerger:
+    """Cumulative Stats.json built from the partial ones, in order of priority.
+
+    :param int top_unknown_barcodes: Unknown barcodes kept per lane
+    """
+
+    def __init__(self, top_unknown_barcodes=DEFAULT_TOP_UNKNOWN_BARCODES):
+        self.header = {}
+        self.conversion_results = []
+        self.read_infos_for_lanes = []
+        self.top_unknown_barcodes = top_unknown_barcodes
+        # Lane -> Counter of the unknown barcodes of that lane
+        self._unknown_barcodes = {}
+        # LaneNumber -> first ConversionResults entry of that lane
+        self._lanes = {}
+
+    def _append(self, conversion_result):
+        self.conversion_results.append(conversion_result)
+        self._lanes.setdefault(conversion_result["LaneNumber"], conversion_result)
+
+    def add(self, data, complex_lanes=(), fix_undetermined=None):
+        """Merge the ConversionResults and ReadInfosForLanes of a partial Stats.json.
+
+        The first file sets the header fields. The results of lanes already
+        present in complex_lanes are merged into the existing entry of the lane,
+        other results are appended.
+
+        :param dict data: Content of a partial Stats.json
+        :param complex_lanes: Lane numbers, as strings, of the complex lanes
+        :param fix_undetermined: Function called with a ConversionResults entry
+            of a complex lane before it is merged
+        """
+        if not self.header:
+            self.header = {field: data[field] for field in HEADER_FIELDS}
+            self.read_infos_for_lanes.extend(data["ReadInfosForLanes"])
+            for conversion_result in data["ConversionResults"]:
+                self._append(conversion_result)
+            return
+        lanes_present = set(self._lanes)
+        for read_info in data["ReadInfosForLanes"]:
+            if read_info["LaneNumber"] not in lanes_present:
+                self.read_infos_for_lanes.append(read_info)
+        for conversion_result in data["ConversionResults"]:
+            lane = conversion_result["LaneNumber"]
+            if lane in lanes_present and str(lane) in complex_lanes:
+                if fix_undetermined:
+                    fix_undetermined(conversion_result)
+                lane_to_update = self._lanes[lane]
+                lane_to_update["DemuxResults"].extend(conversion_result["DemuxResults"])
+                lane_to_update["Undetermined"] = conversion_result["Undetermined"]
+            else:
+                self._append(conversion_result)
+
+    def add_unknown_barcodes(self, lane, barcodes):
+        """Add the counts of the unknown barcodes of a lane, keeping the top ones.
+
+        :param lane: The Lane of an UnknownBarcodes entry
+        :param dict barcodes: Count of each unknown barcode
+        """
+        counter = self._unknown_barcodes.setdefault(lane, Counter())
+        counter.update(barcodes)
+        if len(counter) > self.top_unknown_barcodes:
+            self._unknown_barcodes[lane] = Counter(
+                dict(_top(counter, self.top_unknown_barcodes))
+            )
+
+    def set_unknown_barcodes(self, lane, barcodes):
+        """Replace the unknown barcodes of a lane."""
+        self._unknown_barcodes[lane] = Counter(barcodes)
+
+    def lane_unknown_barcodes(self, lane):
+        """Return the top unknown barcodes of a lane, most frequent first."""
+        return dict(
+            _top(self._unknown_barcodes.get(lane, {}), self.top_unknown_barcodes)
+        )
+
+    @property
+    def unknown_barcodes(self):
+        """UnknownBarcodes of the cumulative Stats.json."""
+        return [
+            {"Lane": lane, "Barcodes": self.lane_unknown_barcodes(lane)}
+            for lane in self._unknown_barcodes
+        ]
+
+    def as_dict(self):
+        stats = dict(self.header)
+        stats["ConversionResults"] = self.conversion_results
+        stats["ReadInfosForLanes"] = self.read_infos_for_lanes
+        stats["UnknownBarcodes"] = self.unknown_barcodes
+        return stats
+
+    def write(self, out):
+        """Write the cumulative Stats.json to the file object out."""
+        _write_json(self.as_dict(), out, _WRITE_DEPTH)
@@ -0,0 +1,158 @@
+"""Planning and building of the symlink tree of a merged Demultiplexing folder.
+
+When a run is demultiplexed in several sub-demultiplexings, the Demultiplexing
+folder is a tree of symlinks to the FastQ files of the Demultiplexing_N
+folders. The whole tree is planned first, from a single os.scandir walk of each
+Demultiplexing_N, then the folders are created once and the symlinks are
+created by a pool of threads, which keeps the number of metadata round trips
+low on network file systems. Links that already point to the right file are
+left alone, so that building a partially built tree again completes it.
+"""
+
+import fnmatch
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Number of threads creating symlinks
+LINK_THREADS = 8
+# Folders of a Demultiplexing_N that are not projects
+NON_PROJECT_DIRS = ["Reports", "Stats"]
+
+
+def scan_demux_dir(demux_dir):
+    """Walk a Demultiplexing_N folder once.
+
+    :param str demux_dir: The Demultiplexing_N folder
+    :returns: (files, projects) where files are the names of the files at the
+        top of demux_dir, and projects maps each project to a dict of its
+        samples and the paths of their FastQ files
+    """
+    files = []
+    projects = {}
+    with os.scandir(demux_dir) as entries:
+        project_entries = []
+        for entry in entries:
+            if entry.is_dir():
+                if entry.name not in NON_PROJECT_DIRS:
+                    project_entries.append(entry)
+            else:
+                files.append(entry.name)
+    for project_entry in project_entries:
+        samples = projects.setdefault(project_entry.name, {})
+        with os.scandir(project_entry.path) as entries:
+            sample_entries = [entry for entry in entries if entry.is_dir()]
+        for sample_entry in sample_entries:
+            with os.scandir(sample_entry.path) as entries:
+                samples[sample_entry.name] = sorted(
+                    entry.path
+                    for entry in entries
+                    if fnmatch.fnmatch(entry.name, "*.fastq*")
+                )
+    return sorted(files), projects
+
+
+class SymlinkFarm:
+    """The folders and symlinks of a merged Demultiplexing folder."""
+
+    def __init__(self):
+        self.dirs = set()
+        # destination -> source
+        self.links = {}
+
+    def add_dir(self, path):
+        self.dirs.add(path)
+
+    def add_link(self, source, dest):
+        """Plan a symlink at dest pointing to source, and its parent folder.
+
+        A destination can only be planned once, as a sample sequenced in
+        several sub-demultiplexings would be overwritten.
+        """
+        if self.links.get(dest, source) != source:
+            raise RuntimeError(
+                f"Symlink {dest} planned to both {self.links[dest]} and {source}"
+            )
+        self.links[dest] = source
+        self.add_dir(os.path.dirname(dest))
+
+    def add_project_fastqs(self, projects, demux_folder):
+        """Plan the links of the project FastQ files of a sub-demultiplexing.
+
+        :param dict projects: Projects as returned by scan_demux_dir
+        :param str demux_folder: The merged Demultiplexing folder
+        """
+        for project, samples in projects.items():
+            project_dest = os.path.join(demux_folder, project)
+            self.add_dir(project_dest)
+            for sample, fastq_files in samples.items():
+                sample_dest = os.path.join(project_dest, sample)
+                self.add_dir(sample_dest)
+                for fastq_file in fastq_files:
+                    self.add_link(
+                        fastq_file,
+                        os.path.join(sample_dest, os.path.basename(fastq_file)),
+                    )
+
+    def add_noindex_fastqs(self, files, demux_dir, demux_folder, samplesheet_data):
+        """Plan the links of undetermined FastQ files as the files of the samples.
+
+        Used when NoIndex samples are given fake indexes, all their reads are
+        then undetermined, e.g. Undetermined_S0_L001_R1_001.fastq.gz becomes
+        P12345_1001_S1_L001_R1_001.fastq.gz.
+
+        :param list files: Files at the top of demux_dir, from scan_demux_dir
+        :param str demux_dir: The Demultiplexing_N folder
+        :param str demux_folder: The merged Demultiplexing folder
+        :param list samplesheet_data: Rows of the samplesheet of demux_dir
+        """
+        for sample_counter, entry in enumerate(
+            sorted(samplesheet_data, key=lambda k: k["Lane"]), start=1
+        ):
+            lane = entry["Lane"]
+            sample = entry["Sample_ID"]
+            sample_dest = os.path.join(demux_folder, entry["Sample_Project"], sample)
+            self.add_dir(sample_dest)
+            for old_name in fnmatch.filter(files, f"Undetermined*L0?{lane}*"):
+                new_name = "_".join(
+                    [sample.replace("Sample_", ""), f"S{sample_counter}"]
+                    + old_name.split("_")[2:]
+                )
+                self.add_link(
+                    os.path.join(demux_dir, old_name),
+                    os.path.join(sample_dest, new_name),
+                )
+                logger.info(
+                    "For undet sample {}, renaming {} to {}".format(
+                        sample.replace("Sample_", ""), old_name, new_name
+                    )
+                )
+
+    def _link(self, dest):
+        source = self.links[dest]
+        try:
+            os.symlink(source, dest)
+            return True
+        except FileExistsError:
+            # Left by an earlier, interrupted build
+            if os.path.islink(dest) and os.readlink(dest) == source:
+                return False
+            raise
+
+    def build(self, threads=LINK_THREADS):
+        """Create the planned folders and symlinks.
+
+        :param int threads: Number of threads creating symlinks
+        :returns: Number of symlinks created
+        """
+        # Parents sort before their children
+        for path in sorted(self.dirs):
+            os.makedirs(path, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            created = sum(executor.map(self._link, sorted(self.links)))
+        logger.info(
+            f"Created {created} symlinks, {len(self.links) - created} were already in place"
+        )
+        return created
@@ -0,0 +1,147 @@
+"""Trial demultiplexing of a single tile before the full conversion.
+
+A wrong index orientation or mask in a samplesheet only shows as most reads
+ending up undetermined, which used to cost a whole demultiplexing and a rerun.
+When a trial is configured, each sub-demultiplexing is first run on one tile
+only (bcl-convert --first-tile-only, bcl2fastq --tiles) into its own folder,
+Trial_N, and the fraction of the reads assigned to samples is read per lane
+from its Stats.json or Demultiplex_Stats.csv. If a lane is below the
+threshold, the trial is run again with the index2 of the samplesheet reverse
+complemented, the most common orientation mistake, and the full conversion
+uses whichever samplesheet passed.
+"""
+
+import csv
+import json
+import logging
+import os
+
+from taca.illumina.bcl_check import read_run_layout
+from taca.illumina.bclconvert_reports import DEMULTIPLEX_STATS, UNDETERMINED_SAMPLE
+from taca.illumina.index_distance import reverse_complement
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.5
+# First tile of each lane by TileNamingConvention, when RunInfo.xml lists no tiles
+FIRST_TILES = {"FourDigit": "1101", "FiveDigit": "11101"}
+
+
+def trial_output_dir(run_dir, demux_id):
+    return os.path.join(run_dir, f"Trial_{demux_id}")
+
+
+def trial_tiles(run_info, lanes=None):
+    """Return the --tiles option of bcl2fastq selecting the first tile of each lane.
+
+    The tiles are taken from the TileSet of RunInfo.xml, e.g. 1101 on a
+    NovaSeq and 11101 on a NextSeq 500. If none are listed, the first tile is
+    named after the TileNamingConvention.
+
+    :param str run_info: RunInfo.xml of the run
+    :param list lanes: Lanes to convert, as strings, all if None
+    """
+    layout = read_run_layout(run_info)
+    first_tiles = {}
+    for lane, tile in layout["tiles"]:
+        if lane not in first_tiles or int(tile) < int(first_tiles[lane]):
+            first_tiles[lane] = tile
+    if not first_tiles:
+        tile = FIRST_TILES.get(layout["tile_naming"], FIRST_TILES["FourDigit"])
+        first_tiles = {lane: tile for lane in range(1, layout["lanes"] + 1)}
+    return ",".join(
+        f"s_{lane}_{tile}"
+        for lane, tile in sorted(first_tiles.items())
+        if lanes is None or str(lane) in lanes
+    )
+
+
+def reverse_complement_samplesheet(samplesheet_text, lanes=None, field="index2"):
+    """Reverse complement a field of the [Data] rows of a sub-samplesheet.
+
+    :param list lanes: Lanes whose rows are changed, all if None
+    :returns: The contents of the changed sub-samplesheet
+    """
+    output = []
+    in_data = False
+    datafields = None
+    for line in samplesheet_text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith("["):
+            in_data = stripped.split(",")[0] == "[Data]"
+            datafields = None
+        elif in_data and stripped:
+            values = stripped.split(",")
+            if datafields is None:
+                datafields = values
+            elif field in datafields and (
+                lanes is None
+                or "Lane" not in datafields
+                or values[datafields.index("Lane")] in lanes
+            ):
+                field_index = datafields.index(field)
+                values[field_index] = reverse_complement(values[field_index])
+                line = ",".join(values) + line[len(line.rstrip("\r\n")) :]
+        output.append(line)
+    return "".join(output)
+
+
+def assigned_fractions_stats_json(stats_json):
+    """Return the fraction of the PF reads of each lane assigned to samples.
+
+    :param str stats_json: Stats.json of bcl2fastq
+    """
+    with open(stats_json) as stats_file:
+        data = json.load(stats_file)
+    fractions = {}
+    for lane in data["ConversionResults"]:
+        total = lane["TotalClustersPF"]
+        assigned = sum(sample["NumberReads"] for sample in lane["DemuxResults"])
+        fractions[str(lane["LaneNumber"])] = assigned / total if total else 0.0
+    return fractions
+
+
+def assigned_fractions_demux_stats(demux_stats):
+    """Return the fraction of the reads of each lane assigned to samples.
+
+    :param str demux_stats: Demultiplex_Stats.csv of bcl-convert
+    """
+    assigned = {}
+    total = {}
+    with open(demux_stats, newline="") as stats_file:
+        for row in csv.DictReader(stats_file):
+            lane = row["Lane"]
+            reads = int(float(row["# Reads"]))
+            total[lane] = total.get(lane, 0) + reads
+            if row["SampleID"] != UNDETERMINED_SAMPLE:
+                assigned[lane] = assigned.get(lane, 0) + reads
+    return {
+        lane: assigned.get(lane, 0) / total[lane] if total[lane] else 0.0
+        for lane in total
+    }
+
+
+def assigned_fractions(output_dir, software):
+    """Return the assigned fraction of each lane of a trial, {} if no stats."""
+    if software == "bclconvert":
+        stats = os.path.join(output_dir, "Reports", DEMULTIPLEX_STATS)
+        reader = assigned_fractions_demux_stats
+    else:
+        stats = os.path.join(output_dir, "Stats", "Stats.json")
+        reader = assigned_fractions_stats_json
+    if not os.path.exists(stats):
+        return {}
+    return reader(stats)
+
+
+def format_fractions(fractions):
+    """Format assigned fractions as e.g. lane 1: 92.1%, lane 2: 3.4%."""
+    return ", ".join(
+        f"lane {lane}: {100 * fraction:.1f}%"
+        for lane, fraction in sorted(fractions.items())
+    )
+
+
+def failing_lanes(fractions, lanes, threshold):
+    """Return the lanes whose assigned fraction is below threshold, or missing."""
+    return [lane for lane in lanes if fractions.get(str(lane), 0.0) < threshold]
@@ -0,0 +1,187 @@
+"""Event-driven detection of Illumina runs that need processing.
+
+The RunWatcher uses inotify to watch the data directories, the run folders and
+the sub-demultiplexing folders for the sentinel files written when sequencing
+or a sub-demultiplexing finishes, and dispatches the run as soon as one shows
+up. inotify does not see changes made by other hosts on network file systems,
+so all runs are also dispatched on a regular polling sweep, which is all that
+happens where inotify is not available.
+"""
+
+import fnmatch
+import logging
+import os
+import time
+
+from taca.utils import inotify
+
+logger = logging.getLogger(__name__)
+
+# Run folder looks like DATE_*_*_*, the last section is the FC name.
+RUN_DIR_PATTERN = "[1-9]*_*_*_*"
+# Folders, relative to the run folder, on the way to the sentinel files
+WATCHED_SUBDIRS = [
+    "Demultiplexing_*",
+    "Demultiplexing_*/Stats",
+    "Demultiplexing_*/Reports",
+    "Demultiplexing_*/Reports/legacy",
+    "Demultiplexing_*/Reports/legacy/Stats",
+]
+# Files whose appearance means that a run has something new to do
+SENTINEL_FILES = ["RTAComplete.txt", "CopyComplete.txt", "DemultiplexingStats.xml"]
+
+_DIR_EVENTS = (
+    inotify.IN_CREATE
+    | inotify.IN_MOVED_TO
+    | inotify.IN_CLOSE_WRITE
+    | inotify.IN_DELETE_SELF
+    | inotify.IN_MOVE_SELF
+    | inotify.IN_ONLYDIR
+)
+
+
+class RunWatcher:
+    """Dispatch runs when their sentinel files appear.
+
+    :param list data_dirs: Folders containing the run folders
+    :param dispatch: Function called with the path of a run folder to process
+    :param int poll_interval: Seconds between sweeps dispatching all runs
+    """
+
+    def __init__(self, data_dirs, dispatch, poll_interval=1800):
+        self.data_dirs = [os.path.abspath(data_dir) for data_dir in data_dirs]
+        self.dispatch = dispatch
+        self.poll_interval = poll_interval
+        # wd -> (run folder or None for a data dir, watched folder)
+        self._watches = {}
+        try:
+            self._inotify = inotify.Inotify()
+        except OSError as e:
+            logger.warning(f"inotify not available ({e}), falling back to polling")
+            self._inotify = None
+
+    def _run_dirs(self):
+        run_dirs = []
+        for data_dir in self.data_dirs:
+            try:
+                with os.scandir(data_dir) as entries:
+                    run_dirs.extend(
+                        entry.path
+                        for entry in entries
+                        if fnmatch.fnmatch(entry.name, RUN_DIR_PATTERN)
+                        and entry.is_dir()
+                    )
+            except OSError as e:
+                logger.warning(f"Could not list data dir {data_dir}: {e}")
+        return sorted(run_dirs)
+
+    def _watch(self, run_dir, path, initial=False):
+        """Watch path, returning the set of runs that already need dispatching.
+
+        :param str run_dir: Run folder path belongs to, None for a data dir
+        :param str path: Folder to watch
+        :param bool initial: Set when starting up, existing sentinel files are
+            then left to the first polling sweep
+        """
+        try:
+            wd = self._inotify.add_watch(path, _DIR_EVENTS)
+        except OSError as e:
+            logger.debug(f"Could not watch {path}: {e}")
+            return set()
+        self._watches[wd] = (run_dir, path)
+        # Anything created before the watch was in place has to be looked at now
+        to_dispatch = set()
+        try:
+            with os.scandir(path) as entries:
+                names = [entry.name for entry in entries]
+        except OSError:
+            return to_dispatch
+        for name in names:
+            to_dispatch |= self._handle(run_dir, path, name, initial)
+        return to_dispatch
+
+    def _handle(self, run_dir, path, name, initial=False):
+        """Handle name appearing in the watched folder path."""
+        child = os.path.join(path, name)
+        if run_dir is None:
+            # A new run folder in a data dir, e.g. a sequencer starting a run
+            if fnmatch.fnmatch(name, RUN_DIR_PATTERN) and os.path.isdir(child):
+                return self._watch(child, child, initial)
+            return set()
+        if name in SENTINEL_FILES:
+            return set() if initial else {run_dir}
+        relpath = os.path.relpath(child, run_dir)
+        if any(fnmatch.fnmatch(relpath, pattern) for pattern in WATCHED_SUBDIRS):
+            if os.path.isdir(child):
+                return self._watch(run_dir, child, initial)
+        return set()
+
+    def _process_events(self, timeout):
+        """Wait up to timeout seconds for events, return the runs to dispatch."""
+        to_dispatch = set()
+        for wd, mask, name in self._inotify.read_events(timeout):
+            if mask & inotify.IN_Q_OVERFLOW:
+                logger.warning("inotify event queue overflowed, sweeping all runs")
+                to_dispatch |= set(self._run_dirs())
+                continue
+            if mask & inotify.IN_IGNORED:
+                # The watched folder has been removed or moved away
+                self._watches.pop(wd, None)
+                continue
+            if mask & inotify.IN_MOVE_SELF:
+                # e.g. the run has been archived to nosync, stop following it
+                self._inotify.remove_watch(wd)
+                self._watches.pop(wd, None)
+                continue
+            if wd not in self._watches or not name:
+                continue
+            run_dir, path = self._watches[wd]
+            to_dispatch |= self._handle(run_dir, path, name)
+        return to_dispatch
+
+    def _dispatch_all(self, run_dirs):
+        for run_dir in sorted(run_dirs):
+            if not os.path.exists(run_dir):
+                continue
+            try:
+                self.dispatch(run_dir)
+            except Exception:
+                # It is better to continue processing other runs
+                logger.warning(
+                    f"There was an error processing the run {run_dir}", exc_info=True
+                )
+
+    def start(self):
+        """Set up the watches on the data dirs and the runs they contain."""
+        if self._inotify is None:
+            return
+        for data_dir in self.data_dirs:
+            self._watch(None, data_dir, initial=True)
+
+    def poll_once(self, timeout):
+        """Wait up to timeout seconds for events and dispatch the affected runs."""
+        if self._inotify is None:
+            time.sleep(timeout)
+            return set()
+        to_dispatch = self._process_events(timeout)
+        self._dispatch_all(to_dispatch)
+        return to_dispatch
+
+    def run(self):
+        """Watch and dispatch runs forever."""
+        self.start()
+        next_sweep = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= next_sweep:
+                logger.info("Polling sweep of all runs")
+                self._dispatch_all(self._run_dirs())
+                next_sweep = time.monotonic() + self.poll_interval
+                continue
+            dispatched = self.poll_once(next_sweep - now)
+            if dispatched:
+                logger.info(f"Dispatched {len(dispatched)} run(s) on inotify events")
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
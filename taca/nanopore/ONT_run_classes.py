@@ -5,6 +5,7 @@ import logging
 import os
 import re
 import shutil
+import sqlite3
 import subprocess
 from datetime import datetime
 from typing import Union
@@ -12,6 +13,7 @@ from typing import Union
 import pandas as pd
 
 from taca.utils.config import CONFIG
+from taca.utils.ledger import TransferLedger
 from taca.utils.statusdb import NanoporeRunsConnection
 from taca.utils.transfer import RsyncAgent, RsyncError
 
@@ -367,10 +369,8 @@ class ONT_run:
     def update_transfer_log(self):
         """Update transfer log with run id and date."""
         try:
-            with open(self.transfer_details["transfer_log"], "a") as f:
-                tsv_writer = csv.writer(f, delimiter="\t")
-                tsv_writer.writerow([self.run_name, str(datetime.now())])
-        except OSError:
+            TransferLedger(self.transfer_details["transfer_log"]).record(self.run_name)
+        except (OSError, sqlite3.Error):
             msg = f"{self.run_name}: Could not update the transfer logfile {self.transfer_details['transfer_log']}"
             logger.error(msg)
             raise OSError(msg)
@@ -397,8 +397,9 @@ class ONT_user_run(ONT_run):
 
     def is_transferred(self) -> bool:
         """Return True if run ID in transfer.tsv, else False."""
-        with open(self.transfer_details["transfer_log"]) as f:
-            return self.run_name in f.read()
+        return TransferLedger(self.transfer_details["transfer_log"]).is_transferred(
+            self.run_name
+        )
 
 
 class ONT_qc_run(ONT_run):
@@ -427,8 +428,9 @@ class ONT_qc_run(ONT_run):
 
     def is_transferred(self) -> bool:
         """Return True if run ID in transfer.tsv, else False."""
-        with open(self.transfer_details["transfer_log"]) as f:
-            return self.run_name in f.read()
+        return TransferLedger(self.transfer_details["transfer_log"]).is_transferred(
+            self.run_name
+        )
 
     # QC methods
 
@@ -5,8 +5,10 @@ import os
 import re
 from collections import OrderedDict, defaultdict
 
-from flowcell_parser.classes import RunParametersParser, SampleSheetParser
+from flowcell_parser.classes import SampleSheetParser
 
+from taca.illumina import parsed
+from taca.illumina.instrument import detect_instrument, run_parameters_file
 from taca.utils import statusdb
 from taca.utils.config import CONFIG
 from taca.utils.misc import send_mail
@@ -176,34 +178,12 @@ def get_ss_projects(run_dir):
     else:
         FCID = run_name_components[3][1:]
     miseq = False
-    # FIXME: this check breaks if the system is case insensitive
-    if os.path.exists(os.path.join(run_dir, "runParameters.xml")):
-        run_parameters_file = "runParameters.xml"
-    elif os.path.exists(os.path.join(run_dir, "RunParameters.xml")):
-        run_parameters_file = "RunParameters.xml"
-    else:
+    if run_parameters_file(run_dir) is None:
         logger.error(
             f"Cannot find RunParameters.xml or runParameters.xml in the run folder for run {run_dir}"
         )
         return []
-    rp = RunParametersParser(os.path.join(run_dir, run_parameters_file))
-    if "Setup" in rp.data["RunParameters"]:
-        runtype = rp.data["RunParameters"]["Setup"].get("Flowcell", "")
-        if not runtype:
-            logger.warn(
-                "Parsing runParameters to fetch instrument type, "
-                "not found Flowcell information in it. Using ApplicationName"
-            )
-            runtype = rp.data["RunParameters"]["Setup"].get("ApplicationName", "")
-    elif "InstrumentType" in rp.data["RunParameters"]:
-        runtype = rp.data["RunParameters"].get("InstrumentType")
-    else:
-        runtype = rp.data["RunParameters"].get("Application")
-        if not runtype:
-            logger.warn(
-                "Couldn't find 'Application', could be NextSeq. Trying 'ApplicationName'"
-            )
-            runtype = rp.data["RunParameters"].get("ApplicationName", "")
+    runtype = detect_instrument(run_dir)
 
     # Miseq case
     if "MiSeq" in runtype:
@@ -295,7 +275,7 @@ def parse_samplesheet(FCID_samplesheet_origin, run_dir, is_miseq=False):
     """
     data = []
     try:
-        ss_reader = SampleSheetParser(FCID_samplesheet_origin)
+        ss_reader = parsed.load(SampleSheetParser, FCID_samplesheet_origin)
         data = ss_reader.data
     except:
         logger.warn(
@@ -3,6 +3,7 @@
 import click
 
 import taca.utils.bioinfo_tab as bt
+from taca.utils.ledger import TransferLedger
 
 
 @click.group(name="bioinfo_deliveries")
@@ -34,3 +35,42 @@ def fail_run(runid, project=None):
     """Updates the status of the specified run to 'Failed'.
     Example of RUNID: 170113_ST-E00269_0163_BHCVH7ALXX"""
     bt.fail_run(runid, project)
+
+
+@click.group(name="ledger")
+def ledger():
+    """Query the ledgers of transferred runs."""
+    pass
+
+
+@ledger.command(name="list")
+@click.argument("transfer_log", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-p",
+    "--pattern",
+    default="%",
+    help="Only list runs matching this SQL LIKE pattern, e.g. '%_LH00217_%'",
+)
+def list_transfers(transfer_log, pattern):
+    """List the runs recorded in TRANSFER_LOG (e.g. transfer.tsv)."""
+    for run_id, transferred in TransferLedger(transfer_log).query(pattern):
+        click.echo(f"{run_id}\t{transferred}")
+
+
+@ledger.command()
+@click.argument("transfer_log", type=click.Path(exists=True, dir_okay=False))
+@click.argument("run_id")
+def query(transfer_log, run_id):
+    """Check whether RUN_ID is recorded in TRANSFER_LOG, exit 1 if not."""
+    if TransferLedger(transfer_log).is_transferred(run_id):
+        click.echo(f"{run_id} is transferred")
+    else:
+        click.echo(f"{run_id} is not transferred")
+        raise SystemExit(1)
+
+
+@ledger.command(name="import")
+@click.argument("transfer_log", type=click.Path(exists=True, dir_okay=False))
+def import_transfers(transfer_log):
+    """Import rows appended to TRANSFER_LOG into its ledger database."""
+    TransferLedger(transfer_log).sync()
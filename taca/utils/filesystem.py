@@ -1,6 +1,7 @@
 """Filesystem utilities."""
 
 import contextlib
+import fcntl
 import os
 import shutil
 
@@ -19,6 +20,28 @@ def chdir(new_dir):
         os.chdir(cur_dir)
 
 
+@contextlib.contextmanager
+def lock_file(lock_path):
+    """Context manager holding an exclusive, non-blocking lock on lock_path.
+
+    Yields True if the lock was acquired and False if another process holds it.
+    The lock is released when the context exits or the holding process dies.
+    """
+    lock_dir = os.path.dirname(lock_path)
+    if lock_dir and not os.path.exists(lock_dir):
+        os.makedirs(lock_dir, exist_ok=True)
+    with open(lock_path, "a") as lock_handle:
+        try:
+            fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+
 def create_folder(target_folder):
     """Ensure that a folder exists and create it if it doesn't, including any
     parent folders, as necessary.
@@ -49,3 +72,21 @@ def do_copy(src_path, dst_path):
     # if symlinks, will copy content, not the links
     # dst_path will be created, it must NOT exist
     shutil.copytree(src_path, dst_path)
+
+
+def write_atomically(path, content):
+    """Write content to path through a temporary file in the same folder, so
+    that a partially written file is never seen at path.
+
+    :param path: the target file
+    :param content: the text to write
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,189 @@
+"""Indexed ledger of transferred runs.
+
+The transfer logs (e.g. transfer.tsv) are append-only TSV files with one
+``run_id<TAB>date`` row per transferred run. Scanning them on every cycle gets
+slower as years of history pile up, so the ledger mirrors them into an SQLite
+database next to the TSV file. Lookups are indexed, and rows appended to the TSV
+by anyone else are picked up incrementally by remembering how far into the file
+the last import went. The inode of the file and a hash of the part already
+imported are kept along with the offset, so that a TSV file that is replaced or
+edited, e.g. to remove a run to be transferred again, is imported again from
+scratch. Lookups only take the write lock of the database when the TSV file has
+changed since the last import.
+"""
+
+import contextlib
+import csv
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class TransferLedger:
+    """SQLite-backed view of a transfer log TSV file.
+
+    :param str tsv_path: Path to the transfer log, e.g. transfer.tsv
+    :param str db_path: Path to the SQLite database, defaults to the TSV path
+        with a .sqlite extension
+    """
+
+    def __init__(self, tsv_path, db_path=None):
+        self.tsv_path = tsv_path
+        self.db_path = db_path or os.path.splitext(tsv_path)[0] + ".sqlite"
+        with self._connect(write=False) as conn:
+            tables = conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "
+                "AND name IN ('transfers', 'meta')"
+            ).fetchone()[0]
+        if tables < 2:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS transfers ("
+                    "run_id TEXT PRIMARY KEY, "
+                    "transferred TEXT)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+                )
+                self._sync(conn)
+
+    @contextlib.contextmanager
+    def _connect(self, write=True):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            if not write:
+                # Lookups run in autocommit mode, without the write lock
+                yield conn
+                return
+            # Serialize writers (TACA processes and the TSV import) on the database
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _get_meta(self, conn):
+        return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+
+    def _set_meta(self, conn, **values):
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in values.items()],
+        )
+
+    def _tsv_stat(self):
+        try:
+            stat = os.stat(self.tsv_path)
+        except OSError:
+            return None
+        return f"{stat.st_dev}:{stat.st_ino}", stat.st_size, str(stat.st_mtime_ns)
+
+    def _changed(self, conn):
+        """Return True if the TSV file changed since the last import."""
+        tsv_stat = self._tsv_stat()
+        if tsv_stat is None:
+            return False
+        inode, size, mtime = tsv_stat
+        meta = self._get_meta(conn)
+        return (
+            meta.get("tsv_inode") != inode
+            or int(meta.get("tsv_offset", 0)) != size
+            or meta.get("tsv_mtime") != mtime
+        )
+
+    def _sync(self, conn):
+        """Import the rows appended to the TSV file since the last import."""
+        tsv_stat = self._tsv_stat()
+        if tsv_stat is None:
+            return
+        inode, size, mtime = tsv_stat
+        meta = self._get_meta(conn)
+        offset = int(meta.get("tsv_offset", 0))
+        with open(self.tsv_path, "rb") as tsv_file:
+            imported = hashlib.sha1()
+            if offset and size >= offset and meta.get("tsv_inode") == inode:
+                imported.update(tsv_file.read(offset))
+            if offset and imported.hexdigest() != meta.get("tsv_hash"):
+                # The TSV file has been replaced or edited, start over
+                logger.warning(
+                    f"Transfer log {self.tsv_path} changed, re-importing it into {self.db_path}"
+                )
+                conn.execute("DELETE FROM transfers")
+                offset = 0
+                imported = hashlib.sha1()
+                tsv_file.seek(0)
+            new_content = tsv_file.read(size - offset)
+        # Only import complete lines, a writer might be halfway through one
+        complete = new_content[: new_content.rfind(b"\n") + 1]
+        rows = csv.reader(io.StringIO(complete.decode()), delimiter="\t")
+        conn.executemany(
+            "INSERT OR IGNORE INTO transfers (run_id, transferred) VALUES (?, ?)",
+            [(row[0], row[1] if len(row) > 1 else None) for row in rows if row],
+        )
+        imported.update(complete)
+        self._set_meta(
+            conn,
+            tsv_offset=offset + len(complete),
+            tsv_hash=imported.hexdigest(),
+            tsv_inode=inode,
+            tsv_mtime=mtime,
+        )
+
+    def _sync_if_changed(self):
+        with self._connect(write=False) as conn:
+            changed = self._changed(conn)
+        if changed:
+            self.sync()
+
+    def sync(self):
+        """Import any rows appended to the TSV file by other writers."""
+        with self._connect() as conn:
+            self._sync(conn)
+
+    def is_transferred(self, run_id):
+        """Return True if run_id is recorded in the ledger."""
+        self._sync_if_changed()
+        with self._connect(write=False) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM transfers WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return row is not None
+
+    def record(self, run_id, transferred=None):
+        """Append run_id to the TSV file and the database in one transaction.
+
+        :param str run_id: The run id
+        :param str transferred: Transfer date, defaults to now
+        """
+        transferred = transferred or str(datetime.now())
+        with self._connect() as conn:
+            self._sync(conn)
+            line = io.StringIO()
+            csv.writer(line, delimiter="\t").writerow([run_id, transferred])
+            with open(self.tsv_path, "a") as tsv_file:
+                tsv_file.write(line.getvalue())
+            conn.execute(
+                "INSERT OR IGNORE INTO transfers (run_id, transferred) VALUES (?, ?)",
+                (run_id, transferred),
+            )
+            self._sync(conn)
+
+    def query(self, pattern="%"):
+        """Return (run_id, transferred) rows whose run_id matches an SQL LIKE pattern."""
+        self._sync_if_changed()
+        with self._connect(write=False) as conn:
+            return conn.execute(
+                "SELECT run_id, transferred FROM transfers WHERE run_id LIKE ? "
+                "ORDER BY transferred",
+                (pattern,),
+            ).fetchall()
@@ -1,4 +1,5 @@
 import importlib
+import json
 import os
 import shutil
 from tempfile import TemporaryDirectory
@@ -582,3 +583,133 @@ def test_run_preprocessing(create_dirs):
         analysis.run_preprocessing(None, software)
         # Demux in progress, specified run
         analysis.run_preprocessing(run_path, software)
+
+
+def test_get_runObj_twice(create_dirs):
+    """Runs of the same folder built in one process do not share parsed objects."""
+    tmp = create_dirs
+
+    test_config_yaml = make_illumina_test_config(tmp)
+    mock_config = patch("taca.utils.config.CONFIG", new=test_config_yaml)
+    mock_config.start()
+    run_path = create_illumina_run_dir(tmp)
+    importlib.reload(analysis)
+
+    first_run = analysis.get_runObj(run_path, "bcl2fastq")
+    first_run.prepare_samplesheet()
+    index = first_run.runParserObj.samplesheet.data[0]["index"]
+    # As done by _classify_lanes and _upload_to_statusdb
+    first_run.runParserObj.samplesheet.data[0]["index"] = "TTTTTTTTTT"
+    first_run.runParserObj.obj["DemultiplexConfig"] = {"Setup": {}}
+
+    second_run = analysis.get_runObj(run_path, "bcl2fastq")
+    second_run.prepare_samplesheet()
+    assert second_run.runParserObj.samplesheet.data[0]["index"] == index
+    assert "DemultiplexConfig" not in second_run.runParserObj.obj
+
+    mock_config.stop()
+
+
+def test_get_runObj_is_lazy(create_dirs):
+    """Creating a Run parses nothing until its samplesheet is needed."""
+    tmp = create_dirs
+
+    test_config_yaml = make_illumina_test_config(tmp)
+    mock_config = patch("taca.utils.config.CONFIG", new=test_config_yaml)
+    mock_config.start()
+    run_path = create_illumina_run_dir(tmp)
+    importlib.reload(analysis)
+
+    run = analysis.get_runObj(run_path, "bcl2fastq")
+    assert not os.path.exists(os.path.join(run_path, "SampleSheet.csv"))
+    for section in ["runinfo", "samplesheet", "obj"]:
+        assert section not in vars(run.runParserObj)
+
+    assert run.prepare_samplesheet()
+    assert os.path.exists(os.path.join(run_path, "SampleSheet.csv"))
+    assert run.sample_table
+    # The whole run is still not parsed
+    assert "obj" not in vars(run.runParserObj)
+
+    mock_config.stop()
+
+
+def _write_stats_json(run_path, demux_id, lane, conversion_results, barcodes):
+    stats_dir = os.path.join(run_path, f"Demultiplexing_{demux_id}", "Stats")
+    os.makedirs(stats_dir)
+    with open(os.path.join(stats_dir, "Stats.json"), "w") as f:
+        json.dump(
+            {
+                "Flowcell": "2255J2LT3",
+                "RunNumber": 44,
+                "RunId": "20240202_LH00217_0044_A2255J2LT3",
+                "ReadInfosForLanes": [{"LaneNumber": lane, "ReadInfos": []}],
+                "ConversionResults": [
+                    {"LaneNumber": lane, "DemuxResults": conversion_results}
+                ],
+                "UnknownBarcodes": [{"Lane": lane, "Barcodes": barcodes}],
+            },
+            f,
+        )
+    return stats_dir
+
+
+def test_index_swaps_report(create_dirs):
+    """Index swaps are reported with one sub-demultiplexing as with several."""
+    tmp = create_dirs
+
+    test_config_yaml = make_illumina_test_config(tmp)
+    mock_config = patch("taca.utils.config.CONFIG", new=test_config_yaml)
+    mock_config.start()
+    run_path = create_illumina_run_dir(tmp)
+    importlib.reload(analysis)
+
+    run = analysis.get_runObj(run_path, "bcl2fastq")
+    run.prepare_samplesheet()
+    shutil.copy(
+        os.path.join(run_path, "SampleSheet.csv"),
+        os.path.join(run_path, "SampleSheet_0.csv"),
+    )
+    # The reads of P00001_113 with index2 reverse complemented, TTAACGTCCG
+    stats_dir = _write_stats_json(
+        run_path,
+        0,
+        1,
+        [{"SampleId": "Sample_P00001_113", "NumberReads": 1000}],
+        {"ATTCGGCTTA+CGGACGTTAA": 5000, "GGGGGGGGGG+GGGGGGGGGG": 3000},
+    )
+    os.makedirs(os.path.join(run_path, "Demultiplexing_0", "Reports"))
+
+    # Single sub-demultiplexing
+    assert run._aggregate_demux_results_simple_complex()
+    with open(os.path.join(stats_dir, "index_swaps.json")) as f:
+        swaps = json.load(f)
+    assert [(swap["sample"], swap["variant"]) for swap in swaps] == [
+        ("Sample_P00001_113", "index2 reverse complemented")
+    ]
+    assert os.path.exists(
+        os.path.join(run_path, "Demultiplexing", "Stats", "index_swaps.json")
+    )
+
+    # Several sub-demultiplexings
+    demux_folder = os.path.join(run_path, "Demultiplexing_all")
+    stats_json = [
+        os.path.join(stats_dir, "Stats.json"),
+        os.path.join(
+            _write_stats_json(run_path, 1, 2, [], {"GGGGGGGGGG+GGGGGGGGGG": 10}),
+            "Stats.json",
+        ),
+    ]
+    run._fix_demultiplexingstats_xml_dir(
+        demux_folder,
+        stats_json,
+        [os.path.join(run_path, "SampleSheet_0.csv")],
+        [19, 10],
+        {"1": {"0": []}, "2": {"1": []}},
+        {},
+        [],
+    )
+    with open(os.path.join(demux_folder, "Stats", "index_swaps.json")) as f:
+        assert json.load(f) == swaps
+
+    mock_config.stop()
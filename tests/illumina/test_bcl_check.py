@@ -0,0 +1,147 @@
+import os
+import struct
+
+from taca.illumina.bcl_check import (
+    BGZF_EOF,
+    check_bcl_files,
+    format_report,
+)
+
+RUN_INFO = """<?xml version="1.0"?>
+<RunInfo Version="6">
+  <Run Id="20240202_LH00217_0044_A2255J2LT3" Number="44">
+    <Reads>
+      <Read Number="1" NumCycles="2" IsIndexedRead="N" />
+      <Read Number="2" NumCycles="1" IsIndexedRead="Y" />
+    </Reads>
+    <FlowcellLayout LaneCount="2" SurfaceCount="2" SwathCount="2" TileCount="2">
+      <TileSet TileNamingConvention="FourDigit">
+        <Tiles>
+          {tiles}
+        </Tiles>
+      </TileSet>
+    </FlowcellLayout>
+  </Run>
+</RunInfo>
+"""
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def _run_dir(tmp, name, tiles=""):
+    run_dir = os.path.join(tmp.name, name)
+    _write(os.path.join(run_dir, "RunInfo.xml"), RUN_INFO.format(tiles=tiles).encode())
+    return run_dir
+
+
+def _cbcl(compressed_sizes):
+    tiles = b"".join(
+        struct.pack("<IIII", 1101 + i, 100, 200, size)
+        for i, size in enumerate(compressed_sizes)
+    )
+    # Two q-score bins
+    header = (
+        (struct.pack("<I", 2) + struct.pack("<II", 0, 2) * 2)
+        + struct.pack("<I", len(compressed_sizes))
+        + tiles
+        + b"\x01"
+    )
+    header_size = 2 + 4 + 1 + 1 + len(header)
+    return (
+        struct.pack("<HIBB", 1, header_size, 2, 2)
+        + header
+        + b"\x00" * sum(compressed_sizes)
+    )
+
+
+def test_cbcl(create_dirs):
+    tmp = create_dirs
+    run_dir = _run_dir(tmp, "20240202_LH00217_0044_A2255J2LT3")
+    basecalls = os.path.join(run_dir, "Data", "Intensities", "BaseCalls")
+    for lane in (1, 2):
+        for cycle in (1, 2, 3):
+            for surface in (1, 2):
+                _write(
+                    os.path.join(
+                        basecalls,
+                        f"L00{lane}",
+                        f"C{cycle}.1",
+                        f"L00{lane}_{surface}.cbcl",
+                    ),
+                    _cbcl([10, 20]),
+                )
+    assert check_bcl_files(run_dir, workers=4) == []
+
+    os.remove(os.path.join(basecalls, "L002", "C3.1", "L002_1.cbcl"))
+    _write(os.path.join(basecalls, "L001", "C2.1", "L001_2.cbcl"), _cbcl([10, 20])[:-5])
+    problems = check_bcl_files(run_dir, workers=4)
+    assert problems == [
+        (
+            os.path.join(
+                "Data", "Intensities", "BaseCalls", "L001", "C2.1", "L001_2.cbcl"
+            ),
+            f"truncated, {len(_cbcl([10, 20])) - 5} bytes instead of {len(_cbcl([10, 20]))}",
+        ),
+        (
+            os.path.join(
+                "Data", "Intensities", "BaseCalls", "L002", "C3.1", "L002_1.cbcl"
+            ),
+            "missing",
+        ),
+    ]
+    assert format_report(problems, limit=1).endswith("... and 1 more")
+
+
+def test_bgzf(create_dirs):
+    tmp = create_dirs
+    run_dir = _run_dir(tmp, "240109_NB501038_0333_AHFB5KJM5")
+    basecalls = os.path.join(run_dir, "Data", "Intensities", "BaseCalls")
+    for lane in (1, 2):
+        for cycle in (1, 2, 3):
+            _write(
+                os.path.join(basecalls, f"L00{lane}", f"000{cycle}.bcl.bgzf"),
+                b"\x1f\x8b" + b"\x00" * 30 + BGZF_EOF,
+            )
+    assert check_bcl_files(run_dir) == []
+    _write(os.path.join(basecalls, "L002", "0002.bcl.bgzf"), b"\x1f\x8b" + b"\x00" * 30)
+    assert check_bcl_files(run_dir) == [
+        (
+            os.path.join("Data", "Intensities", "BaseCalls", "L002", "0002.bcl.bgzf"),
+            "truncated, no BGZF end-of-file block",
+        )
+    ]
+
+
+def test_bcl_per_tile(create_dirs):
+    tmp = create_dirs
+    run_dir = _run_dir(
+        tmp,
+        "200508_M01234_0123_000000000-ABCDE",
+        tiles="<Tile>1_1101</Tile><Tile>2_1101</Tile>",
+    )
+    basecalls = os.path.join(run_dir, "Data", "Intensities", "BaseCalls")
+    for lane in (1, 2):
+        for cycle in (1, 2, 3):
+            _write(
+                os.path.join(
+                    basecalls, f"L00{lane}", f"C{cycle}.1", f"s_{lane}_1101.bcl"
+                ),
+                struct.pack("<I", 3) + b"\x00" * 3,
+            )
+    assert check_bcl_files(run_dir) == []
+    _write(
+        os.path.join(basecalls, "L001", "C3.1", "s_1_1101.bcl"),
+        struct.pack("<I", 3) + b"\x00",
+    )
+    assert check_bcl_files(run_dir) == [
+        (
+            os.path.join(
+                "Data", "Intensities", "BaseCalls", "L001", "C3.1", "s_1_1101.bcl"
+            ),
+            "5 bytes instead of 7",
+        )
+    ]
@@ -0,0 +1,104 @@
+import os
+import tempfile
+
+from taca.illumina.bclconvert_reports import BclConvertReport, has_native_reports
+from taca.illumina.lane_reports import summarize_lanes
+
+DEMULTIPLEX_STATS = """Lane,SampleID,Sample_Project,Index,# Reads,# Perfect Index Reads,# One Mismatch Index Reads,# Two Mismatch Index Reads,% Reads,% Perfect Index Reads,% One Mismatch Index Reads,% Two Mismatch Index Reads
+1,Sample_P1_1001,P1,ACGTACGT-TTGGCCAA,600000,570000,30000,0,0.6,0.95,0.05,0
+1,Sample_P1_1002,P1,GGTTAACC-CCAATTGG,300000,300000,0,0,0.3,1,0,0
+1,Undetermined,,,100000,100000,0,0,0.1,1,0,0
+2,Sample_P2_1001,P2,ACGTACGT-TTGGCCAA,2000000,1900000,100000,0,1,0.95,0.05,0
+2,Undetermined,,,0,0,0,0,0,0,0,0
+"""
+
+QUALITY_METRICS = """Lane,SampleID,index,index2,ReadNumber,Yield,YieldQ30,QualityScoreSum,Mean Quality Score (PF),% Q30
+1,Sample_P1_1001,ACGTACGT,TTGGCCAA,1,90000000,81000000,3150000000,35.00,0.90
+1,Sample_P1_1001,ACGTACGT,TTGGCCAA,2,90000000,72000000,2970000000,33.00,0.80
+1,Sample_P1_1002,GGTTAACC,CCAATTGG,1,45000000,45000000,1575000000,35.00,1.00
+1,Sample_P1_1002,GGTTAACC,CCAATTGG,I1,2400000,2400000,84000000,35.00,1.00
+1,Undetermined,,,1,15000000,7500000,450000000,30.00,0.50
+2,Sample_P2_1001,ACGTACGT,TTGGCCAA,1,300000000,270000000,10500000000,35.00,0.90
+"""
+
+
+def _write_reports(reports_dir):
+    for name, content in [
+        ("Demultiplex_Stats.csv", DEMULTIPLEX_STATS),
+        ("Quality_Metrics.csv", QUALITY_METRICS),
+    ]:
+        with open(os.path.join(reports_dir, name), "w") as f:
+            f.write(content)
+
+
+def test_bclconvert_report_tables():
+    with tempfile.TemporaryDirectory() as reports_dir:
+        assert not has_native_reports(reports_dir)
+        _write_reports(reports_dir)
+        assert has_native_reports(reports_dir)
+        samplesheet_data = [
+            {
+                "Lane": "1",
+                "Sample_ID": "Sample_P1_1001",
+                "Sample_Name": "P1_1001",
+                "Sample_Project": "P1",
+            }
+        ]
+        tile_metrics = {
+            "1": {"clusters": 1250000, "clusters_pf": 1000000, "percent_pf": 80.0},
+            "2": {"clusters": 2500000, "clusters_pf": 2000000, "percent_pf": 80.0},
+        }
+        report = BclConvertReport(reports_dir, samplesheet_data, tile_metrics)
+
+        lane_table = report.lane_table()
+        assert lane_table.flowcell_data == {
+            "Clusters (Raw)": "3,750,000",
+            "Clusters(PF)": "3,000,000",
+            "Yield (MBases)": "540",
+        }
+        lane_1 = lane_table.sample_data[0]
+        assert lane_1["Lane"] == "1"
+        assert lane_1["PF Clusters"] == "1,000,000"
+        assert lane_1["% of thelane"] == "100.00"
+        assert lane_1["% Perfectbarcode"] == "87.00"
+        assert lane_1["% One mismatchbarcode"] == "3.00"
+        # Index reads are left out of the yield
+        assert lane_1["Yield (Mbases)"] == "240"
+        assert lane_1["% PFClusters"] == "80.00"
+        assert lane_1["% >= Q30bases"] == "85.62"
+        assert lane_1["Mean QualityScore"] == "33.94"
+
+        barcodes = report.laneBarcode_table().sample_data
+        assert [(entry["Lane"], entry["Sample"]) for entry in barcodes] == [
+            ("1", "P1_1001"),
+            ("1", "Sample_P1_1002"),
+            ("1", "Undetermined"),
+            ("2", "Sample_P2_1001"),
+            ("2", "Undetermined"),
+        ]
+        assert barcodes[0]["Barcode sequence"] == "ACGTACGT-TTGGCCAA"
+        assert barcodes[0]["% of thelane"] == "60.00"
+        assert barcodes[0]["Yield (Mbases)"] == "180"
+        assert barcodes[2]["Project"] == "default"
+        assert barcodes[2]["Barcode sequence"] == "unknown"
+        assert barcodes[4]["% >= Q30bases"] == "0.00"
+        # Not known per sample
+        assert "% PFClusters" not in barcodes[0]
+
+        # The tables can be aggregated as those parsed from html reports
+        number_reads_summary, flowcell_data = summarize_lanes(
+            lane_table.sample_data, []
+        )
+        assert number_reads_summary["2"] == {
+            "total_lane_cluster": 2000000,
+            "total_lane_yield": 300,
+        }
+        assert flowcell_data["Clusters (Raw)"] == "3,750,000"
+
+        # Without InterOp tile metrics, raw clusters and % PF are left out
+        report = BclConvertReport(reports_dir, samplesheet_data)
+        lane_table = report.lane_table()
+        assert "Clusters (Raw)" not in lane_table.flowcell_data
+        assert "% PFClusters" not in lane_table.sample_data[0]
+        _, flowcell_data = summarize_lanes(lane_table.sample_data, [])
+        assert flowcell_data == {"Clusters(PF)": "3,000,000", "Yield (MBases)": "540"}
@@ -0,0 +1,36 @@
+import os
+
+from taca.illumina.catalog import RunCatalog, run_fingerprint
+
+
+def test_run_catalog(create_dirs):
+    tmp = create_dirs
+    run_dir = os.path.join(
+        tmp.name, "ngi_data/sequencing/NovaSeqXPlus/20240202_LH00217_0044_A2255J2LT3"
+    )
+    os.makedirs(run_dir)
+    catalog = RunCatalog(os.path.join(tmp.name, "log", "run_catalog.sqlite"))
+    run_id = os.path.basename(run_dir)
+
+    # Unknown runs are never skipped
+    fingerprint = run_fingerprint(run_dir)
+    assert not catalog.is_unchanged(run_id, fingerprint)
+
+    # Sequencing runs are not skipped by default, their progress is uploaded
+    catalog.update(run_id, "SEQUENCING", fingerprint)
+    assert catalog.get(run_id) == ("SEQUENCING", fingerprint)
+    assert not catalog.is_unchanged(run_id, run_fingerprint(run_dir))
+    assert catalog.is_unchanged(run_id, fingerprint, statuses=["SEQUENCING"])
+
+    # Sequencing finishes, the fingerprint moves
+    open(os.path.join(run_dir, "RTAComplete.txt"), "w").close()
+    open(os.path.join(run_dir, "CopyComplete.txt"), "w").close()
+    assert not catalog.is_unchanged(run_id, run_fingerprint(run_dir))
+
+    # Sub-demultiplexing stats appear
+    catalog.update(run_id, "IN_PROGRESS", run_fingerprint(run_dir))
+    os.makedirs(os.path.join(run_dir, "Demultiplexing_0", "Stats"))
+    assert not catalog.is_unchanged(run_id, run_fingerprint(run_dir))
+
+    catalog.remove(run_id)
+    assert catalog.get(run_id) is None
@@ -0,0 +1,33 @@
+import os
+
+from taca.illumina.demux_executor import BatchExecutor, LocalExecutor
+
+
+class _Scheduler:
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue(self, run_id, run_dir, demux_id, cmd, software, cost):
+        self.jobs.append((run_id, demux_id, cmd, cost))
+
+
+def test_local_executor_with_scheduler(create_dirs):
+    tmp = create_dirs
+    scheduler = _Scheduler()
+    LocalExecutor(scheduler).submit(
+        "run", tmp.name, "1_L2", ["bcl-convert"], "bclconvert", 10
+    )
+    assert scheduler.jobs == [("run", "1_L2", ["bcl-convert"], 10)]
+
+
+def test_batch_executor(create_dirs):
+    tmp = create_dirs
+    # The shell stands in for the submit command of the batch scheduler
+    executor = BatchExecutor("sh")
+    executor.submit("run", tmp.name, "1_L2", ["echo", "lane 2"], "bclconvert", 10)
+    assert os.access(os.path.join(tmp.name, "demux_1_L2.sh"), os.X_OK)
+    with open(os.path.join(tmp.name, "demux_1_L2_echo.out")) as out:
+        lines = out.read().splitlines()
+    assert lines[0].startswith("Started command echo 'lane 2' on ")
+    assert lines[1] == "lane 2"
+    assert os.path.exists(os.path.join(tmp.name, "demux_1_L2_echo.err"))
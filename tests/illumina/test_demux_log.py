@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from taca.illumina.demux_log import DemuxLogScanner
+
+
+def test_demux_log_scanner_bclconvert(create_dirs):
+    tmp = create_dirs
+    log = os.path.join(tmp.name, "demux_0_bcl-convert.err")
+    with open(log, "w") as f:
+        f.write("INFO: starting\n")
+        for i in range(8):
+            f.write(f"WARNING: warning {i}\n")
+        f.write("ERROR: error 0\nINFO: partial")
+
+    scanner = DemuxLogScanner(log, "bclconvert", keep=3)
+    errors, warnings, first, last, count = scanner.scan()
+    assert (errors, warnings, count) == (1, 8, 9)
+    assert first == [f"WARNING: warning {i}\n" for i in range(3)]
+    assert last == ["WARNING: warning 6\n", "WARNING: warning 7\n", "ERROR: error 0\n"]
+    assert os.path.exists(log + ".scan.json")
+
+    # Only the appended bytes are read on the next scan
+    with open(log, "a") as f:
+        f.write(" line done\nERROR: error 1\n")
+    errors, warnings, first, last, count = scanner.scan()
+    assert (errors, warnings, count) == (2, 8, 10)
+    assert first == [f"WARNING: warning {i}\n" for i in range(3)]
+    assert last[-1] == "ERROR: error 1\n"
+
+    # A restarted demultiplexing replaces the log
+    os.remove(log)
+    with open(log, "w") as f:
+        f.write("WARNING: again\n")
+    assert DemuxLogScanner(log, "bclconvert", keep=3).scan()[:2] == (0, 1)
+
+    # The last line of a complete log is counted, newline or not
+    with open(log, "a") as f:
+        f.write("ERROR: no newline")
+    scanner = DemuxLogScanner(log, "bclconvert", keep=3)
+    assert scanner.scan()[:2] == (0, 1)
+    errors, warnings, first, last, count = scanner.scan(complete=True)
+    assert (errors, warnings, count) == (1, 1, 2)
+    assert last[-1] == "ERROR: no newline"
+    # And only once
+    assert scanner.scan(complete=True)[:2] == (1, 1)
+
+
+def test_demux_log_scanner_bcl2fastq(create_dirs):
+    tmp = create_dirs
+    log = os.path.join(tmp.name, "demux_0_bcl2fastq.err")
+    with open(log, "w") as f:
+        f.write("2024-02-02 WARNING: something\n")
+    scanner = DemuxLogScanner(log, "bcl2fastq")
+    with pytest.raises(RuntimeError):
+        scanner.scan()
+
+    with open(log, "a") as f:
+        f.write("Processing completed with 0 errors and 1 warnings.\n")
+    errors, warnings, first, last, count = scanner.scan()
+    assert (errors, warnings, count) == (0, 1, 1)
+    assert first == last == ["2024-02-02 WARNING: something\n"]
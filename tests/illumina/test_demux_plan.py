@@ -0,0 +1,94 @@
+import os
+
+from taca.illumina.demux_plan import (
+    DEMUX_PLAN,
+    group_samples,
+    load_demux_plan,
+    plan_demux,
+    write_demux_plan,
+)
+
+
+def _sample(name, sample_type, index_length, read_length=(151, 151)):
+    return (
+        name,
+        {
+            "sample_type": sample_type,
+            "index_length": list(index_length),
+            "umi_length": [0, 0],
+            "read_length": list(read_length),
+        },
+    )
+
+
+SAMPLE_TABLE = {
+    "1": [
+        _sample("P1_101", "ordinary", (8, 8)),
+        _sample("P1_102", "ordinary", (10, 10)),
+        _sample("P2_101", "10X_DUAL", (10, 10)),
+    ],
+    "2": [
+        # Masks in the opposite order of lane 1
+        _sample("P1_201", "ordinary", (10, 10)),
+        _sample("P1_202", "ordinary", (8, 8)),
+        _sample("P1_203", "ordinary", (8, 8)),
+    ],
+    "3": [_sample("P3_101", "ordinary", (8, 8))],
+}
+MASK_8 = ((8, 8), (0, 0), (151, 151))
+MASK_10 = ((10, 10), (0, 0), (151, 151))
+
+
+def test_group_samples():
+    groups, lane_masks = group_samples(SAMPLE_TABLE)
+    assert groups[("ordinary",) + MASK_8] == {
+        "1": ["P1_101"],
+        "2": ["P1_202", "P1_203"],
+        "3": ["P3_101"],
+    }
+    assert lane_masks["ordinary"] == {
+        "1": [MASK_8, MASK_10],
+        "2": [MASK_10, MASK_8],
+        "3": [MASK_8],
+    }
+
+
+def test_plan_demux():
+    # bcl-convert: one sub-demultiplexing per sample type and mask
+    plan = plan_demux(SAMPLE_TABLE, "bclconvert")
+    assert [
+        (demux["demux_id"], demux["sample_type"], demux["mask"])
+        for demux in plan["demuxes"]
+    ] == [(0, "10X_DUAL", MASK_10), (1, "ordinary", MASK_8), (2, "ordinary", MASK_10)]
+    assert plan["demuxes"][1]["mask_table"] == {"1": MASK_8, "2": MASK_8, "3": MASK_8}
+    assert plan["demuxes"][2]["samples_to_include"] == {
+        "1": ["P1_102"],
+        "2": ["P1_201"],
+    }
+
+    # bcl2fastq: the Nth mask of each lane goes to the Nth sub-demultiplexing
+    plan = plan_demux(SAMPLE_TABLE, "bcl2fastq")
+    assert len(plan["demuxes"]) == 3
+    assert plan["demuxes"][1]["mask_table"] == {"1": MASK_8, "2": MASK_10, "3": MASK_8}
+    assert plan["demuxes"][2]["samples_to_include"] == {
+        "1": ["P1_102"],
+        "2": ["P1_202", "P1_203"],
+    }
+
+
+def test_demux_plan_file(create_dirs):
+    tmp = create_dirs
+    assert load_demux_plan(tmp.name) is None
+    plan = plan_demux(SAMPLE_TABLE, "bclconvert")
+    write_demux_plan(tmp.name, plan)
+    assert os.path.exists(os.path.join(tmp.name, DEMUX_PLAN))
+
+    loaded = load_demux_plan(tmp.name, SAMPLE_TABLE, "bclconvert")
+    assert [demux["samples_to_include"] for demux in loaded["demuxes"]] == [
+        demux["samples_to_include"] for demux in plan["demuxes"]
+    ]
+    # Outdated once the samples or the software change
+    assert load_demux_plan(tmp.name, SAMPLE_TABLE, "bcl2fastq") is None
+    changed_table = dict(SAMPLE_TABLE, **{"4": [_sample("P4_101", "ordinary", (8, 0))]})
+    assert load_demux_plan(tmp.name, changed_table, "bclconvert") is None
+    assert load_demux_plan(tmp.name) is not None
@@ -0,0 +1,92 @@
+import os
+import subprocess
+
+from taca.illumina.demux_queue import (
+    FINISHED,
+    QUEUED,
+    RUNNING,
+    DemuxScheduler,
+    command_cpus,
+)
+
+
+def test_command_cpus():
+    cmd = [
+        "bcl-convert",
+        "--bcl-num-conversion-threads",
+        "8",
+        "--bcl-num-compression-threads",
+        "4",
+        "--output-dir",
+        "Demultiplexing_0",
+    ]
+    assert command_cpus(cmd, "bclconvert") == 12
+    assert command_cpus(cmd, "bcl2fastq", default=16) == 16
+
+
+def test_demux_scheduler(create_dirs):
+    tmp = create_dirs
+    run_dir = os.path.join(tmp.name, "ngi_data/sequencing/NovaSeqXPlus/run")
+    os.makedirs(run_dir)
+    launched = []
+    pids = {}
+
+    def launch(job):
+        launched.append((job["run_id"], job["demux_id"]))
+        # A process that has finished by the time it is checked
+        process = subprocess.Popen(["true"])
+        process.wait()
+        return pids.get(job["demux_id"], process.pid)
+
+    db_path = os.path.join(tmp.name, "log", "demux_queue.sqlite")
+    scheduler = DemuxScheduler(
+        db_path, cpus=16, mem_gb=64, job_cpus=8, job_mem_gb=32, launch=launch
+    )
+    # Jobs 0 and 2 are still running when checked
+    pids["0"] = pids["2"] = os.getpid()
+    scheduler.enqueue("run_A", run_dir, 0, ["bcl-convert"], "bclconvert", cost=100)
+    scheduler.enqueue("run_A", run_dir, 1, ["bcl-convert"], "bclconvert", cost=50)
+    scheduler.enqueue("run_B", run_dir, 2, ["bcl-convert"], "bclconvert", cost=400)
+    assert scheduler.job_states("run_A") == {"0": QUEUED, "1": QUEUED}
+
+    # The longest jobs first, within 16 CPUs and 64 GB
+    assert scheduler.schedule() == [("run_B", "2"), ("run_A", "0")]
+    assert scheduler.job_states("run_A") == {"0": RUNNING, "1": QUEUED}
+    assert scheduler.has_pending("run_A")
+
+    # Queue state survives a restart, nothing has finished yet
+    scheduler = DemuxScheduler(db_path, cpus=16, mem_gb=64, launch=launch)
+    assert scheduler.schedule() == []
+
+    # Jobs larger than the whole budget run one at a time
+    pids.clear()
+    scheduler.cpus = 1
+    scheduler.enqueue("run_C", run_dir, 3, ["bcl-convert"], "bclconvert", cost=1)
+    with scheduler._connect() as conn:
+        conn.execute("UPDATE jobs SET state = 'FINISHED' WHERE demux_id IN ('0', '2')")
+    assert scheduler.schedule() == [("run_A", "1")]
+    # Job 1 has exited, its resources are freed
+    assert scheduler.schedule() == [("run_C", "3")]
+    assert scheduler.schedule() == []
+    assert not scheduler.has_pending("run_A")
+
+
+def test_demux_scheduler_reused_pid(create_dirs):
+    tmp = create_dirs
+    run_dir = os.path.join(tmp.name, "ngi_data/sequencing/NovaSeqXPlus/run")
+    os.makedirs(run_dir)
+    db_path = os.path.join(tmp.name, "log", "demux_queue.sqlite")
+    scheduler = DemuxScheduler(
+        db_path, cpus=16, mem_gb=64, launch=lambda job: os.getpid()
+    )
+    scheduler.enqueue("run_A", run_dir, 0, ["bcl-convert"], "bclconvert", cost=1)
+    scheduler.schedule()
+    assert scheduler.job_states("run_A") == {"0": RUNNING}
+    scheduler.schedule()
+    assert scheduler.job_states("run_A") == {"0": RUNNING}
+
+    # After a reboot the pid belongs to a process started at another time
+    with scheduler._connect() as conn:
+        conn.execute("UPDATE jobs SET pid_start_time = pid_start_time + 1")
+    scheduler.schedule()
+    assert scheduler.job_states("run_A") == {"0": FINISHED}
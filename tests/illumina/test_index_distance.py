@@ -0,0 +1,101 @@
+import numpy as np
+
+from taca.illumina.index_distance import (
+    check_demux_indexes,
+    check_lane_indexes,
+    encode_indexes,
+    hamming_distances,
+)
+
+
+def test_hamming_distances():
+    encoded = encode_indexes(["ACGTACGT", "ACGTACGA", "acgt"], 8)
+    assert encoded.dtype == np.uint8
+    assert encoded.shape == (3, 8)
+    assert hamming_distances(encoded).tolist() == [[0, 1, 4], [1, 0, 4], [4, 4, 0]]
+
+
+def test_check_lane_indexes():
+    # Far apart, all configured mismatches are kept
+    result = check_lane_indexes(
+        [("S1", "AAAAAAAA", "CCCCCCCC"), ("S2", "GGGGGGGG", "TTTTTTTT")], 8, 8
+    )
+    assert result == {
+        "collisions": [],
+        "min_distance": (8, 8),
+        "barcode_mismatches": (1, 1),
+    }
+
+    # Index 2 three mismatches apart is enough to tell the samples apart
+    result = check_lane_indexes(
+        [("S1", "AAAAAAAA", "CCCCCCCC"), ("S2", "AAAAAAAG", "CCCCCTTT")], 8, 8
+    )
+    assert result["min_distance"] == (1, 3)
+    assert result["barcode_mismatches"] == (1, 1)
+
+    # Two mismatches apart in both, one mismatch can only be allowed on one index
+    result = check_lane_indexes(
+        [("S1", "AAAAAAAA", "CCCCCCCC"), ("S2", "AAAAAAGG", "CCCCCCTT")], 8, 8
+    )
+    assert result["barcode_mismatches"] == (1, 0)
+
+    # Single index, two mismatches apart
+    result = check_lane_indexes(
+        [("S1", "AAAAAAAA", ""), ("S2", "AAAAAAGG", "")], 8, 0, (1, 1)
+    )
+    assert result["barcode_mismatches"] == (0, 1)
+
+    # Identical indexes, the rows of a same sample are not compared
+    result = check_lane_indexes(
+        [
+            ("S1", "AAAAAAAA", ""),
+            ("S1", "AAAAAAAA", ""),
+            ("S2", "AAAAAAAA", ""),
+        ],
+        8,
+        0,
+    )
+    assert result["collisions"] == [("S1", "S2")]
+
+
+def test_check_demux_indexes():
+    samplesheet_data = [
+        {
+            "Lane": "1",
+            "Sample_ID": "Sample_P1_101",
+            "Sample_Name": "P1_101",
+            "index": "ACGTACGT",
+            "index2": "",
+        },
+        {
+            "Lane": "1",
+            "Sample_ID": "Sample_P1_102",
+            "Sample_Name": "P1_102",
+            "index": "ACGTACGA",
+            "index2": "",
+        },
+        # Not part of this sub-demultiplexing
+        {
+            "Lane": "1",
+            "Sample_ID": "Sample_P1_103",
+            "Sample_Name": "P1_103",
+            "index": "ACGTACGT",
+            "index2": "",
+        },
+        # IDT UMI, the Ns are not part of the index
+        {
+            "Lane": "2",
+            "Sample_ID": "Sample_P2_101",
+            "Sample_Name": "P2_101",
+            "index": "ACGTACGTNNNNNNNNN",
+            "index2": "",
+        },
+    ]
+    results = check_demux_indexes(
+        samplesheet_data,
+        {"1": ["P1_101", "P1_102"], "2": ["P2_101"]},
+        {"1": ((8, 0), (0, 0), (151, 151)), "2": ((8, 0), (9, 0), (151, 151))},
+    )
+    assert results["1"]["collisions"] == []
+    assert results["1"]["barcode_mismatches"] == (0, 1)
+    assert results["2"]["barcode_mismatches"] == (1, 1)
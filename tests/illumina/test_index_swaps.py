@@ -0,0 +1,113 @@
+from taca.illumina.index_swaps import (
+    find_index_swaps,
+    index_variants,
+    samplesheet_samples,
+    stats_assigned_reads,
+)
+
+SAMPLES = {
+    "1": [
+        ("Sample_P1_101", "AAAACCCC", "ACGTACGG"),
+        ("Sample_P1_102", "GGGGTTTT", "TTGGCCAA"),
+    ],
+    "2": [("Sample_P2_101", "CCCCAAAA", "")],
+}
+
+
+def test_index_variants():
+    variants = index_variants("AAAACCCC", "ACGTACGG")
+    assert variants["index2 reverse complemented"] == ("AAAACCCC", "CCGTACGT")
+    assert variants["index and index2 swapped"] == ("ACGTACGG", "AAAACCCC")
+    assert len(variants) == 5
+    assert index_variants("CCCCAAAA", "") == {
+        "index reverse complemented": ("TTTTGGGG", "")
+    }
+
+
+def test_find_index_swaps():
+    unknown_barcodes = [
+        {
+            "Lane": 1,
+            "Barcodes": {
+                # index2 of Sample_P1_101 reverse complemented, with a mismatch
+                "AAAACCCC+CCGTACGT": 60000,
+                "AAAACCCC+CCGTACGA": 5000,
+                # index and index2 of Sample_P1_102 swapped
+                "TTGGCCAA+GGGGTTTT": 800,
+                "NNNNNNNN+NNNNNNNN": 20000,
+                "GGGG+TTGG": 3000,
+            },
+        },
+        {"Lane": 2, "Barcodes": {"TTTTGGGG": 4000}},
+        {"Lane": 3, "Barcodes": {"ACACACAC": 90000}},
+    ]
+    assigned = {
+        ("1", "Sample_P1_101"): 1000,
+        ("1", "Sample_P1_102"): 500000,
+        ("2", "Sample_P2_101"): 2000,
+    }
+    swaps = find_index_swaps(unknown_barcodes, SAMPLES, assigned)
+    assert [(swap["lane"], swap["sample"], swap["variant"]) for swap in swaps] == [
+        ("1", "Sample_P1_101", "index2 reverse complemented"),
+        ("2", "Sample_P2_101", "index reverse complemented"),
+    ]
+    assert swaps[0]["hits"] == 65000
+    assert swaps[0]["index2"] == "CCGTACGT"
+    assert swaps[0]["assigned"] == 1000
+    # No mismatch allowed
+    swaps = find_index_swaps(unknown_barcodes, SAMPLES, assigned, max_mismatches=0)
+    assert swaps[0]["hits"] == 60000
+    # Small swaps are reported with lower thresholds
+    swaps = find_index_swaps(
+        unknown_barcodes, SAMPLES, assigned, min_hits=500, min_fraction=0
+    )
+    assert ("Sample_P1_102", "index and index2 swapped", 800) in [
+        (swap["sample"], swap["variant"], swap["hits"]) for swap in swaps
+    ]
+    # Without assigned reads only min_hits applies
+    assert len(find_index_swaps(unknown_barcodes, SAMPLES)) == 2
+    assert find_index_swaps(unknown_barcodes, {}) == []
+
+
+def test_samplesheet_samples():
+    data = [
+        {"Lane": "1", "Sample_ID": "Sample_P1_101", "index": "AAAA", "index2": "CCCC"},
+        {"Lane": "2", "Sample_ID": "Sample_P2_101", "index": "NOINDEX"},
+        {"Lane": "3", "Sample_ID": "Sample_P3_101", "index": "GGGG"},
+        # IDT UMI
+        {
+            "Lane": "4",
+            "Sample_ID": "Sample_P4_101",
+            "index": "AACCGGTANNNNNNNNN",
+            "index2": "TTGGCCAC",
+        },
+    ]
+    samples = samplesheet_samples(data)
+    assert samples == {
+        "1": [("Sample_P1_101", "AAAA", "CCCC")],
+        "3": [("Sample_P3_101", "GGGG", "")],
+        "4": [("Sample_P4_101", "AACCGGTA", "TTGGCCAC")],
+    }
+    # The UMI sample is found with its index2 reverse complemented
+    unknown_barcodes = [{"Lane": 4, "Barcodes": {"AACCGGTA+GTGGCCAA": 5000}}]
+    swaps = find_index_swaps(unknown_barcodes, samples)
+    assert [(swap["sample"], swap["variant"]) for swap in swaps] == [
+        ("Sample_P4_101", "index2 reverse complemented")
+    ]
+
+
+def test_stats_assigned_reads():
+    conversion_results = [
+        {
+            "LaneNumber": 1,
+            "DemuxResults": [
+                {"SampleId": "Sample_P1_101", "NumberReads": 10},
+                {"SampleId": "Sample_P1_102", "NumberReads": 20},
+            ],
+        },
+        {"LaneNumber": 2},
+    ]
+    assert stats_assigned_reads(conversion_results) == {
+        ("1", "Sample_P1_101"): 10,
+        ("1", "Sample_P1_102"): 20,
+    }
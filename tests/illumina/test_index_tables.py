@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from taca.illumina.index_tables import (
+    index_kind,
+    load_10X_indexes,
+    load_smartseq_indexes,
+)
+
+
+def test_index_tables(create_dirs):
+    tmp = create_dirs
+    tenX_path = os.path.join(tmp.name, "config", "Chromium_10X_indexes.txt")
+    smartseq_path = os.path.join(tmp.name, "config", "Smart-seq3_v1.5.csv")
+
+    tenX = load_10X_indexes(tenX_path)
+    assert tenX["SI-GA-A1"] == ("GGTTTACT", "CTAAACGG", "TCGGCGTC", "AACCGTAA")
+    assert tenX["SI-TT-A1"] == ("GTAACATGCG", "AGGTAACACT")
+    # Parsed once per process while the file is unchanged
+    assert load_10X_indexes(tenX_path) is tenX
+    with pytest.raises(TypeError):
+        tenX["SI-GA-A1"] = ("AAAAAAAA",)
+
+    smartseq = load_smartseq_indexes(smartseq_path)
+    assert smartseq["1A"][0] == ("GAGCGCCTAT", "CGCGTACCAA")
+
+    assert index_kind("SI-GA-A1", tenX) == "10X_SINGLE"
+    assert index_kind("SI-TT-A1", tenX) == "10X_DUAL"
+    assert index_kind("SMARTSEQ3-1A", tenX) == "SMARTSEQ"
+    assert index_kind("GGTTTACT", tenX) is None
+
+    # Changes to the file are picked up
+    with open(tenX_path, "a") as f:
+        f.write("\nSI-NA-H13,ACGTACGT,CATGCATG,GTCAGTCA,TGCATGCA\n")
+    reloaded = load_10X_indexes(tenX_path)
+    assert reloaded is not tenX
+    assert reloaded["SI-NA-H13"][2] == "GTCAGTCA"
@@ -0,0 +1,99 @@
+import os
+
+from taca.illumina import instrument
+from taca.illumina.instrument import (
+    classify_instrument_name,
+    classify_run_name,
+    detect_instrument,
+    read_instrument_field,
+)
+
+
+def _run_parameters(run_dir, content, name="RunParameters.xml"):
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, name)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def test_classify_run_name():
+    assert classify_run_name("20241016_LH00217_0123_B22HG3FLT3") == "NovaSeqXPlus"
+    assert classify_run_name("200624_A00834_0183_BHMTFYDRXX") == "NovaSeq"
+    assert classify_run_name("240109_VH00203_333_AAFB5KJM5") == "NextSeq"
+    assert classify_run_name("200508_M01234_0123_000000000-ABCDE") == "MiSeq"
+    assert classify_run_name("190201_ST-E00214_0278_BHCXXXCCXY") == "HiSeq X"
+    assert classify_run_name("190201_D00123_0278_BHCXXXCCXY") == "HiSeq"
+    # MiSeq flowcell on an unknown instrument
+    assert classify_run_name("200508_X01234_0123_000000000-ABCDE") == "MiSeq"
+    assert classify_run_name("200508_X01234_0123_AHCXXXCCXY") is None
+    assert classify_run_name("not_a_run") is None
+
+
+def test_classify_instrument_name():
+    assert classify_instrument_name("NovaSeqXPlus") == "NovaSeqXPlus"
+    assert classify_instrument_name("NovaSeq Control Software") == "NovaSeq"
+    assert classify_instrument_name("HiSeq Flow Cell v4") == "HiSeq"
+    assert classify_instrument_name("TruSeq Rapid Flow Cell v2") == "HiSeq"
+    assert classify_instrument_name("Something else") is None
+
+
+def test_read_instrument_field(create_dirs):
+    tmp = create_dirs
+    run_dir = os.path.join(tmp.name, "runParameters")
+    path = _run_parameters(
+        run_dir,
+        "<RunParameters><Setup><ApplicationName>HiSeq Control Software"
+        "</ApplicationName><Flowcell>HiSeq Flow Cell v4</Flowcell></Setup>"
+        "</RunParameters>",
+    )
+    assert read_instrument_field(path) == "HiSeq Flow Cell v4"
+
+    path = _run_parameters(
+        run_dir,
+        "<RunParameters><Setup><ApplicationName>MiSeq Control Software"
+        "</ApplicationName></Setup><InstrumentType>NovaSeq</InstrumentType>"
+        "</RunParameters>",
+    )
+    # Setup wins over the top level fields
+    assert read_instrument_field(path) == "MiSeq Control Software"
+
+    path = _run_parameters(
+        run_dir,
+        "<RunParameters><Reads><RunInfoRead Number='1'/></Reads>"
+        "<InstrumentType>NovaSeqXPlus</InstrumentType></RunParameters>",
+    )
+    assert read_instrument_field(path) == "NovaSeqXPlus"
+
+    path = _run_parameters(
+        run_dir,
+        "<RunParameters><Application>NextSeq Control Software</Application>"
+        "<ApplicationName>NextSeq 1000/2000 Control Software</ApplicationName>"
+        "</RunParameters>",
+    )
+    assert read_instrument_field(path) == "NextSeq 1000/2000 Control Software"
+
+    path = _run_parameters(run_dir, "<RunParameters></RunParameters>")
+    assert read_instrument_field(path) == ""
+
+
+def test_detect_instrument(create_dirs):
+    tmp = create_dirs
+    instrument._instruments.clear()
+    run_dir = os.path.join(tmp.name, "200508_X01234_0123_AHCXXXCCXY")
+    # Not cached as long as there is no runParameters.xml
+    os.makedirs(run_dir)
+    assert detect_instrument(run_dir) == ""
+    _run_parameters(
+        run_dir,
+        "<RunParameters><InstrumentType>NextSeq</InstrumentType></RunParameters>",
+        name="runParameters.xml",
+    )
+    assert detect_instrument(run_dir) == "NextSeq"
+    os.remove(os.path.join(run_dir, "runParameters.xml"))
+    assert detect_instrument(run_dir) == "NextSeq"
+    # The run name is enough
+    assert (
+        detect_instrument(os.path.join(tmp.name, "200624_A00834_0183_BHMTFYDRXX/"))
+        == "NovaSeq"
+    )
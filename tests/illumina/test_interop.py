@@ -0,0 +1,191 @@
+import os
+
+import numpy as np
+
+from taca.illumina import interop
+from taca.illumina.interop import (
+    ExtractionMetricsReader,
+    LiveMetrics,
+    QMetricsReader,
+    forget_live_metrics,
+    read_live_metrics,
+    read_tile_metrics,
+)
+
+TILE_V2 = np.dtype(
+    [("lane", "<u2"), ("tile", "<u2"), ("code", "<u2"), ("value", "<f4")]
+)
+EXTRACTION_V2 = np.dtype(
+    [
+        ("lane", "<u2"),
+        ("tile", "<u2"),
+        ("cycle", "<u2"),
+        ("fwhm", "<f4", (4,)),
+        ("intensity", "<u2", (4,)),
+        ("datetime", "<u8"),
+    ]
+)
+Q_V6 = np.dtype(
+    [("lane", "<u2"), ("tile", "<u2"), ("cycle", "<u2"), ("histogram", "<u4", (3,))]
+)
+
+
+def _records(dtype, rows):
+    records = np.zeros(len(rows), dtype=dtype)
+    for record, row in zip(records, rows):
+        for field, value in row.items():
+            record[field] = value
+    return records.tobytes()
+
+
+def _write(path, content, mode="wb"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode) as f:
+        f.write(content)
+
+
+def _extraction(lane, cycle):
+    return {"lane": lane, "tile": 1101, "cycle": cycle}
+
+
+def test_live_metrics(create_dirs):
+    tmp = create_dirs
+    run_dir = os.path.join(tmp.name, "200624_A00834_0183_BHMTFYDRXX")
+    interop = os.path.join(run_dir, "InterOp")
+    os.makedirs(interop)
+    live_metrics = LiveMetrics(run_dir)
+    # Nothing written yet
+    assert live_metrics.update() == {}
+
+    tiles = []
+    for lane, tile, clusters, clusters_pf, density in [
+        (1, 1101, 1000, 800, 200000),
+        (1, 1102, 1000, 600, 300000),
+        (2, 1101, 2000, 2000, 400000),
+    ]:
+        tiles.append({"lane": lane, "tile": tile, "code": 100, "value": density})
+        tiles.append({"lane": lane, "tile": tile, "code": 102, "value": clusters})
+        tiles.append({"lane": lane, "tile": tile, "code": 103, "value": clusters_pf})
+    _write(
+        os.path.join(interop, "TileMetricsOut.bin"),
+        bytes([2, TILE_V2.itemsize]) + _records(TILE_V2, tiles),
+    )
+    _write(
+        os.path.join(interop, "ExtractionMetricsOut.bin"),
+        bytes([2, EXTRACTION_V2.itemsize])
+        + _records(EXTRACTION_V2, [_extraction(1, 1), _extraction(2, 1)]),
+    )
+    # Binned Q scores 10, 30 and 40
+    _write(
+        os.path.join(interop, "QMetricsOut.bin"),
+        bytes([6, Q_V6.itemsize, 1, 3, 1, 20, 35, 19, 34, 40, 10, 30, 40])
+        + _records(Q_V6, [{"lane": 1, "cycle": 1, "histogram": [10, 40, 50]}]),
+    )
+    assert live_metrics.update() == {
+        "1": {
+            "clusters": 2000,
+            "clusters_pf": 1400,
+            "percent_pf": 70.0,
+            "density_k_mm2": 250.0,
+            "cycle": 1,
+            "percent_q30": 90.0,
+        },
+        "2": {
+            "clusters": 2000,
+            "clusters_pf": 2000,
+            "percent_pf": 100.0,
+            "density_k_mm2": 400.0,
+            "cycle": 1,
+        },
+    }
+
+    # Next cycle, only the new records are read
+    _write(
+        os.path.join(interop, "ExtractionMetricsOut.bin"),
+        _records(EXTRACTION_V2, [_extraction(1, 2), _extraction(2, 2)]),
+        mode="ab",
+    )
+    _write(
+        os.path.join(interop, "QMetricsOut.bin"),
+        _records(Q_V6, [{"lane": 1, "cycle": 2, "histogram": [100, 0, 0]}]),
+        mode="ab",
+    )
+    assert live_metrics.extraction.update() == 2
+    assert live_metrics.quality.update() == 1
+    assert live_metrics.extraction.cycles == {1: 2, 2: 2}
+    assert live_metrics.quality.percent_q30() == {1: 45.0}
+
+    # Tile metrics alone, e.g. for the lane tables of bcl-convert
+    assert read_tile_metrics(run_dir)["1"]["percent_pf"] == 70.0
+    assert read_tile_metrics(tmp.name) == {}
+
+
+def test_read_live_metrics_state(create_dirs, monkeypatch):
+    tmp = create_dirs
+    run_dir = os.path.join(tmp.name, "200624_A00834_0183_BHMTFYDRXX")
+    path = os.path.join(run_dir, "InterOp", "ExtractionMetricsOut.bin")
+    state_dir = os.path.join(tmp.name, "log", "live_metrics")
+    state_path = os.path.join(state_dir, "200624_A00834_0183_BHMTFYDRXX.pickle")
+    _write(
+        path,
+        bytes([2, EXTRACTION_V2.itemsize])
+        + _records(EXTRACTION_V2, [_extraction(1, 1)]),
+    )
+    assert read_live_metrics(run_dir, state_dir) == {"1": {"cycle": 1}}
+    assert os.path.exists(state_path)
+
+    # Next invocation of TACA, the readers carry on from the pickled offsets
+    monkeypatch.setattr(interop, "_live_metrics", {})
+    folded = []
+    fold = ExtractionMetricsReader.fold
+    monkeypatch.setattr(
+        ExtractionMetricsReader,
+        "fold",
+        lambda self, records: folded.append(len(records)) or fold(self, records),
+    )
+    _write(path, _records(EXTRACTION_V2, [_extraction(1, 2)]), mode="ab")
+    assert read_live_metrics(run_dir, state_dir) == {"1": {"cycle": 2}}
+    assert folded == [1]
+
+    # Done sequencing, the readers are dropped
+    forget_live_metrics(run_dir, state_dir)
+    assert interop._live_metrics == {}
+    assert not os.path.exists(state_path)
+
+
+def test_partial_records(create_dirs):
+    tmp = create_dirs
+    path = os.path.join(tmp.name, "InterOp", "ExtractionMetricsOut.bin")
+    record = _records(EXTRACTION_V2, [_extraction(1, 5)])
+    # The last record is still being written
+    _write(path, bytes([2, EXTRACTION_V2.itemsize]) + record + record[:10])
+    reader = ExtractionMetricsReader(path)
+    assert reader.update() == 1
+    _write(path, record[10:], mode="ab")
+    assert reader.update() == 1
+    assert reader.update() == 0
+    assert reader.cycles == {1: 5}
+
+
+def test_unbinned_q_metrics(create_dirs):
+    tmp = create_dirs
+    path = os.path.join(tmp.name, "InterOp", "QMetricsOut.bin")
+    q_v4 = np.dtype(
+        [
+            ("lane", "<u2"),
+            ("tile", "<u2"),
+            ("cycle", "<u2"),
+            ("histogram", "<u4", (50,)),
+        ]
+    )
+    histogram = [0] * 50
+    histogram[28], histogram[29] = 3, 1
+    _write(
+        path,
+        bytes([4, q_v4.itemsize])
+        + _records(q_v4, [{"lane": 3, "cycle": 1, "histogram": histogram}]),
+    )
+    reader = QMetricsReader(path)
+    reader.update()
+    # Index 29 is Q30
+    assert reader.percent_q30() == {3: 25.0}
@@ -0,0 +1,126 @@
+import json
+import os
+import types
+
+from taca.illumina.lane_reports import (
+    aggregate_lane_barcodes,
+    json_twin,
+    merge_lane_entries,
+    summarize_lanes,
+    write_lane_report,
+)
+
+
+def _lane(lane, pf_clusters, lane_yield):
+    return {
+        "Lane": lane,
+        "PF Clusters": f"{pf_clusters:,}",
+        "% PFClusters": "80.00",
+        "% Perfectbarcode": "95.00",
+        "% One mismatchbarcode": "5.00",
+        "Yield (Mbases)": f"{lane_yield:,}",
+    }
+
+
+def _barcode(lane, project, sample, pf_clusters, lane_yield):
+    return {
+        "Lane": lane,
+        "Project": project,
+        "Sample": sample,
+        "Barcode sequence": "unknown" if project == "default" else "ACGT",
+        "PF Clusters": f"{pf_clusters:,}",
+        "Yield (Mbases)": f"{lane_yield:,}",
+        "% >= Q30bases": "90.00",
+    }
+
+
+def test_lane_reports():
+    # Lane 2 is complex, demultiplexed in both sub-demultiplexings
+    lane_entries = merge_lane_entries(
+        [
+            [_lane("1", 1000000, 300), _lane("2", 2000000, 600)],
+            [_lane("2", 2000000, 600), _lane("3", 4000, 1)],
+        ]
+    )
+    assert [entry["Lane"] for entry in lane_entries] == ["1", "2", "3"]
+
+    summary, flowcell_data = summarize_lanes(lane_entries, {"2": {}})
+    assert flowcell_data == {
+        "Clusters (Raw)": "3,755,000",
+        "Clusters(PF)": "3,004,000",
+        "Yield (MBases)": "901",
+    }
+    assert lane_entries[1]["% Perfectbarcode"] is None
+    assert lane_entries[0]["% Perfectbarcode"] == "95.00"
+
+    entries = aggregate_lane_barcodes(
+        [
+            _barcode("1", "P1", "P1_101", 900000, 270),
+            _barcode("1", "default", "Undetermined", 100000, 30),
+            _barcode("2", "P1", "P1_102", 1000000, 300),
+            _barcode("2", "default", "Undetermined", 1000000, 300),
+            _barcode("2", "default", "Undetermined", 900000, 270),
+            _barcode("2", "P2", "P2_101", 500000, 150),
+            _barcode("3", "P3", "P3_101", 10, 1),
+            _barcode("3", "default", "Undetermined", 3990, 0),
+        ],
+        ["2"],
+        ["3"],
+        [8, 8],
+        summary,
+    )
+    assert [(entry["Lane"], entry["Sample"]) for entry in entries] == [
+        ("1", "P1_101"),
+        ("1", "Undetermined"),
+        ("2", "P1_102"),
+        ("2", "P2_101"),
+        ("2", "Undetermined"),
+        ("3", "P3_101"),
+    ]
+    assert summary["2"] == {
+        "total_lane_cluster": 2000000,
+        "total_lane_yield": 600,
+        "total_sample_cluster": 1500000,
+        "total_sample_yield": 450,
+        "undet_cluster": 500000,
+        "undet_yield": 150,
+    }
+    # A single undetermined entry for the complex lane, with the reads left over
+    undetermined = entries[4]
+    assert undetermined["PF Clusters"] == "500,000"
+    assert undetermined["Yield (Mbases)"] == "150"
+    assert undetermined["% >= Q30bases"] == "0"
+    # The undetermined entry of the NoIndex lane is renamed after its sample
+    assert entries[5]["Project"] == "P3"
+    assert entries[5]["PF Clusters"] == "3,990"
+
+
+def test_write_lane_report(create_dirs):
+    tmp = create_dirs
+    html_file = os.path.join(tmp.name, "laneBarcode.html")
+    report = types.SimpleNamespace(
+        flowcell_data={"Clusters(PF)": "1,000", "Clusters (Raw)": "1,250"},
+        sample_data=[
+            {"Lane": "1", "Sample": "P1_101", "% Perfectbarcode": None},
+            {"Lane": "2", "Sample": "P1_102", "% Perfectbarcode": "99.00"},
+        ],
+    )
+    write_lane_report(html_file, report)
+
+    with open(html_file) as f:
+        html = f.read()
+    assert html.startswith("<!DOCTYPE html")
+    assert html.endswith("</html>\n")
+    # Columns are sorted, in the header and in every row
+    assert "<th>Clusters (Raw)</th>\n<th>Clusters(PF)</th>" in html
+    assert "<td>1,250</td>\n<td>1,000</td>" in html
+    assert "<td>None</td>\n<td>1</td>\n<td>P1_101</td>" in html
+
+    assert json_twin(html_file) == os.path.join(tmp.name, "laneBarcode.json")
+    with open(json_twin(html_file)) as f:
+        assert json.load(f) == {
+            "flowcell_data": report.flowcell_data,
+            "sample_data": report.sample_data,
+        }
+    # No temporary files are left behind
+    assert not [name for name in os.listdir(tmp.name) if name.endswith(".tmp")]
@@ -0,0 +1,143 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from taca.illumina.lane_split import (
+    lane_job_id,
+    lane_output_dir,
+    lane_outputs_done,
+    merge_lane_outputs,
+)
+
+
+def _write(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def _lane_output(run_dir, lane, done=True):
+    lane_dir = lane_output_dir(run_dir, 1, lane)
+    fastq = _write(
+        os.path.join(
+            lane_dir,
+            "P1",
+            f"Sample_P1_10{lane}",
+            f"P1_10{lane}_S1_L00{lane}_R1_001.fastq.gz",
+        )
+    )
+    _write(os.path.join(lane_dir, f"Undetermined_S0_L00{lane}_R1_001.fastq.gz"))
+    stats = os.path.join(lane_dir, "Reports", "legacy", "Stats")
+    _write(
+        os.path.join(stats, "Stats.json"),
+        json.dumps(
+            {
+                "RunNumber": 1,
+                "Flowcell": "FC",
+                "RunId": "run",
+                "ConversionResults": [{"LaneNumber": lane}],
+                "ReadInfosForLanes": [{"LaneNumber": lane}],
+                "UnknownBarcodes": [{"Lane": lane, "Barcodes": {"AAAA": 1}}],
+            }
+        ),
+    )
+    _write(os.path.join(stats, f"DemuxSummaryF1L{lane}.txt"))
+    _write(os.path.join(stats, "ConversionStats.xml"))
+    if done:
+        _write(os.path.join(stats, "DemultiplexingStats.xml"))
+    _write(
+        os.path.join(lane_dir, "Reports", "Demultiplex_Stats.csv"),
+        f"Lane,SampleID\n{lane},P1_10{lane}\n",
+    )
+    _write(os.path.join(lane_dir, "Reports", "RunInfo.xml"))
+    return fastq
+
+
+def test_merge_lane_outputs(create_dirs):
+    run_dir = os.path.join(create_dirs.name, "run")
+    fastq_1 = _lane_output(run_dir, 1)
+    _lane_output(run_dir, 2, done=False)
+    assert not lane_outputs_done(run_dir, 1, ["1", "2"], "Reports/legacy")
+    _lane_output(run_dir, 2)
+    assert lane_outputs_done(run_dir, 1, ["1", "2"], "Reports/legacy")
+
+    merge_lane_outputs(run_dir, 1, ["1", "2"], "Reports/legacy")
+    demux_dir = os.path.join(run_dir, "Demultiplexing_1")
+    assert (
+        os.readlink(
+            os.path.join(demux_dir, "P1", "Sample_P1_101", os.path.basename(fastq_1))
+        )
+        == fastq_1
+    )
+    assert os.path.islink(
+        os.path.join(demux_dir, "Undetermined_S0_L002_R1_001.fastq.gz")
+    )
+    stats = os.path.join(demux_dir, "Reports", "legacy", "Stats")
+    with open(os.path.join(stats, "Stats.json")) as stats_json:
+        merged = json.load(stats_json)
+    assert merged["ConversionResults"] == [{"LaneNumber": 1}, {"LaneNumber": 2}]
+    assert [entry["Lane"] for entry in merged["UnknownBarcodes"]] == [1, 2]
+    assert os.path.islink(os.path.join(stats, "DemuxSummaryF1L2.txt"))
+    # Neither per lane nor merged
+    assert not os.path.exists(os.path.join(stats, "ConversionStats.xml"))
+    # Left to the caller, once the html reports are merged
+    assert not os.path.exists(os.path.join(stats, "DemultiplexingStats.xml"))
+    with open(os.path.join(demux_dir, "Reports", "Demultiplex_Stats.csv")) as report:
+        assert report.read() == "Lane,SampleID\n1,P1_101\n2,P1_102\n"
+    assert os.path.islink(os.path.join(demux_dir, "Reports", "RunInfo.xml"))
+
+
+def test_split_lane_barcode_mismatches(create_dirs):
+    """The job of each split lane allows the mismatches safe for that lane."""
+    pytest.importorskip("flowcell_parser")
+    from taca.illumina.Standard_Runs import Standard_Run
+
+    tmp = create_dirs
+    run_dir = os.path.join(tmp.name, "ngi_data/sequencing/NovaSeqXPlus/run")
+    os.makedirs(run_dir)
+    samplesheet_data = [
+        {"Lane": "1", "Sample_Name": "P1_101", "index": "ACGTACGT", "index2": ""},
+        # One mismatch away from P1_101
+        {"Lane": "1", "Sample_Name": "P1_102", "index": "ACGTACGA", "index2": ""},
+        {"Lane": "2", "Sample_Name": "P2_101", "index": "AAAAAAAA", "index2": ""},
+        {"Lane": "2", "Sample_Name": "P2_102", "index": "CCCCCCCC", "index2": ""},
+    ]
+    mask = ((8, 0), (0, 0), (151, 151))
+    demux = {
+        "demux_id": 0,
+        "sample_type": "ordinary",
+        "mask_table": {"1": mask, "2": mask},
+        "samples_to_include": {"1": ["P1_101", "P1_102"], "2": ["P2_101", "P2_102"]},
+        "split_lanes": ["1", "2"],
+    }
+    submitted = {}
+    run = Standard_Run.__new__(Standard_Run)
+    run.run_dir = run_dir
+    run.id = "run"
+    run.software = "bcl2fastq"
+    run.CONFIG = {"bcl2fastq": {"split_lanes": True}}
+    run.demux_scheduler = None
+    run.demux_executor = SimpleNamespace(
+        submit=lambda run_id, run_dir, job_id, cmd, software, cost: submitted.update(
+            {job_id: cmd}
+        )
+    )
+    run.runParserObj = SimpleNamespace(
+        samplesheet=SimpleNamespace(data=samplesheet_data),
+        runinfo=SimpleNamespace(get_read_configuration=lambda: [{"NumCycles": "151"}]),
+    )
+    run.generate_bcl_command = (
+        lambda sample_type, mask_table, counter, barcode_mismatches, lane: (
+            barcode_mismatches
+        )
+    )
+
+    # The whole sub-demultiplexing is held back by lane 1
+    assert run._check_indexes(demux) == (0,)
+    assert demux["lane_barcode_mismatches"] == {"1": (0,), "2": None}
+    run._start_demux(demux, (0,))
+    # Lane 2 keeps the configured mismatches
+    assert submitted == {lane_job_id(0, "1"): (0,), lane_job_id(0, "2"): None}
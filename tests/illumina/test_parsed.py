@@ -0,0 +1,86 @@
+import os
+
+from taca.illumina.parsed import ParsedCache, run_parser_files
+
+
+class LineParser:
+    parsed = 0
+
+    def __init__(self, path):
+        LineParser.parsed += 1
+        with open(path) as f:
+            self.data = f.read().splitlines()
+
+
+def _write(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def test_parsed_cache(create_dirs):
+    tmp = create_dirs
+    first = _write(os.path.join(tmp.name, "first.csv"), "a\nb\n")
+    second = _write(os.path.join(tmp.name, "second.csv"), "c\n")
+    cache = ParsedCache(maxsize=1)
+    LineParser.parsed = 0
+
+    parsed = cache.load(LineParser, first)
+    assert parsed.data == ["a", "b"]
+    assert cache.load(LineParser, first).data == ["a", "b"]
+    assert LineParser.parsed == 1
+
+    # Each caller gets its own copy
+    parsed.data[0] = "modified"
+    assert cache.load(LineParser, first).data == ["a", "b"]
+    assert LineParser.parsed == 1
+
+    # Changes to the file are picked up
+    _write(first, "a\nb\nc\n")
+    assert cache.load(LineParser, first).data == ["a", "b", "c"]
+    assert LineParser.parsed == 2
+
+    # The least recently used object is evicted
+    cache.load(LineParser, second)
+    cache.load(LineParser, first)
+    assert LineParser.parsed == 4
+
+    # Objects depending on other files than the one parsed
+    other = _write(os.path.join(tmp.name, "other.txt"), "")
+    LineParser.parsed = 0
+    cache.load(LineParser, first, depends_on=[first, other])
+    cache.load(LineParser, first, depends_on=[first, other])
+    assert LineParser.parsed == 1
+    _write(other, "changed")
+    cache.load(LineParser, first, depends_on=[first, other])
+    assert LineParser.parsed == 2
+
+
+def test_parsed_cache_pickles(create_dirs):
+    tmp = create_dirs
+    samplesheet = _write(os.path.join(tmp.name, "SampleSheet.csv"), "a\n")
+    cache_dir = os.path.join(tmp.name, "parsed_cache")
+    LineParser.parsed = 0
+
+    assert ParsedCache(cache_dir=cache_dir).load(LineParser, samplesheet).data == ["a"]
+    assert len(os.listdir(cache_dir)) == 1
+    # Another process reads the pickle
+    assert ParsedCache(cache_dir=cache_dir).load(LineParser, samplesheet).data == ["a"]
+    assert LineParser.parsed == 1
+    # Unless the file changed
+    _write(samplesheet, "b\n")
+    assert ParsedCache(cache_dir=cache_dir).load(LineParser, samplesheet).data == ["b"]
+    assert LineParser.parsed == 2
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_run_parser_files(create_dirs):
+    tmp = create_dirs
+    run_dir = os.path.join(tmp.name, "200624_A00834_0183_BHMTFYDRXX")
+    reports = os.path.join(
+        run_dir, "Demultiplexing", "Reports", "html", "HMTFYDRXX", "all", "all", "all"
+    )
+    os.makedirs(reports)
+    files = run_parser_files(run_dir)
+    assert os.path.join(run_dir, "RunInfo.xml") in files
+    assert os.path.join(reports, "laneBarcode.html") in files
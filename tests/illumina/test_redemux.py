@@ -0,0 +1,232 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from taca.illumina.demux_plan import load_demux_plan, write_demux_plan
+from taca.illumina.redemux import (
+    drop_fastq_lanes,
+    drop_stats_lanes,
+    plan_redemux,
+    restrict_samplesheet,
+    samplesheet_lane_hashes,
+)
+
+MASK_8 = ((8, 8), (0, 0), (151, 151))
+MASK_10 = ((10, 10), (0, 0), (151, 151))
+
+
+SAMPLESHEET = (
+    "[Header]\n"
+    "Date,2026-10-17\n"
+    "[Settings]\n"
+    "OverrideCycles,Y151;I8;I8;Y151\n"
+    "[Data]\n"
+    "Lane,Sample_ID,Sample_Name,index,index2,Sample_Project\n"
+    "1,Sample_P1_101,P1_101,AAAAAAAA,CCCCCCCC,P1\n"
+    "1,Sample_P1_102,P1_102,GGGGGGGG,TTTTTTTT,P1\n"
+    "2,Sample_P2_101,P2_101,AAAAAAAA,CCCCCCCC,P2\n"
+)
+
+
+def test_samplesheet_lane_hashes():
+    hashes = samplesheet_lane_hashes(SAMPLESHEET)
+    assert sorted(hashes) == ["1", "2"]
+    # The header does not matter
+    assert (
+        samplesheet_lane_hashes(SAMPLESHEET.replace("2026-10-17", "2026-10-18"))
+        == hashes
+    )
+    # A changed row only changes its lane
+    changed = samplesheet_lane_hashes(SAMPLESHEET.replace("P2_101,AAAA", "P2_101,TTTT"))
+    assert changed["1"] == hashes["1"]
+    assert changed["2"] != hashes["2"]
+    # Settings apply to all lanes
+    changed = samplesheet_lane_hashes(SAMPLESHEET.replace("Y151;I8", "Y150;I8"))
+    assert changed["1"] != hashes["1"]
+    assert changed["2"] != hashes["2"]
+
+
+def test_restrict_samplesheet():
+    restricted = restrict_samplesheet(SAMPLESHEET, ["1"])
+    assert "P2_101" not in restricted
+    assert restricted.startswith("[Header]\nDate,2026-10-17\n[Settings]\n")
+    assert samplesheet_lane_hashes(restricted) == {
+        "1": samplesheet_lane_hashes(SAMPLESHEET)["1"]
+    }
+
+
+def _demux(demux_id, sample_type, mask, lane_samples, lane_hashes):
+    return {
+        "demux_id": demux_id,
+        "sample_type": sample_type,
+        "mask": mask,
+        "mask_table": {lane: mask for lane in lane_samples},
+        "samples_to_include": lane_samples,
+        "lane_hashes": lane_hashes,
+    }
+
+
+def _plan(*demuxes):
+    return {"software": "bclconvert", "fingerprint": "f", "demuxes": list(demuxes)}
+
+
+def test_plan_redemux():
+    old_plan = _plan(
+        _demux(
+            0,
+            "ordinary",
+            MASK_8,
+            {"1": ["P1_101"], "2": ["P2_101"], "3": ["P3_101"]},
+            {"1": "a", "2": "b", "3": "c"},
+        ),
+        _demux(1, "ordinary", MASK_10, {"4": ["P4_101"]}, {"4": "d"}),
+    )
+    # Nothing changed
+    plan, new_ids, trimmed_ids, retired_ids = plan_redemux(old_plan, old_plan)
+    assert (new_ids, trimmed_ids, retired_ids) == ([], [], [])
+    assert plan["demuxes"] == old_plan["demuxes"]
+
+    # Lane 2 corrected, lane 4 now with 8 bp indexes
+    new_plan = _plan(
+        _demux(
+            0,
+            "ordinary",
+            MASK_8,
+            {"1": ["P1_101"], "2": ["P2_102"], "3": ["P3_101"], "4": ["P4_101"]},
+            {"1": "a", "2": "e", "3": "c", "4": "f"},
+        )
+    )
+    plan, new_ids, trimmed_ids, retired_ids = plan_redemux(old_plan, new_plan)
+    assert (new_ids, trimmed_ids, retired_ids) == ([2], [0], [1])
+    trimmed, new_demux = plan["demuxes"]
+    assert trimmed["mask_table"] == {"1": MASK_8, "3": MASK_8}
+    assert trimmed["retired_lanes"] == ["2"]
+    assert new_demux["demux_id"] == 2
+    assert new_demux["mask"] == MASK_8
+    assert new_demux["samples_to_include"] == {"2": ["P2_102"], "4": ["P4_101"]}
+    assert new_demux["lane_hashes"] == {"2": "e", "4": "f"}
+    assert plan["retired"] == [1]
+
+    # Ids of retired sub-demultiplexings are not used again
+    newer_plan = _plan(
+        _demux(
+            0,
+            "ordinary",
+            MASK_8,
+            {"1": ["P1_101"], "2": ["P2_102"], "3": ["P3_103"], "4": ["P4_101"]},
+            {"1": "a", "2": "e", "3": "g", "4": "f"},
+        )
+    )
+    plan, new_ids, trimmed_ids, retired_ids = plan_redemux(plan, newer_plan)
+    assert (new_ids, trimmed_ids, retired_ids) == ([3], [0], [])
+    assert plan["demuxes"][0]["retired_lanes"] == ["2", "3"]
+    assert plan["retired"] == [1]
+
+
+def test_redemultiplex_samplesheet(create_dirs, monkeypatch):
+    """SampleSheet.csv.previous is put back on failure and removed otherwise."""
+    pytest.importorskip("flowcell_parser")
+    from taca.illumina import Standard_Runs
+
+    tmp = create_dirs
+    run_dir = os.path.join(tmp.name, "ngi_data/sequencing/NovaSeqXPlus/run")
+    os.makedirs(run_dir)
+    samplesheet = os.path.join(run_dir, "SampleSheet.csv")
+    for name in ["SampleSheet.csv", "SampleSheet_0.csv"]:
+        with open(os.path.join(run_dir, name), "w") as f:
+            f.write(SAMPLESHEET)
+    old_plan = _plan(
+        _demux(0, "ordinary", MASK_8, {"1": ["P1_101"], "2": ["P2_101"]}, {})
+    )
+    old_plan["demuxes"][0]["lane_hashes"] = {"1": "a", "2": "b"}
+    write_demux_plan(run_dir, old_plan)
+    new_plan = _plan(
+        _demux(0, "ordinary", MASK_8, {"1": ["P1_101"], "2": ["P2_102"]}, {})
+    )
+    lane_hashes = {"1": "a", "2": "b"}
+    monkeypatch.setattr(Standard_Runs, "plan_demux", lambda *args: new_plan)
+    generated = []
+
+    def _copy_samplesheet():
+        if not generated:
+            generated.append(False)
+            return False
+        generated.append(True)
+        with open(samplesheet, "w") as f:
+            f.write(SAMPLESHEET)
+
+    run = Standard_Runs.Standard_Run.__new__(Standard_Runs.Standard_Run)
+    run.run_dir = run_dir
+    run.id = "run"
+    run.software = "bclconvert"
+    run.demux_dir = "Demultiplexing"
+    run.demux_scheduler = None
+    run.sample_table = {}
+    run.runParserObj = SimpleNamespace(
+        runinfo=SimpleNamespace(get_read_configuration=lambda: [])
+    )
+    run._copy_samplesheet = _copy_samplesheet
+    run._check_indexes = lambda demux: None
+    run._sub_samplesheet_text = lambda demux, runSetup, mismatches: demux["demux_id"]
+    run._write_sub_samplesheet = lambda demux, mismatches: None
+    run._lanes_to_split = lambda demux: []
+    run._start_demux = lambda demux, mismatches: None
+    monkeypatch.setattr(
+        Standard_Runs,
+        "samplesheet_lane_hashes",
+        lambda text: dict(lane_hashes),
+    )
+    previous = f"{samplesheet}.previous"
+
+    # The samplesheet could not be generated, the run is left as it was
+    with pytest.raises(RuntimeError):
+        run.redemultiplex()
+    assert os.path.exists(samplesheet)
+    assert not os.path.exists(previous)
+
+    # Nothing changed
+    assert not run.redemultiplex()
+    assert not os.path.exists(previous)
+
+    # Lane 2 corrected
+    lane_hashes["2"] = "c"
+    assert run.redemultiplex()
+    assert [demux["demux_id"] for demux in load_demux_plan(run_dir)["demuxes"]] == [
+        0,
+        1,
+    ]
+    assert os.path.exists(samplesheet)
+    assert not os.path.exists(previous)
+
+
+def test_drop_lanes():
+    data = {
+        "ConversionResults": [{"LaneNumber": 1}, {"LaneNumber": 2}],
+        "ReadInfosForLanes": [{"LaneNumber": 1}, {"LaneNumber": 2}],
+        "UnknownBarcodes": [{"Lane": 1}, {"Lane": 2}],
+    }
+    assert drop_stats_lanes(data, {"2"}) == {
+        "ConversionResults": [{"LaneNumber": 1}],
+        "ReadInfosForLanes": [{"LaneNumber": 1}],
+        "UnknownBarcodes": [{"Lane": 1}],
+    }
+
+    projects = {
+        "P1": {
+            "Sample_P1_101": [
+                "/run/P1/Sample_P1_101/P1_101_S1_L001_R1_001.fastq.gz",
+                "/run/P1/Sample_P1_101/P1_101_S1_L002_R1_001.fastq.gz",
+            ],
+            "Sample_P1_102": [],
+        },
+        "P2": {
+            "Sample_P2_101": ["/run/P2/Sample_P2_101/P2_101_S2_L002_R1_001.fastq.gz"]
+        },
+    }
+    assert drop_fastq_lanes(projects, {"2"}) == {
+        "P1": {
+            "Sample_P1_101": ["/run/P1/Sample_P1_101/P1_101_S1_L001_R1_001.fastq.gz"],
+            "Sample_P1_102": [],
+        }
+    }
@@ -0,0 +1,35 @@
+import os
+
+from taca.illumina.snapshot import RunSnapshot
+
+
+def test_run_snapshot(create_dirs):
+    tmp = create_dirs
+    run_dir = os.path.join(
+        tmp.name, "ngi_data/sequencing/NovaSeqXPlus/20240202_LH00217_0044_A2255J2LT3"
+    )
+    os.makedirs(run_dir)
+
+    snapshot = RunSnapshot(run_dir)
+    assert not snapshot.sequencing_done
+    assert not snapshot.demultiplexing_started
+
+    open(os.path.join(run_dir, "RTAComplete.txt"), "w").close()
+    open(os.path.join(run_dir, "CopyComplete.txt"), "w").close()
+    # Nothing changes until the snapshot is refreshed
+    assert not snapshot.sequencing_done
+    snapshot.refresh()
+    assert snapshot.sequencing_done
+    assert not snapshot.demultiplexing_started
+
+    os.makedirs(os.path.join(run_dir, "Demultiplexing", "Stats"))
+    snapshot.refresh()
+    assert snapshot.demultiplexing_started
+    assert not snapshot.demultiplexing_done
+
+    open(os.path.join(run_dir, "Demultiplexing", "Stats", "Stats.json"), "w").close()
+    snapshot.refresh()
+    assert snapshot.demultiplexing_done
+
+    # A run that has been moved away looks empty
+    assert not RunSnapshot(run_dir + "_moved").sequencing_done
@@ -0,0 +1,214 @@
+import io
+import json
+import time
+
+import pytest
+
+from taca.illumina.stats_json import StatsJsonMerger
+
+
+def _partial_stats(lanes, samples_per_lane, first_sample=0):
+    """Synthetic Stats.json of a sub-demultiplexing."""
+    return {
+        "Flowcell": "2255J2LT3",
+        "RunNumber": 44,
+        "RunId": "20240202_LH00217_0044_A2255J2LT3",
+        "ReadInfosForLanes": [
+            {"LaneNumber": lane, "ReadInfos": [{"Number": 1, "NumCycles": 151}]}
+            for lane in lanes
+        ],
+        "ConversionResults": [
+            {
+                "LaneNumber": lane,
+                "TotalClustersRaw": 1000000,
+                "TotalClustersPF": 900000,
+                "Yield": 135900000,
+                "DemuxResults": [
+                    {
+                        "SampleId": f"P1_{sample}",
+                        "SampleName": f"P1_{sample}",
+                        "IndexMetrics": [
+                            {"IndexSequence": "ACGT", "MismatchCounts": {"0": 10}}
+                        ],
+                        "NumberReads": 100,
+                        "Yield": 15100,
+                        "ReadMetrics": [
+                            {"ReadNumber": 1, "Yield": 15100, "YieldQ30": 14000}
+                        ],
+                    }
+                    for sample in range(first_sample, first_sample + samples_per_lane)
+                ],
+                "Undetermined": {
+                    "NumberReads": 1000,
+                    "Yield": 151000,
+                    "ReadMetrics": [
+                        {"ReadNumber": 1, "Yield": 151000, "YieldQ30": 140000}
+                    ],
+                },
+            }
+            for lane in lanes
+        ],
+        "UnknownBarcodes": [],
+    }
+
+
+def test_stats_json_merger():
+    merger = StatsJsonMerger()
+    merger.add(_partial_stats([1, 2], 3))
+    fixed = []
+    merger.add(
+        _partial_stats([2, 3], 2, first_sample=3),
+        complex_lanes={"2": {}},
+        fix_undetermined=lambda entry: fixed.append(entry["LaneNumber"]),
+    )
+    # Lane 2 is complex and merged, lane 3 is new
+    assert fixed == [2]
+    assert [entry["LaneNumber"] for entry in merger.conversion_results] == [1, 2, 3]
+    assert [entry["LaneNumber"] for entry in merger.read_infos_for_lanes] == [1, 2, 3]
+    assert [s["SampleId"] for s in merger.conversion_results[1]["DemuxResults"]] == [
+        "P1_0",
+        "P1_1",
+        "P1_2",
+        "P1_3",
+        "P1_4",
+    ]
+
+    # Written exactly as json.dump would
+    out = io.StringIO()
+    merger.write(out)
+    assert out.getvalue() == json.dumps(merger.as_dict())
+
+
+def test_stats_json_merger_many_samples():
+    """8 lanes of 5000 samples, the last 4 lanes complex across two sub-demultiplexings."""
+    partials = [
+        _partial_stats(range(1, 9), 2500),
+        _partial_stats(range(5, 9), 2500, first_sample=2500),
+    ]
+    complex_lanes = {str(lane): {"0": [], "1": []} for lane in range(5, 9)}
+
+    merger = StatsJsonMerger()
+    for partial in partials:
+        merger.add(partial, complex_lanes)
+    out = io.StringIO()
+    merger.write(out)
+
+    merged = json.loads(out.getvalue())
+    assert merged == merger.as_dict()
+    assert [entry["LaneNumber"] for entry in merged["ConversionResults"]] == list(
+        range(1, 9)
+    )
+    # The samples of both sub-demultiplexings in order, none repeated
+    for entry in merged["ConversionResults"]:
+        samples = 2500 if entry["LaneNumber"] < 5 else 5000
+        assert [s["SampleId"] for s in entry["DemuxResults"]] == [
+            f"P1_{sample}" for sample in range(samples)
+        ]
+
+
+def _list_scan_merge(partials, complex_lanes):
+    """The merge done before StatsJsonMerger, scanning the lanes merged so far."""
+    stats_list = {}
+    for data in partials:
+        if len(stats_list) == 0:
+            stats_list["RunNumber"] = data["RunNumber"]
+            stats_list["Flowcell"] = data["Flowcell"]
+            stats_list["RunId"] = data["RunId"]
+            stats_list["ConversionResults"] = data["ConversionResults"]
+            stats_list["ReadInfosForLanes"] = data["ReadInfosForLanes"]
+            stats_list["UnknownBarcodes"] = []
+            continue
+        lanes_present_in_stats_json = [
+            entry["LaneNumber"] for entry in stats_list["ConversionResults"]
+        ]
+        for ReadInfosForLanes_lane in data["ReadInfosForLanes"]:
+            if ReadInfosForLanes_lane["LaneNumber"] not in lanes_present_in_stats_json:
+                stats_list["ReadInfosForLanes"].extend([ReadInfosForLanes_lane])
+        for ConversionResults_lane in data["ConversionResults"]:
+            if (
+                ConversionResults_lane["LaneNumber"] in lanes_present_in_stats_json
+                and str(ConversionResults_lane["LaneNumber"]) in complex_lanes.keys()
+            ):
+                lane_to_update = [
+                    entry
+                    for entry in stats_list["ConversionResults"]
+                    if entry["LaneNumber"] == ConversionResults_lane["LaneNumber"]
+                ][0]
+                lane_to_update["DemuxResults"].extend(
+                    ConversionResults_lane["DemuxResults"]
+                )
+                lane_to_update["Undetermined"] = ConversionResults_lane["Undetermined"]
+            else:
+                stats_list["ConversionResults"].extend([ConversionResults_lane])
+    return stats_list
+
+
+@pytest.mark.benchmark
+def test_stats_json_merger_benchmark(capsys):
+    """Time the merge and write of 8 lanes of 5000 samples, run with -m benchmark."""
+    complex_lanes = {str(lane): {"0": [], "1": []} for lane in range(5, 9)}
+
+    def _partials():
+        return [
+            _partial_stats(range(1, 9), 2500),
+            _partial_stats(range(5, 9), 2500, first_sample=2500),
+        ]
+
+    def _list_scan(partials):
+        out = io.StringIO()
+        json.dump(_list_scan_merge(partials, complex_lanes), out)
+        return out.getvalue()
+
+    def _merger(partials):
+        merger = StatsJsonMerger()
+        for partial in partials:
+            merger.add(partial, complex_lanes)
+        out = io.StringIO()
+        merger.write(out)
+        return out.getvalue()
+
+    timings = {}
+    outputs = {}
+    for name, merge in [("list scan", _list_scan), ("StatsJsonMerger", _merger)]:
+        elapsed = []
+        for _ in range(3):
+            partials = _partials()
+            start = time.perf_counter()
+            outputs[name] = merge(partials)
+            elapsed.append(time.perf_counter() - start)
+        timings[name] = min(elapsed)
+    with capsys.disabled():
+        for name, elapsed in timings.items():
+            print(
+                f"\n{name}: merged and wrote 8 lanes x 5000 samples in {elapsed:.3f}s"
+            )
+
+    # Same document, in less time
+    assert outputs["StatsJsonMerger"] == outputs["list scan"]
+    assert timings["StatsJsonMerger"] < timings["list scan"]
+
+
+def test_stats_json_merger_unknown_barcodes():
+    merger = StatsJsonMerger(top_unknown_barcodes=3)
+    merger.add_unknown_barcodes(1, {"AAAA+CCCC": 50, "GGGG+TTTT": 10, "ACAC+GTGT": 5})
+    merger.add_unknown_barcodes(2, {"NNNN+NNNN": 7})
+    # Summed per lane, only the top 3 kept
+    merger.add_unknown_barcodes(1, {"GGGG+TTTT": 100, "CACA+TGTG": 20})
+    assert merger.unknown_barcodes == [
+        {
+            "Lane": 1,
+            "Barcodes": {"GGGG+TTTT": 110, "AAAA+CCCC": 50, "CACA+TGTG": 20},
+        },
+        {"Lane": 2, "Barcodes": {"NNNN+NNNN": 7}},
+    ]
+    assert list(merger.lane_unknown_barcodes(1)) == [
+        "GGGG+TTTT",
+        "AAAA+CCCC",
+        "CACA+TGTG",
+    ]
+    assert merger.lane_unknown_barcodes(3) == {}
+    merger.set_unknown_barcodes(2, {"unknown": 1})
+    assert merger.as_dict()["UnknownBarcodes"][1] == {
+        "Lane": 2,
+        "Barcodes": {"unknown": 1},
+    }
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from taca.illumina.symlink_farm import SymlinkFarm, scan_demux_dir
+
+
+def _touch(*parts):
+    path = os.path.join(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+    return path
+
+
+def test_symlink_farm(create_dirs):
+    tmp = create_dirs
+    demux_source = os.path.join(tmp.name, "run", "Demultiplexing_1")
+    demux_folder = os.path.join(tmp.name, "run", "Demultiplexing")
+    fastq = _touch(
+        demux_source, "P1", "Sample_P1_101", "P1_101_S1_L001_R1_001.fastq.gz"
+    )
+    _touch(demux_source, "P1", "Sample_P1_101", "P1_101_S1_L001_R1_001.md5")
+    os.makedirs(os.path.join(demux_source, "P1", "Sample_P1_102"))
+    _touch(demux_source, "Undetermined_S0_L002_R1_001.fastq.gz")
+    _touch(demux_source, "Reports", "Demultiplex_Stats.csv")
+
+    files, projects = scan_demux_dir(demux_source)
+    assert files == ["Undetermined_S0_L002_R1_001.fastq.gz"]
+    assert projects == {"P1": {"Sample_P1_101": [fastq], "Sample_P1_102": []}}
+
+    farm = SymlinkFarm()
+    farm.add_project_fastqs(projects, demux_folder)
+    farm.add_noindex_fastqs(
+        files,
+        demux_source,
+        demux_folder,
+        [{"Lane": "2", "Sample_ID": "Sample_P2_101", "Sample_Project": "P2"}],
+    )
+    assert farm.build(threads=2) == 2
+    linked = os.path.join(
+        demux_folder, "P1", "Sample_P1_101", "P1_101_S1_L001_R1_001.fastq.gz"
+    )
+    assert os.readlink(linked) == fastq
+    assert os.path.isdir(os.path.join(demux_folder, "P1", "Sample_P1_102"))
+    renamed = os.path.join(
+        demux_folder, "P2", "Sample_P2_101", "P2_101_S1_L002_R1_001.fastq.gz"
+    )
+    assert os.readlink(renamed) == os.path.join(
+        demux_source, "Undetermined_S0_L002_R1_001.fastq.gz"
+    )
+
+    # Building again, e.g. after a crash, only creates what is missing
+    os.unlink(renamed)
+    assert farm.build(threads=2) == 1
+    assert os.path.islink(renamed)
+
+    # A link planned to two different files is an error
+    with pytest.raises(RuntimeError):
+        farm.add_link(os.path.join(demux_source, "other.fastq.gz"), linked)
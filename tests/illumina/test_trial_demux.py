@@ -0,0 +1,104 @@
+import json
+import os
+
+from taca.illumina.trial_demux import (
+    assigned_fractions,
+    failing_lanes,
+    format_fractions,
+    reverse_complement_samplesheet,
+    trial_tiles,
+)
+
+SAMPLESHEET = (
+    "[Header]\n"
+    "Date,2026-10-17\n"
+    "[Data]\n"
+    "Lane,Sample_ID,index,index2,Sample_Project\n"
+    "1,Sample_P1_101,AAAAAAAA,ACCGGTTT,P1\n"
+    "2,Sample_P2_101,GGGGGGGG,AACCGGTN,P2\n"
+)
+
+RUN_INFO = """<?xml version="1.0"?>
+<RunInfo Version="2">
+  <Run Id="200624_NB501038_0183_AHMTFYBGXX" Number="183">
+    <FlowcellLayout LaneCount="2" SurfaceCount="2" SwathCount="3" TileCount="12">
+      {tile_set}
+    </FlowcellLayout>
+  </Run>
+</RunInfo>
+"""
+
+
+def test_trial_tiles(create_dirs):
+    tmp = create_dirs
+    run_info = os.path.join(tmp.name, "RunInfo.xml")
+    with open(run_info, "w") as f:
+        f.write(
+            RUN_INFO.format(
+                tile_set="<TileSet TileNamingConvention='FiveDigit'><Tiles>"
+                "<Tile>1_11102</Tile><Tile>1_11101</Tile><Tile>2_11101</Tile>"
+                "</Tiles></TileSet>"
+            )
+        )
+    assert trial_tiles(run_info) == "s_1_11101,s_2_11101"
+    assert trial_tiles(run_info, lanes=["2"]) == "s_2_11101"
+    # Tiles not listed
+    with open(run_info, "w") as f:
+        f.write(RUN_INFO.format(tile_set="<TileSet TileNamingConvention='FiveDigit'/>"))
+    assert trial_tiles(run_info) == "s_1_11101,s_2_11101"
+    with open(run_info, "w") as f:
+        f.write(RUN_INFO.format(tile_set=""))
+    assert trial_tiles(run_info) == "s_1_1101,s_2_1101"
+
+
+def test_reverse_complement_samplesheet():
+    assert reverse_complement_samplesheet(SAMPLESHEET, lanes=["2"]) == (
+        SAMPLESHEET.replace("AACCGGTN", "NACCGGTT")
+    )
+    assert reverse_complement_samplesheet(SAMPLESHEET) == (
+        SAMPLESHEET.replace("AACCGGTN", "NACCGGTT").replace("ACCGGTTT", "AAACCGGT")
+    )
+    single_index = SAMPLESHEET.replace(",index2", "").replace(",ACCGGTTT", "")
+    assert reverse_complement_samplesheet(single_index, lanes=["1"]) == single_index
+
+
+def test_assigned_fractions(create_dirs):
+    tmp = create_dirs
+    trial_dir = os.path.join(tmp.name, "Trial_1")
+    os.makedirs(os.path.join(trial_dir, "Stats"))
+    assert assigned_fractions(trial_dir, "bcl2fastq") == {}
+    with open(os.path.join(trial_dir, "Stats", "Stats.json"), "w") as stats:
+        json.dump(
+            {
+                "ConversionResults": [
+                    {
+                        "LaneNumber": 1,
+                        "TotalClustersPF": 1000,
+                        "DemuxResults": [{"NumberReads": 600}, {"NumberReads": 300}],
+                    },
+                    {
+                        "LaneNumber": 2,
+                        "TotalClustersPF": 1000,
+                        "DemuxResults": [{"NumberReads": 20}],
+                    },
+                ]
+            },
+            stats,
+        )
+    fractions = assigned_fractions(trial_dir, "bcl2fastq")
+    assert fractions == {"1": 0.9, "2": 0.02}
+    assert failing_lanes(fractions, ["1", "2", "3"], 0.5) == ["2", "3"]
+    assert format_fractions(fractions) == "lane 1: 90.0%, lane 2: 2.0%"
+
+    os.makedirs(os.path.join(trial_dir, "Reports"))
+    with open(
+        os.path.join(trial_dir, "Reports", "Demultiplex_Stats.csv"), "w"
+    ) as stats:
+        stats.write(
+            "Lane,SampleID,Sample_Project,Index,# Reads\n"
+            "1,P1_101,P1,AAAAAAAA-ACCGGTTT,750\n"
+            "1,Undetermined,,,250\n"
+            "2,P2_101,P2,GGGGGGGG-AACCGGTN,0\n"
+            "2,Undetermined,,,1000\n"
+        )
+    assert assigned_fractions(trial_dir, "bclconvert") == {"1": 0.75, "2": 0.0}
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from taca.illumina.watcher import RunWatcher
+
+
+def test_run_watcher(create_dirs):
+    tmp = create_dirs
+    data_dir = os.path.join(tmp.name, "ngi_data/sequencing/NovaSeqXPlus")
+    finished_run = os.path.join(data_dir, "20240201_LH00217_0043_A2255J2LT2")
+    os.makedirs(finished_run)
+    open(os.path.join(finished_run, "CopyComplete.txt"), "w").close()
+
+    dispatched = []
+    watcher = RunWatcher([data_dir], dispatched.append, poll_interval=60)
+    if watcher._inotify is None:
+        pytest.skip("inotify not available")
+    try:
+        # Runs that were already finished are left to the polling sweep
+        watcher.start()
+        assert watcher.poll_once(0.1) == set()
+
+        # A run is started, nothing to do yet
+        run_dir = os.path.join(data_dir, "20240202_LH00217_0044_A2255J2LT3")
+        os.makedirs(run_dir)
+        assert watcher.poll_once(0.1) == set()
+
+        # Sequencing finishes
+        open(os.path.join(run_dir, "CopyComplete.txt"), "w").close()
+        assert watcher.poll_once(1) == {run_dir}
+        assert dispatched == [run_dir]
+
+        # Sub-demultiplexing finishes, its folders have to be followed down
+        stats_dir = os.path.join(run_dir, "Demultiplexing_0", "Reports", "legacy")
+        os.makedirs(stats_dir)
+        assert watcher.poll_once(0.1) == set()
+        os.makedirs(os.path.join(stats_dir, "Stats"))
+        open(os.path.join(stats_dir, "Stats", "DemultiplexingStats.xml"), "w").close()
+        assert watcher.poll_once(1) == {run_dir}
+
+        # Unrelated files are ignored
+        open(os.path.join(run_dir, "SampleSheet.csv"), "w").close()
+        assert watcher.poll_once(0.1) == set()
+        assert watcher._run_dirs() == [finished_run, run_dir]
+    finally:
+        watcher.close()
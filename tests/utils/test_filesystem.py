@@ -0,0 +1,18 @@
+import os
+
+from taca.utils.filesystem import lock_file
+
+
+def test_lock_file(create_dirs):
+    tmp = create_dirs
+    lock_path = os.path.join(tmp.name, "log", "locks", "run.lock")
+
+    with lock_file(lock_path) as locked:
+        assert locked
+        # A second holder is refused while the first one is active
+        with lock_file(lock_path) as locked_again:
+            assert not locked_again
+
+    # Released on exit
+    with lock_file(lock_path) as locked:
+        assert locked
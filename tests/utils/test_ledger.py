@@ -0,0 +1,60 @@
+import os
+import sqlite3
+
+from taca.utils.ledger import TransferLedger
+
+
+def test_transfer_ledger(create_dirs):
+    tmp = create_dirs
+    transfer_log = os.path.join(tmp.name, "log", "transfer.tsv")
+    with open(transfer_log, "w") as f:
+        f.write("20240202_LH00217_0044_A2255J2LT3\t2024-02-04 10:00:00.000000\r\n")
+
+    # Existing TSV rows are imported
+    ledger = TransferLedger(transfer_log)
+    assert os.path.exists(os.path.join(tmp.name, "log", "transfer.sqlite"))
+    assert ledger.is_transferred("20240202_LH00217_0044_A2255J2LT3")
+    # Exact matches only, no partial run names
+    assert not ledger.is_transferred("20240202_LH00217_0044_A2255J2LT")
+
+    # Records are appended to both the TSV and the database
+    ledger.record("20240203_LH00217_0045_B2255J2LT4", "2024-02-05 10:00:00.000000")
+    assert TransferLedger(transfer_log).is_transferred(
+        "20240203_LH00217_0045_B2255J2LT4"
+    )
+    with open(transfer_log) as f:
+        assert f.read().count("\n") == 2
+
+    # Rows appended to the TSV by someone else are picked up
+    with open(transfer_log, "a") as f:
+        f.write("20240204_LH00217_0046_A2255J2LT5\t2024-02-06 10:00:00.000000\r\n")
+    assert ledger.is_transferred("20240204_LH00217_0046_A2255J2LT5")
+    assert [row[0] for row in ledger.query("%_A2255J2LT_")] == [
+        "20240202_LH00217_0044_A2255J2LT3",
+        "20240204_LH00217_0046_A2255J2LT5",
+    ]
+
+    # A replaced TSV is re-imported from scratch
+    with open(transfer_log, "w") as f:
+        f.write("20240205_LH00217_0047_A2255J2LT6\t2024-02-07 10:00:00.000000\r\n")
+    assert not ledger.is_transferred("20240202_LH00217_0044_A2255J2LT3")
+    assert ledger.is_transferred("20240205_LH00217_0047_A2255J2LT6")
+
+    # A run removed to be transferred again, with rows appended since
+    with open(transfer_log, "w") as f:
+        f.write("20240206_LH00217_0048_A2255J2LT7\t2024-02-08 10:00:00.000000\r\n")
+        f.write("20240207_LH00217_0049_A2255J2LT8\t2024-02-09 10:00:00.000000\r\n")
+    assert not ledger.is_transferred("20240205_LH00217_0047_A2255J2LT6")
+    assert ledger.is_transferred("20240207_LH00217_0049_A2255J2LT8")
+
+    # Lookups of an unchanged TSV do not wait for the write lock
+    writer = sqlite3.connect(ledger.db_path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        assert TransferLedger(transfer_log).is_transferred(
+            "20240206_LH00217_0048_A2255J2LT7"
+        )
+        assert len(ledger.query()) == 2
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()